@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Auditoria write-behind: eventos em fila, gravados em lote por uma thread.
+
+Com AUDIT_MODE=async a requisição não escreve em audit_log / AuditLog:
+submit() põe o evento em uma fila limitada e o flusher grava lotes de até
+AUDIT_BATCH_SIZE eventos (ou o que chegou em AUDIT_FLUSH_INTERVAL segundos)
+em uma conexão persistente — COPY no PostgreSQL, INSERT multi-linha no SQL
+Server. O horário do evento é o da requisição, não o do flush.
+
+Durabilidade:
+    - fila cheia: AUDIT_QUEUE_FULL=block segura a requisição até abrir
+      espaço (backpressure); "drop" descarta o evento e conta
+    - lote que falha fica pendente e é regravado no próximo flush; enquanto
+      isso a fila enche e a política acima decide
+    - no encerramento (close / atexit) a fila é drenada e gravada; eventos
+      ainda em memória num kill -9 se perdem
+
+Configuração:
+    AUDIT_MODE             "sync" (default, INSERT na requisição) ou "async"
+    AUDIT_QUEUE_SIZE       eventos na fila (default 10000)
+    AUDIT_BATCH_SIZE       eventos por flush (default 500)
+    AUDIT_FLUSH_INTERVAL   espera máxima de um evento na fila em segundos (default 1)
+    AUDIT_QUEUE_FULL       "block" (default) ou "drop"
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime, timezone
+
+import service_metrics
+from batch_logger import announce, log_error
+
+AUDIT_MODE = os.getenv("AUDIT_MODE", "sync")
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", 10000))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 1))
+AUDIT_QUEUE_FULL = os.getenv("AUDIT_QUEUE_FULL", "block")
+
+PG_COPY_SQL = """
+    COPY audit_log (entity_type, entity_id, action, user_service, changes, created_at) FROM STDIN
+"""
+
+SQLSERVER_INSERT_SQL = """
+    INSERT INTO AuditLog (EntityType, EntityID, Action, UserService, Changes, CreatedAt)
+    VALUES {values}
+"""
+
+# Limite de 2100 parâmetros por statement no SQL Server: 300 linhas × 6 colunas
+_SQLSERVER_ROWS = 300
+
+FLUSH_SERVICE = "Audit Flush"
+
+
+def _copy_field(value):
+    """Campo no formato texto do COPY (\\N para NULL, escapes de tab/quebra de linha)."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _flush_postgres(conn, batch):
+    buffer = io.StringIO()
+    for entity_type, entity_id, action, user_service, changes, ts in batch:
+        row = (entity_type, entity_id, action, user_service, changes,
+               datetime.fromtimestamp(ts, timezone.utc).isoformat())
+        buffer.write("\t".join(_copy_field(value) for value in row) + "\n")
+    buffer.seek(0)
+    cursor = conn.cursor()
+    try:
+        cursor.copy_expert(PG_COPY_SQL, buffer)
+    finally:
+        cursor.close()
+
+
+def _flush_sqlserver(conn, batch):
+    cursor = conn.cursor()
+    try:
+        for i in range(0, len(batch), _SQLSERVER_ROWS):
+            rows = batch[i:i + _SQLSERVER_ROWS]
+            params = []
+            for entity_type, entity_id, action, user_service, changes, ts in rows:
+                # CreatedAt é DATETIME2 com GETDATE(): horário local, sem fuso
+                params += [entity_type, entity_id, action, user_service, changes, datetime.fromtimestamp(ts)]
+            cursor.execute(SQLSERVER_INSERT_SQL.format(values=", ".join(["(?, ?, ?, ?, ?, ?)"] * len(rows))),
+                           params)
+    finally:
+        cursor.close()
+
+
+DIALECTS = {
+    "postgres": _flush_postgres,
+    "sqlserver": _flush_sqlserver,
+}
+
+
+class AuditWriter:
+    """Fila limitada de eventos de auditoria com flush em lote em background."""
+
+    def __init__(self, dialect, connect, mode=AUDIT_MODE, queue_size=AUDIT_QUEUE_SIZE,
+                 batch_size=AUDIT_BATCH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL, on_full=AUDIT_QUEUE_FULL):
+        self.flush = DIALECTS[dialect]
+        self.connect = connect
+        self.enabled = mode == "async"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_full = on_full
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.batches = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.connect()
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def submit(self, entity_type, entity_id, action, user_service, changes=None):
+        """Enfileira um evento; False se foi descartado (fila cheia com AUDIT_QUEUE_FULL=drop)."""
+        event = (entity_type, entity_id, action, user_service,
+                 json.dumps(changes, default=str) if changes is not None else None, time.time())
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            if self.on_full == "drop":
+                with self._lock:
+                    self.dropped += 1
+                return False
+            started = time.perf_counter()
+            self.queue.put(event)
+            with self._lock:
+                self.blocked += 1
+                self.blocked_seconds += time.perf_counter() - started
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _collect(self, wait=True):
+        """Lote pendente + eventos da fila, até batch_size ou o fim do flush_interval."""
+        batch, self._pending = self._pending, []
+        deadline = time.monotonic() + (self.flush_interval if wait else 0)
+        while len(batch) < self.batch_size:
+            try:
+                timeout = deadline - time.monotonic()
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Grava o lote em uma transação; se falhar, o lote fica pendente."""
+        started = time.perf_counter()
+        try:
+            conn = self._connection()
+            self.flush(conn, batch)
+            conn.commit()
+        except Exception as e:
+            service_metrics.record(FLUSH_SERVICE, time.perf_counter() - started, ok=False)
+            log_error("AUDIT", f"Falha gravando {len(batch)} eventos (ficam pendentes): {e}")
+            self._disconnect()
+            self._pending = batch
+            with self._lock:
+                self.failures += 1
+            return False
+        service_metrics.record(FLUSH_SERVICE, time.perf_counter() - started)
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+        return True
+
+    def run(self):
+        while not self._stop.is_set():
+            with self._flush_lock:
+                batch = self._collect()
+                ok = self._write(batch) if batch else True
+            if not ok:
+                self._stop.wait(min(self.flush_interval * 2, 5.0))
+
+    def drain(self):
+        """Grava tudo o que está na fila e pendente; False se algum lote falhou."""
+        with self._flush_lock:
+            while True:
+                batch = self._collect(wait=False)
+                if not batch:
+                    return True
+                if not self._write(batch):
+                    return False
+
+    def summary(self):
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "written": self.written,
+                "dropped": self.dropped,
+                "blocked": self.blocked,
+                "blocked_ms": round(self.blocked_seconds * 1000, 1),
+                "batches": self.batches,
+                "failures": self.failures,
+                "queued": self.queue.qsize() + len(self._pending),
+            }
+
+    def close(self, timeout=10.0):
+        """Para o flusher e drena a fila (chamado também no atexit)."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.drain()
+        self._disconnect()
+        s = self.summary()
+        announce("AUDIT", f"📝 Auditoria: {s['written']}/{s['submitted']} eventos gravados em {s['batches']} lotes, "
+                          f"{s['dropped']} descartados, {s['blocked']} bloqueios ({s['blocked_ms']}ms), "
+                          f"{s['queued']} não gravados")
+
+    def start(self):
+        """Inicia o flusher se AUDIT_MODE=async."""
+        if not self.enabled:
+            return False
+        self._thread = threading.Thread(target=self.run, daemon=True, name="AuditWriter")
+        self._thread.start()
+        announce("AUDIT", f"Auditoria write-behind: lotes de até {self.batch_size} a cada "
+                          f"{self.flush_interval:.1f}s, fila {self.queue.maxsize} ({self.on_full} quando cheia)")
+        # Depois do announce: o atexit do batch_logger roda depois deste (LIFO) e imprime o resumo
+        atexit.register(self.close)
+        return True
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Logging não-bloqueante para os serviços do simulador.
+
+O hot path (log/log_error) apenas faz append em um deque — operação atômica
+sob o GIL, sem lock explícito nem formatação. Uma thread de background drena
+a fila em lotes, formata timestamps e escreve tudo em um único write().
+
+Modos (LOG_MODE):
+    lines    → uma linha por operação (comportamento original, em lote)
+    summary  → a cada LOG_SUMMARY_INTERVAL segundos imprime contagem e taxa
+               por serviço (ops, erros e retries); erros e mensagens de
+               ciclo de vida continuam sendo impressos linha a linha
+    off      → descarta linhas de operação (erros continuam visíveis)
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+
+LOG_MODE = os.getenv("LOG_MODE", "lines")
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 0.2))
+LOG_SUMMARY_INTERVAL = float(os.getenv("LOG_SUMMARY_INTERVAL", 10))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 100000))
+
+# Tipos de evento na fila
+_OP = 0
+_ERROR = 1
+_INFO = 2
+_RETRY = 3
+
+# Quando cheia, o deque descarta as entradas mais antigas (nunca bloqueia)
+_queue = deque(maxlen=LOG_QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def log(service, message):
+    """Registra uma operação do serviço (hot path)."""
+    if _writer is None:
+        _start()
+    _queue.append((_OP, time.time(), service, message))
+
+
+def log_error(service, message):
+    """Registra um erro — sempre impresso, contado no resumo."""
+    if _writer is None:
+        _start()
+    _queue.append((_ERROR, time.time(), service, message))
+
+
+def log_retry(service, message):
+    """Registra um retry — contado à parte no resumo."""
+    if _writer is None:
+        _start()
+    _queue.append((_RETRY, time.time(), service, message))
+
+
+def announce(service, message):
+    """Mensagens de ciclo de vida (início, problemas ativados...) — sempre impressas."""
+    if _writer is None:
+        _start()
+    _queue.append((_INFO, time.time(), service, message))
+
+
+def flush():
+    """Drena a fila imediatamente (usado no encerramento)."""
+    _drain()
+
+
+def _start():
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            return
+        _writer = threading.Thread(target=_writer_loop, daemon=True, name="LogWriter")
+        _writer.start()
+        atexit.register(_shutdown)
+
+
+def _shutdown():
+    _stop.set()
+    _drain()
+    if LOG_MODE == "summary" and (_summary.ops or _summary.errors or _summary.retries):
+        _summary.emit(time.time())
+
+
+class _Summary:
+    """Contagem por serviço acumulada pela thread de escrita."""
+
+    def __init__(self):
+        self.ops = {}
+        self.errors = {}
+        self.retries = {}
+        self.totals = {}
+        self.window_start = time.time()
+
+    def add(self, kind, service):
+        target = {_ERROR: self.errors, _RETRY: self.retries}.get(kind, self.ops)
+        target[service] = target.get(service, 0) + 1
+
+    def emit(self, now):
+        elapsed = max(now - self.window_start, 1e-9)
+        services = sorted(set(self.ops) | set(self.errors) | set(self.retries))
+        ts = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+        lines = [f"[{ts}] [SUMMARY] janela de {elapsed:.1f}s"]
+        for service in services:
+            ops = self.ops.get(service, 0)
+            errors = self.errors.get(service, 0)
+            retries = self.retries.get(service, 0)
+            total = self.totals.get(service, 0) + ops
+            self.totals[service] = total
+            lines.append(
+                f"    {service:<28} ops={ops:<6} {ops / elapsed:>8.2f}/s  "
+                f"erros={errors:<4} retries={retries:<4} total={total}"
+            )
+        if not services:
+            lines.append("    (nenhuma operação na janela)")
+        _write(lines)
+        self.ops.clear()
+        self.errors.clear()
+        self.retries.clear()
+        self.window_start = now
+
+
+_summary = _Summary()
+_ts_cache = [0, ""]
+
+
+def _format_ts(ts):
+    """Formata o timestamp reaproveitando a string enquanto o segundo não muda."""
+    second = int(ts)
+    if second != _ts_cache[0]:
+        _ts_cache[0] = second
+        _ts_cache[1] = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+    return _ts_cache[1]
+
+
+def _write(lines):
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+
+def _drain():
+    lines = []
+    popleft = _queue.popleft
+    while True:
+        try:
+            kind, ts, service, message = popleft()
+        except IndexError:
+            break
+        if LOG_MODE == "summary" and kind != _INFO:
+            _summary.add(kind, service)
+            if kind in (_OP, _RETRY):
+                continue
+        elif LOG_MODE == "off" and kind in (_OP, _RETRY):
+            continue
+        lines.append(f"[{_format_ts(ts)}] [{service}] {message}")
+    _write(lines)
+
+
+def _writer_loop():
+    while not _stop.wait(LOG_FLUSH_INTERVAL):
+        _drain()
+        if LOG_MODE == "summary":
+            now = time.time()
+            if now - _summary.window_start >= LOG_SUMMARY_INTERVAL:
+                _summary.emit(now)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Limite adaptativo de concorrência no cliente (AIMD / gradiente), por serviço
+e para o processo inteiro.
+
+Cada operação passa por call_with_limit(serviço, func): se o serviço ou o
+processo já têm `limit` operações em voo, a operação é rejeitada na hora
+(LimitExceeded, classe "rejected") em vez de empilhar carga no banco. Ao
+terminar, a latência é comparada com a latência de referência do serviço
+e o limite é ajustado. A referência aproxima a latência sem carga: desce
+rápido quando a latência cai e sobe devagar (média móvel por tempo, janela
+de LIMIT_BASELINE_WINDOW segundos) — uma degradação longa vira o novo normal.
+
+    aimd       latência > LIMIT_TOLERANCE × referência, ou erro de contenção
+               (deadlock, lock_timeout, serialization, connection) →
+               limite × LIMIT_BACKOFF, no máximo uma vez por latência
+               observada (como o TCP, uma redução por RTT); senão +1 a
+               cada `limit` sucessos
+    gradient   limite × clamp(LIMIT_TOLERANCE / razão, 0.5, 1) + √limite,
+               suavizado — encolhe na proporção em que a latência sobe
+
+O limite do processo recebe os mesmos sinais (a razão latência/referência
+de cada serviço, que é comparável entre serviços de latências diferentes).
+Erros de lógica não mexem no limite; rejeições não entram na conta.
+
+Configuração:
+    CONCURRENCY_LIMIT       "off" (default), "aimd" ou "gradient"
+    LIMIT_INITIAL           limite inicial por serviço (default 4)
+    LIMIT_MIN / LIMIT_MAX   faixa do limite por serviço (default 1 / 64)
+    LIMIT_GLOBAL_INITIAL    limite inicial do processo (default 16)
+    LIMIT_GLOBAL_MAX        teto do limite do processo (default 256)
+    LIMIT_TOLERANCE         razão latência/referência tolerada (default 2.0)
+    LIMIT_BACKOFF           fator de redução do AIMD (default 0.9)
+    LIMIT_BASELINE_WINDOW   janela em segundos para a referência subir (default 60)
+    LIMIT_REPORT_INTERVAL   intervalo do resumo no log em segundos (default 30)
+    LIMIT_FILE              arquivo JSON lines com limite, em voo e rejeições
+"""
+
+import os
+import json
+import math
+import time
+import threading
+
+from batch_logger import announce
+from retry_policy import error_class_of, REJECTED, DEADLOCK, LOCK_TIMEOUT, SERIALIZATION, CONNECTION
+
+CONCURRENCY_LIMIT = os.getenv("CONCURRENCY_LIMIT", "off")
+LIMIT_INITIAL = float(os.getenv("LIMIT_INITIAL", 4))
+LIMIT_MIN = float(os.getenv("LIMIT_MIN", 1))
+LIMIT_MAX = float(os.getenv("LIMIT_MAX", 64))
+LIMIT_GLOBAL_INITIAL = float(os.getenv("LIMIT_GLOBAL_INITIAL", 16))
+LIMIT_GLOBAL_MAX = float(os.getenv("LIMIT_GLOBAL_MAX", 256))
+LIMIT_TOLERANCE = float(os.getenv("LIMIT_TOLERANCE", 2.0))
+LIMIT_BACKOFF = float(os.getenv("LIMIT_BACKOFF", 0.9))
+LIMIT_BASELINE_WINDOW = float(os.getenv("LIMIT_BASELINE_WINDOW", 60))
+LIMIT_REPORT_INTERVAL = float(os.getenv("LIMIT_REPORT_INTERVAL", 30))
+LIMIT_FILE = os.getenv("LIMIT_FILE", "")
+
+PROCESS = "(processo)"
+
+# Erros que indicam banco sobrecarregado
+_CONGESTION = (DEADLOCK, LOCK_TIMEOUT, SERIALIZATION, CONNECTION)
+
+# Peso de cada amostra quando a latência cai abaixo da referência
+_BASELINE_DOWN = 0.1
+# Suavização do algoritmo de gradiente
+_GRADIENT_SMOOTHING = 0.2
+
+
+class LimitExceeded(Exception):
+    """Operação rejeitada: o serviço (ou o processo) está no limite de concorrência."""
+
+    error_class = REJECTED
+
+    def __init__(self, name, limit):
+        super().__init__(f"limite de concorrência de {name} atingido ({limit})")
+
+
+class AdaptiveLimit:
+    """Limite de operações em voo ajustado por AIMD ou gradiente."""
+
+    def __init__(self, name, algorithm=CONCURRENCY_LIMIT, initial=LIMIT_INITIAL,
+                 minimum=LIMIT_MIN, maximum=LIMIT_MAX, tolerance=LIMIT_TOLERANCE, backoff=LIMIT_BACKOFF,
+                 baseline_window=LIMIT_BASELINE_WINDOW):
+        self.name = name
+        self.algorithm = algorithm
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.baseline_window = baseline_window
+        self.baseline = None
+        self._baseline_updated = None
+        self._last_drop = 0.0
+        self.in_flight = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.drops = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= max(1, int(self.limit)):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.accepted += 1
+            return True
+
+    def cancel(self):
+        """Devolve a vaga sem sinal (o outro limite rejeitou)."""
+        with self._lock:
+            self.in_flight -= 1
+            self.accepted -= 1
+            self.rejected += 1
+
+    def ratio(self, latency):
+        """Latência / referência do serviço; atualiza a referência."""
+        now = time.monotonic()
+        with self._lock:
+            if self.baseline is None:
+                self.baseline, self._baseline_updated = latency, now
+            ratio = latency / self.baseline if self.baseline > 0 else 1.0
+            if latency < self.baseline:
+                weight = _BASELINE_DOWN
+            else:
+                weight = 1.0 - math.exp(-(now - self._baseline_updated) / self.baseline_window)
+            self.baseline += weight * (latency - self.baseline)
+            self._baseline_updated = now
+            return ratio
+
+    def release(self, ratio=None, congested=False, latency=0.0):
+        """Fim da operação: ajusta o limite (ratio None → só libera a vaga)."""
+        now = time.monotonic()
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            if ratio is None and not congested:
+                return
+            if self.algorithm == "gradient":
+                gradient = 0.5 if congested else max(0.5, min(1.0, self.tolerance / max(ratio, 1e-9)))
+                if gradient < 1.0:
+                    self.drops += 1
+                target = self.limit * gradient + math.sqrt(self.limit)
+                limit = self.limit + _GRADIENT_SMOOTHING * (target - self.limit)
+            elif congested or ratio > self.tolerance:
+                if now - self._last_drop < latency:
+                    return
+                self._last_drop = now
+                self.drops += 1
+                limit = self.limit * self.backoff
+            elif in_flight * 2 >= self.limit:
+                # Só cresce quando o limite está sendo usado
+                limit = self.limit + 1.0 / self.limit
+            else:
+                limit = self.limit
+            self.limit = max(self.minimum, min(self.maximum, limit))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "drops": self.drops,
+                "baseline_ms": round(self.baseline * 1000, 2) if self.baseline is not None else None,
+            }
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+_process = AdaptiveLimit(PROCESS, initial=LIMIT_GLOBAL_INITIAL, maximum=LIMIT_GLOBAL_MAX)
+
+
+def enabled():
+    return CONCURRENCY_LIMIT in ("aimd", "gradient")
+
+
+def _limit(service):
+    limit = _limits.get(service)
+    if limit is None:
+        with _limits_lock:
+            limit = _limits.setdefault(service, AdaptiveLimit(service))
+    return limit
+
+
+def call_with_limit(service, func, *args, **kwargs):
+    """Executa func dentro do limite do serviço e do processo; LimitExceeded se não há vaga."""
+    if not enabled():
+        return func(*args, **kwargs)
+    limit = _limit(service)
+    if not limit.try_acquire():
+        raise LimitExceeded(service, int(limit.limit))
+    if not _process.try_acquire():
+        limit.cancel()
+        raise LimitExceeded(PROCESS, int(_process.limit))
+
+    started = time.perf_counter()
+    ratio, congested = None, False
+    try:
+        result = func(*args, **kwargs)
+        ratio = limit.ratio(time.perf_counter() - started)
+        return result
+    except Exception as e:
+        congested = error_class_of(e) in _CONGESTION
+        raise
+    finally:
+        latency = time.perf_counter() - started
+        limit.release(ratio, congested, latency)
+        _process.release(ratio, congested, latency)
+
+
+def snapshot():
+    """Limite, em voo, aceitas, rejeitadas e reduções por serviço e do processo."""
+    with _limits_lock:
+        limits = dict(_limits)
+    result = {service: limit.snapshot() for service, limit in sorted(limits.items())}
+    result[PROCESS] = _process.snapshot()
+    return result
+
+
+def report(path=LIMIT_FILE):
+    current = snapshot()
+    if path:
+        with open(path, "a", encoding="utf-8") as out:
+            out.write(json.dumps({"ts": round(time.time(), 3), "limits": current}, ensure_ascii=False) + "\n")
+    lines = [f"🚦 Limite de concorrência ({CONCURRENCY_LIMIT})"]
+    for name, s in current.items():
+        lines.append(f"    {name:<28} limite {s['limit']:>6.1f}  em voo {s['in_flight']:>3}  "
+                     f"aceitas {s['accepted']:>7}  rejeitadas {s['rejected']:>6}  reduções {s['drops']:>5}")
+    announce("LIMIT", "\n".join(lines))
+
+
+def _report_loop(interval):
+    while True:
+        time.sleep(interval)
+        report()
+
+
+def start_report(interval=LIMIT_REPORT_INTERVAL):
+    """Resumo periódico dos limites se CONCURRENCY_LIMIT estiver ligado."""
+    if not enabled():
+        return False
+    threading.Thread(target=_report_loop, args=(interval,), daemon=True, name="LimitReport").start()
+    announce("LIMIT", f"Limite adaptativo de concorrência: {CONCURRENCY_LIMIT} "
+                      f"(inicial {LIMIT_INITIAL:.0f}/serviço, {LIMIT_GLOBAL_INITIAL:.0f}/processo, "
+                      f"tolerância {LIMIT_TOLERANCE}×)")
+    return True
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Backend DB-API em memória, para medir o teto de throughput do cliente.
+
+Com DB_BACKEND=fake o simulador roda sem banco: install() troca o connect()
+do driver (psycopg2 / pyodbc) antes do patch do ddtrace, então pool,
+roteamento, ddtrace, logging e threads continuam no caminho — só o servidor
+some. Cada execute aceita qualquer statement e devolve um resultado com a
+forma esperada: o número de colunas vem da lista do SELECT / RETURNING /
+OUTPUT, o de linhas de TOP / LIMIT (ou FAKE_DB_ROWS), e a latência injetada
+é dormida com o GIL liberado, como uma ida ao servidor.
+
+Resultados específicos podem ser fixados em FAKE_DB_RESULTS (JSON):
+    [{"match": "FROM customers", "rows": [[1, "00000000001", 700]], "latency_ms": 2}]
+"match" é um trecho do SQL (sem diferenciar maiúsculas); a primeira regra
+que casar vale.
+
+Configuração:
+    DB_BACKEND            "fake" liga o backend em memória (default: banco real)
+    FAKE_DB_LATENCY_MS    latência injetada por execute em ms (default 1)
+    FAKE_DB_JITTER        variação relativa da latência, ±fração (default 0.5)
+    FAKE_DB_ROWS          linhas de um SELECT sem TOP/LIMIT (default 20)
+    FAKE_DB_RESULTS       arquivo JSON com resultados fixos
+
+Benchmark do cliente (ops/s e CPU por operação, sem serviços rodando):
+    python fake_db.py <módulo>:<operações> [threads] [segundos]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import importlib
+import threading
+from functools import lru_cache
+
+import service_metrics
+
+DB_BACKEND = os.getenv("DB_BACKEND", "")
+FAKE_DB_LATENCY_MS = float(os.getenv("FAKE_DB_LATENCY_MS", 1))
+FAKE_DB_JITTER = float(os.getenv("FAKE_DB_JITTER", 0.5))
+FAKE_DB_ROWS = int(os.getenv("FAKE_DB_ROWS", 20))
+FAKE_DB_RESULTS = os.getenv("FAKE_DB_RESULTS", "")
+
+_COMMENT = re.compile(r"/\*.*?\*/|--[^\n]*", re.DOTALL)
+_STRING = re.compile(r"N?'(?:[^']|'')*'")
+_TOP_PAREN = re.compile(r"\btop\s*\(\s*([^()]*?)\s*\)")
+_LIMIT = re.compile(r"\b(?:top|limit)\s+(\d+)\b")
+_AGGREGATE = re.compile(r"^(count|sum|avg|min|max)\s*\(")
+_DRIVERS = {"psycopg2", "pyodbc"}
+
+_rules = []
+
+
+def register(match, rows, latency_ms=None):
+    """Fixa o resultado (e opcionalmente a latência) dos statements que contêm `match`."""
+    _rules.append((match.lower(), [tuple(row) for row in rows], latency_ms))
+
+
+def load_rules(path=FAKE_DB_RESULTS):
+    if not path:
+        return
+    with open(path, encoding="utf-8") as f:
+        for rule in json.load(f):
+            register(rule["match"], rule.get("rows", []), rule.get("latency_ms"))
+
+
+# ── Forma do resultado ────────────────────────────────────────
+def _top_level(sql):
+    """Texto fora de parênteses (conteúdo trocado por '()'), para achar cláusulas e vírgulas."""
+    out, depth = [], 0
+    for char in sql:
+        if char == "(":
+            if depth == 0:
+                out.append("()")
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            out.append(char)
+    return "".join(out)
+
+
+def _count_columns(projection):
+    return len([item for item in projection.split(",") if item.strip()])
+
+
+def _statement_shape(statement):
+    """(colunas, linhas) do result set do statement, ou None se não devolve linhas."""
+    top = _top_level(_TOP_PAREN.sub(r"top \1", statement)).strip()
+    words = top.split()
+    if not words:
+        return None
+    keyword = words[0]
+    if keyword == "with":
+        # CTE: o statement principal vem depois das definições
+        main = re.search(r"\b(select|insert|update|delete|merge)\b", top)
+        keyword = main.group(1) if main else ""
+    if keyword in ("exec", "execute", "call", "{call"):
+        return 1, 1
+
+    limit = _LIMIT.search(top)
+    rows = int(limit.group(1)) if limit else FAKE_DB_ROWS
+    if keyword in ("insert", "update", "delete", "merge"):
+        returning = re.search(r"\breturning\b(.*)$", top)
+        if returning:
+            return _count_columns(returning.group(1)), 1
+        output = re.search(r"\boutput\b(.*?)(\binto\b|\bfrom\b|\bwhere\b|\bselect\b|\bvalues\b|$)", top)
+        if output and output.group(2) != "into":
+            return _count_columns(output.group(1)), rows
+        return None
+    if keyword != "select":
+        return None
+
+    projection = re.search(r"\bselect\b(.*?)(\bfrom\b|$)", top).group(1)
+    projection = re.sub(r"^\s*(distinct\s+)?(top\s+\S+\s+)?", "", projection)
+    if " from " not in f" {top} ":
+        rows = 1
+    elif "group by" not in top and all(_AGGREGATE.match(item.strip()) for item in projection.split(",")):
+        rows = 1
+    return _count_columns(projection), rows
+
+
+@lru_cache(maxsize=1024)
+def shape(sql):
+    """(colunas, linhas) do primeiro result set do batch, ou None."""
+    text = " ".join(_STRING.sub("''", _COMMENT.sub(" ", sql)).lower().split())
+    for statement in text.split(";"):
+        result = _statement_shape(statement)
+        if result is not None:
+            return result
+    return None
+
+
+def _matching_rule(sql):
+    lowered = sql.lower()
+    for match, rows, latency_ms in _rules:
+        if match in lowered:
+            return rows, latency_ms
+    return None
+
+
+# ── DB-API ────────────────────────────────────────────────────
+class _Info:
+    # psycopg2.extensions.TRANSACTION_STATUS_IDLE: o pool devolve a conexão sem rollback
+    transaction_status = 0
+
+
+class FakeCursor:
+    arraysize = 1
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+        self._position = 0
+
+    def execute(self, sql, params=None, *args):
+        sql = sql if isinstance(sql, str) else str(sql)
+        rule = _matching_rule(sql) if _rules else None
+        latency_ms = FAKE_DB_LATENCY_MS
+        if rule is not None:
+            rows, rule_latency = rule
+            if rule_latency is not None:
+                latency_ms = rule_latency
+            result = (len(rows[0]) if rows else 1, len(rows))
+        else:
+            result = shape(sql)
+            rows = []
+            if result is not None:
+                columns, count = result
+                # Table-valued parameter (lista de linhas): uma linha de resultado por item
+                tvp = [p for p in params if isinstance(p, list)] if isinstance(params, (list, tuple)) else []
+                if tvp:
+                    count = len(tvp[0])
+                rows = [tuple(i + j + 1 for j in range(columns)) for i in range(count)]
+
+        if latency_ms > 0:
+            jitter = random.uniform(1 - FAKE_DB_JITTER, 1 + FAKE_DB_JITTER) if FAKE_DB_JITTER else 1
+            time.sleep(latency_ms * jitter / 1000.0)
+
+        if result is None:
+            self.description = None
+            self.rowcount = 1
+        else:
+            self.description = [(f"col{j}", None, None, None, None, None, None) for j in range(result[0])]
+            self.rowcount = len(rows)
+        self._rows = rows
+        self._position = 0
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        for params in seq_of_params:
+            self.execute(sql, params)
+
+    def copy_expert(self, sql, file, size=8192):
+        """COPY ... FROM STDIN (psycopg2): consome o arquivo e dorme a latência de um execute."""
+        lines = sum(1 for _ in file)
+        self.execute("SELECT 1")
+        self.description = None
+        self.rowcount = lines
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def nextset(self):
+        return None
+
+    def close(self):
+        self._rows = []
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeConnection:
+    def __init__(self, dsn=""):
+        self.dsn = dsn
+        self.autocommit = False
+        self.closed = 0
+        self.info = _Info()
+
+    def cursor(self, name=None, *args, **kwargs):
+        return FakeCursor(self, name)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+    def get_transaction_status(self):
+        return _Info.transaction_status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def connect(*args, **kwargs):
+    """Substituto de psycopg2.connect / pyodbc.connect."""
+    dsn = args[0] if args and isinstance(args[0], str) else " ".join(f"{k}={v}" for k, v in kwargs.items())
+    return FakeConnection(dsn)
+
+
+def install(driver):
+    """Troca driver.connect pelo backend em memória; chamar antes do patch do ddtrace."""
+    driver.connect = connect
+    load_rules()
+
+
+# ── Benchmark do cliente ──────────────────────────────────────
+def benchmark(operations, threads=4, duration=10.0):
+    """Roda as operações em round-robin em `threads` threads; ops/s, latência e CPU por operação."""
+    names = list(operations)
+    cpu = {name: 0.0 for name in names}
+    cpu_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        spent = {name: 0.0 for name in names}
+        i = offset
+        while time.perf_counter() < deadline:
+            name = names[i % len(names)]
+            i += 1
+            started, cpu_started = time.perf_counter(), time.thread_time()
+            try:
+                operations[name]()
+                service_metrics.record(f"bench.{name}", time.perf_counter() - started)
+            except Exception:
+                service_metrics.record(f"bench.{name}", time.perf_counter() - started, ok=False)
+            spent[name] += time.thread_time() - cpu_started
+        with cpu_lock:
+            for name, seconds in spent.items():
+                cpu[name] += seconds
+
+    began, process_started = time.time(), time.process_time()
+    workers = [threading.Thread(target=worker, args=(i,), name=f"bench-{i}") for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall, process_cpu = time.time() - began, time.process_time() - process_started
+
+    stats = service_metrics.window(began, began + wall + 1)
+    print(f"── {threads} threads, {wall:.1f}s, latência injetada {FAKE_DB_LATENCY_MS}ms")
+    total_ops = 0
+    for name in names:
+        s = stats.get(f"bench.{name}", {"ops": 0, "errors": 0, "p50_ms": 0.0, "p95_ms": 0.0})
+        total_ops += s["ops"]
+        cpu_ms = cpu[name] * 1000 / s["ops"] if s["ops"] else 0.0
+        print(f"    {name:<22} {s['ops'] / wall:>9.1f} ops/s  p50 {s['p50_ms']:>7.2f}ms  "
+              f"p95 {s['p95_ms']:>7.2f}ms  CPU {cpu_ms:>6.3f}ms/op  erros {s['errors']}")
+    if total_ops:
+        print(f"    {'total':<22} {total_ops / wall:>9.1f} ops/s  "
+              f"CPU do processo {process_cpu * 1000 / total_ops:.3f}ms/op ({process_cpu / wall:.2f} cores)")
+
+
+def _operations(target):
+    """'modulo:ATRIBUTO' → {nome: callable}; aceita dict ou lista de (nome, func, ...)."""
+    module_name, attribute = target.split(":")
+    value = getattr(importlib.import_module(module_name), attribute)
+    if isinstance(value, dict):
+        return dict(value)
+    return {entry[0]: entry[1] for entry in value}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3, 4):
+        print("Uso: python fake_db.py <módulo>:<operações> [threads] [segundos]")
+        sys.exit(1)
+    # O driver precisa ser trocado antes do import do simulador (patch do ddtrace)
+    os.environ["DB_BACKEND"] = "fake"
+    for driver_name in _DRIVERS:
+        try:
+            install(importlib.import_module(driver_name))
+        except ImportError:
+            pass
+    benchmark(_operations(sys.argv[1]), *(int(a) for a in sys.argv[2:3]), *(float(a) for a in sys.argv[3:4]))
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Motor de incidentes programático.
+
+Executa os cenários de sql/ (blocking, deadlock, scans, slow query, CPU)
+dentro do próprio processo do simulador, em sessões persistentes — sem
+psql/sqlcmd por statement. Enquanto o incidente roda a carga normal dos
+serviços continua, e ao final o motor compara throughput e latência de
+cada serviço durante o incidente com a janela de baseline anterior.
+
+Disparo:
+    INCIDENT_SCHEDULE       "offset:cenario:duracao:concorrencia,..." (segundos
+                            a partir do início), ex: "120:seq_scan:60:2"
+    INCIDENT_TRIGGER_FILE   arquivo observado; escrever "cenario duracao
+                            concorrencia" nele dispara o incidente na hora
+"""
+
+import os
+import re
+import time
+import random
+import threading
+from collections import namedtuple
+
+import service_metrics
+from batch_logger import announce, log_error
+from retry_policy import classify, CONNECTION
+
+INCIDENT_SCHEDULE = os.getenv("INCIDENT_SCHEDULE", "")
+INCIDENT_TRIGGER_FILE = os.getenv("INCIDENT_TRIGGER_FILE", "")
+INCIDENT_BASELINE = float(os.getenv("INCIDENT_BASELINE", 30))
+INCIDENT_MAX_CONCURRENT = int(os.getenv("INCIDENT_MAX_CONCURRENT", 2))
+
+# mode: "loop" → executa o arquivo repetidamente em autocommit até o fim
+#       "hold" → executa uma vez em transação aberta e só faz rollback no fim
+Role = namedtuple("Role", ["file", "mode"])
+Scenario = namedtuple("Scenario", ["name", "roles", "pause"])
+
+_GO = re.compile(r"^\s*GO\s*;?\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def split_batches(script):
+    """Separa o script em batches pelo separador GO (T-SQL); sem GO, um batch só."""
+    return [batch.strip() for batch in _GO.split(script) if batch.strip()]
+
+
+def check_scenario(name, scenarios):
+    """ValueError se `scenarios` foi dado e não contém o cenário."""
+    if scenarios is not None and name not in scenarios:
+        raise ValueError(f"cenário desconhecido: {name} (opções: {', '.join(scenarios)})")
+
+
+def parse_schedule(spec, scenarios=None):
+    """'120:seq_scan:60:2,300:deadlock:30' → [(120.0, 'seq_scan', 60.0, 2), ...]
+
+    Entradas malformadas ou com cenário fora de `scenarios` vão para o log e
+    são ignoradas; as demais continuam agendadas.
+    """
+    entries = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            fields = item.split(":")
+            offset, name = float(fields[0]), fields[1]
+            duration = float(fields[2]) if len(fields) > 2 else 60.0
+            concurrency = int(fields[3]) if len(fields) > 3 else 1
+            check_scenario(name, scenarios)
+        except (ValueError, IndexError) as e:
+            log_error("INCIDENT", f"Entrada de INCIDENT_SCHEDULE ignorada ({item}): {e}")
+            continue
+        entries.append((offset, name, duration, concurrency))
+    return sorted(entries)
+
+
+def _consume(cursor):
+    """Lê todos os result sets — no pyodbc o batch só termina após nextset()."""
+    while True:
+        if cursor.description is not None:
+            cursor.fetchall()
+        try:
+            if not cursor.nextset():
+                break
+        except Exception:
+            # psycopg2 não suporta nextset()
+            break
+
+
+def _abort_transaction(conn):
+    """Descarta transação explícita (BEGIN no script) deixada aberta pelo erro."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("ROLLBACK")
+    except Exception:
+        pass
+    finally:
+        cursor.close()
+
+
+class IncidentEngine:
+    """Agenda e executa cenários de incidente com sessões reaproveitadas."""
+
+    def __init__(self, connect, sql_dir, scenarios, baseline=INCIDENT_BASELINE,
+                 max_concurrent=INCIDENT_MAX_CONCURRENT):
+        self.connect = connect
+        self.sql_dir = sql_dir
+        self.scenarios = {s.name: s for s in scenarios}
+        self.baseline = baseline
+        self.reports = []
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._scripts = {}
+        self._counters_lock = threading.Lock()
+
+    # ── Sessões persistentes ──────────────────────────────────
+    def _acquire(self, autocommit):
+        with self._idle_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self.connect()
+        conn.autocommit = autocommit
+        return conn
+
+    def _release(self, conn, healthy=True):
+        try:
+            if healthy:
+                conn.rollback()
+                with self._idle_lock:
+                    self._idle.append(conn)
+                return
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _batches(self, filename):
+        batches = self._scripts.get(filename)
+        if batches is None:
+            with open(os.path.join(self.sql_dir, filename), encoding="utf-8") as f:
+                batches = split_batches(f.read())
+            self._scripts[filename] = batches
+        return batches
+
+    def _execute(self, conn, filename):
+        cursor = conn.cursor()
+        try:
+            for batch in self._batches(filename):
+                cursor.execute(batch)
+                _consume(cursor)
+        finally:
+            cursor.close()
+
+    # ── Execução ──────────────────────────────────────────────
+    def _count(self, counters, key):
+        # Vários papéis/cópias incrementam o mesmo contador em threads diferentes
+        with self._counters_lock:
+            counters[key] += 1
+
+    def _session(self, scenario, role, stop, counters):
+        conn = self._acquire(autocommit=(role.mode == "loop"))
+        healthy = True
+        try:
+            if role.mode == "hold":
+                self._execute(conn, role.file)
+                self._count(counters, "executions")
+                stop.wait()
+                return
+            while not stop.is_set():
+                try:
+                    self._execute(conn, role.file)
+                    self._count(counters, "executions")
+                except Exception as e:
+                    # Vítima de deadlock/timeout é esperado em incidente
+                    self._count(counters, "errors")
+                    if classify(e) == CONNECTION or getattr(conn, "closed", False):
+                        healthy = False
+                        return
+                    _abort_transaction(conn)
+                stop.wait(scenario.pause * random.uniform(0.5, 1.5))
+        except Exception as e:
+            self._count(counters, "errors")
+            healthy = False
+            log_error("INCIDENT", f"[{scenario.name}] sessão {role.file}: {e}")
+        finally:
+            self._release(conn, healthy)
+
+    def run(self, name, duration=60, concurrency=1):
+        """Executa um incidente (bloqueante) e retorna o relatório de degradação."""
+        scenario = self.scenarios.get(name)
+        if scenario is None:
+            log_error("INCIDENT", f"Cenário desconhecido: {name} (disponíveis: {', '.join(self.scenarios)})")
+            return None
+
+        with self._slots:
+            stop = threading.Event()
+            counters = {"executions": 0, "errors": 0}
+            workers = []
+            for role in scenario.roles:
+                copies = 1 if role.mode == "hold" else max(1, concurrency)
+                for i in range(copies):
+                    workers.append(threading.Thread(
+                        target=self._session, args=(scenario, role, stop, counters),
+                        daemon=True, name=f"Incident-{name}-{i}",
+                    ))
+
+            announce("INCIDENT", f"⚠️  {name} iniciado ({duration:.0f}s, {len(workers)} sessões)")
+            started = time.time()
+            for worker in workers:
+                worker.start()
+            stop.wait(duration)
+            stop.set()
+            for worker in workers:
+                worker.join(timeout=30)
+            ended = time.time()
+
+        report = self.report(name, started, ended, counters)
+        self.reports.append(report)
+        return report
+
+    def trigger(self, name, duration=60, concurrency=1):
+        """Dispara o incidente em background."""
+        thread = threading.Thread(target=self.run, args=(name, duration, concurrency),
+                                  daemon=True, name=f"Incident-{name}")
+        thread.start()
+        return thread
+
+    def report(self, name, started, ended, counters):
+        before = service_metrics.window(started - self.baseline, started)
+        during = service_metrics.window(started, ended)
+
+        lines = [f"📉 {name}: {ended - started:.0f}s, "
+                 f"{counters['executions']} execuções, {counters['errors']} erros de sessão"]
+        services = {}
+        for service in sorted(set(before) | set(during)):
+            b = before.get(service) or {"ops_per_s": 0.0, "avg_ms": 0.0, "p95_ms": 0.0, "errors": 0, "retries": 0}
+            d = during.get(service) or {"ops_per_s": 0.0, "avg_ms": 0.0, "p95_ms": 0.0, "errors": 0, "retries": 0}
+            services[service] = {"baseline": b, "incident": d}
+            lines.append(
+                f"    {service:<28} ops/s {b['ops_per_s']:>7.2f} → {d['ops_per_s']:>7.2f} "
+                f"({_delta(b['ops_per_s'], d['ops_per_s'])})  "
+                f"avg {b['avg_ms']:>7.1f} → {d['avg_ms']:>7.1f}ms "
+                f"({_delta(b['avg_ms'], d['avg_ms'])})  "
+                f"p95 {b['p95_ms']:>7.1f} → {d['p95_ms']:>7.1f}ms  "
+                f"erros {b['errors']} → {d['errors']}  "
+                f"retries {b['retries']} → {d['retries']}"
+            )
+        announce("INCIDENT", "\n".join(lines))
+        return {"scenario": name, "started": started, "ended": ended,
+                "counters": dict(counters), "services": services}
+
+    # ── Agendamento ───────────────────────────────────────────
+    def run_schedule(self, schedule):
+        """Dispara cada entrada (offset, cenário, duração, concorrência) no seu horário."""
+        origin = time.time()
+        for offset, name, duration, concurrency in schedule:
+            time.sleep(max(0.0, origin + offset - time.time()))
+            self.trigger(name, duration, concurrency)
+
+    def watch_trigger_file(self, path, interval=1.0):
+        """Observa o arquivo de trigger; cada linha 'cenario [duracao] [concorrencia]' dispara."""
+        while True:
+            time.sleep(interval)
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    commands = f.read().splitlines()
+                os.remove(path)
+            except OSError as e:
+                log_error("INCIDENT", f"Falha lendo trigger {path}: {e}")
+                continue
+            for command in filter(None, (c.strip() for c in commands)):
+                try:
+                    fields = command.split()
+                    duration = float(fields[1]) if len(fields) > 1 else 60.0
+                    concurrency = int(fields[2]) if len(fields) > 2 else 1
+                    check_scenario(fields[0], self.scenarios)
+                except (ValueError, IndexError) as e:
+                    log_error("INCIDENT", f"Linha do trigger ignorada ({command}): {e}")
+                    continue
+                self.trigger(fields[0], duration, concurrency)
+
+    def start(self, schedule_spec=INCIDENT_SCHEDULE, trigger_file=INCIDENT_TRIGGER_FILE):
+        """Inicia agendamento e/ou trigger conforme configuração; retorna se algo foi ativado."""
+        active = False
+        if schedule_spec:
+            schedule = parse_schedule(schedule_spec, self.scenarios)
+            threading.Thread(target=self.run_schedule, args=(schedule,),
+                             daemon=True, name="IncidentSchedule").start()
+            active = True
+        if trigger_file:
+            threading.Thread(target=self.watch_trigger_file, args=(trigger_file,),
+                             daemon=True, name="IncidentTrigger").start()
+            active = True
+        if active:
+            announce("INCIDENT", f"Motor de incidentes ativo — cenários: {', '.join(self.scenarios)}")
+        return active
+
+
+def _delta(before, after):
+    if not before:
+        return "  n/a"
+    return f"{(after - before) / before * 100:+.0f}%"
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Amostragem de contenção de lock, com as cadeias de bloqueio atribuídas a serviços.
+
+A cada LOCK_SAMPLE_INTERVAL segundos (0.1–0.5s), em uma conexão persistente,
+o sampler lê quem espera lock e quem bloqueia: pg_stat_activity / pg_locks
+(pg_blocking_pids) no PostgreSQL, sys.dm_os_waiting_tasks / sys.dm_tran_locks
+no SQL Server. Sem ninguém esperando a amostra volta vazia e custa pouco.
+
+Cada sessão é atribuída a um serviço, nesta ordem:
+    1. fingerprint da query comparado com o SQL de cada serviço (query_fingerprint)
+    2. comentário DBM ddps='...' no texto da query
+    3. application_name / program_name da conexão
+O tempo entre amostras é somado por par (serviço que espera → serviço que
+bloqueia), por recurso de lock e por head blocker — a sessão na raiz da
+cadeia, que bloqueia sem estar esperando.
+
+Configuração:
+    LOCK_SAMPLE_INTERVAL   intervalo da amostragem em segundos (0 → desligado, default)
+    LOCK_REPORT_INTERVAL   intervalo do resumo no log em segundos (default 30)
+    LOCK_FILE              arquivo JSON lines com o acumulado a cada resumo
+"""
+
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+
+from batch_logger import log_error, announce
+from query_fingerprint import text_fingerprint, normalize
+from stats_collector import service_of as dbm_service_of
+
+LOCK_SAMPLE_INTERVAL = float(os.getenv("LOCK_SAMPLE_INTERVAL", 0))
+LOCK_REPORT_INTERVAL = float(os.getenv("LOCK_REPORT_INTERVAL", 30))
+LOCK_FILE = os.getenv("LOCK_FILE", "")
+
+# Uma linha por (sessão, bloqueador): sessões que esperam lock e as que as
+# bloqueiam (blocker NULL). pg_blocking_pids só roda para quem está esperando.
+PG_BLOCKING_QUERY = """
+    WITH waiting AS (
+        SELECT pid, unnest(pg_blocking_pids(pid)) AS blocker
+        FROM pg_stat_activity
+        WHERE wait_event_type = 'Lock' AND datname = current_database()
+    )
+    SELECT a.pid, w.blocker, a.application_name, LEFT(a.query, 2000),
+           (SELECT l.locktype || COALESCE(' ' || l.relation::regclass::text, '') || ' (' || l.mode || ')'
+            FROM pg_locks l
+            WHERE l.pid = a.pid AND NOT l.granted
+            LIMIT 1)
+    FROM pg_stat_activity a
+    LEFT JOIN waiting w ON w.pid = a.pid
+    WHERE a.pid IN (SELECT pid FROM waiting UNION SELECT blocker FROM waiting)
+"""
+
+# most_recent_sql_handle: statement atual de quem espera e o último de quem
+# bloqueia (mesmo idle, com a transação aberta)
+SQLSERVER_BLOCKING_QUERY = """
+    WITH waits AS (
+        SELECT DISTINCT session_id, blocking_session_id
+        FROM sys.dm_os_waiting_tasks
+        WHERE blocking_session_id IS NOT NULL
+          AND blocking_session_id <> session_id
+          AND wait_type LIKE 'LCK[_]%'
+    ),
+    sessions AS (
+        SELECT session_id FROM waits UNION SELECT blocking_session_id FROM waits
+    )
+    SELECT s.session_id, w.blocking_session_id, es.program_name, LEFT(t.text, 2000), l.resource
+    FROM sessions s
+    JOIN sys.dm_exec_sessions es ON es.session_id = s.session_id
+    LEFT JOIN waits w ON w.session_id = s.session_id
+    LEFT JOIN sys.dm_exec_connections c ON c.session_id = s.session_id
+    OUTER APPLY sys.dm_exec_sql_text(c.most_recent_sql_handle) t
+    OUTER APPLY (
+        SELECT TOP 1 tl.resource_type + ' '
+               + ISNULL(OBJECT_NAME(ISNULL(p.object_id, CASE WHEN tl.resource_type = 'OBJECT'
+                                                             THEN CAST(tl.resource_associated_entity_id AS INT) END),
+                                    tl.resource_database_id), '?')
+               + ' (' + tl.request_mode + ')' AS resource
+        FROM sys.dm_tran_locks tl
+        LEFT JOIN sys.partitions p
+               ON p.hobt_id = tl.resource_associated_entity_id
+              AND tl.resource_type IN ('KEY', 'PAGE', 'RID', 'HOBT')
+        WHERE tl.request_session_id = s.session_id AND tl.request_status = 'WAIT'
+    ) l
+"""
+
+DIALECTS = {
+    "postgres": PG_BLOCKING_QUERY,
+    "sqlserver": SQLSERVER_BLOCKING_QUERY,
+}
+
+# Esperas por transação (linha travada no PostgreSQL) não nomeiam a tabela:
+# o recurso leva a query de quem espera
+_TRANSACTION_LOCKS = ("transactionid", "virtualxid")
+
+DEADLOCK = "(ciclo / deadlock)"
+
+
+class LockSampler:
+    """Amostragem periódica de bloqueios, acumulando tempo de espera por serviço."""
+
+    def __init__(self, dialect, connect, services=None, interval=LOCK_SAMPLE_INTERVAL,
+                 report_interval=LOCK_REPORT_INTERVAL, path=LOCK_FILE):
+        self.query = DIALECTS[dialect]
+        self.connect = connect
+        # Texto SQL → serviço, indexado pelo fingerprint normalizado
+        self.services = {text_fingerprint(sql): service for sql, service in (services or {}).items()}
+        self.interval = interval
+        self.report_interval = report_interval
+        self.path = path
+        self.pairs = defaultdict(float)
+        self.resources = defaultdict(float)
+        self.heads = defaultdict(float)
+        self.samples = 0
+        self.blocked_samples = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._last = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.connect()
+            self._conn.autocommit = True
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def service_of(self, session, sessions):
+        app, text = sessions.get(session, ("", ""))
+        if text:
+            service = self.services.get(text_fingerprint(text)) or dbm_service_of(text)
+            if service:
+                return service
+        return app or f"sessão {session}"
+
+    @staticmethod
+    def _head(session, edges):
+        """Raiz da cadeia de quem espera; None se a cadeia fecha um ciclo."""
+        seen = set()
+        while session in edges:
+            if session in seen:
+                return None
+            seen.add(session)
+            session = min(edges[session][0])
+        return session
+
+    def sample(self):
+        """Lê os bloqueios atuais e acumula o tempo desde a amostra anterior."""
+        now = time.perf_counter()
+        # Depois de uma falha não credita o buraco inteiro
+        dt = min(now - self._last, 2 * self.interval) if self._last is not None else self.interval
+        self._last = now
+
+        cursor = self._connection().cursor()
+        try:
+            cursor.execute(self.query)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        sessions = {}
+        edges = {}
+        for session, blocker, app, text, resource in rows:
+            sessions.setdefault(session, ((app or "").strip(), text or ""))
+            if blocker is not None:
+                edge = edges.setdefault(session, (set(), resource or "?"))
+                edge[0].add(blocker)
+
+        with self._lock:
+            self.samples += 1
+            if not edges:
+                return 0
+            self.blocked_samples += 1
+            for waiter, (blockers, resource) in edges.items():
+                waiter_service = self.service_of(waiter, sessions)
+                # Vários bloqueadores (PostgreSQL): o tempo é dividido entre eles
+                share = dt / len(blockers)
+                for blocker in blockers:
+                    self.pairs[(waiter_service, self.service_of(blocker, sessions))] += share
+                if resource.startswith(_TRANSACTION_LOCKS):
+                    resource += " · " + normalize(sessions[waiter][1])[:80]
+                self.resources[resource] += dt
+                head = self._head(waiter, edges)
+                self.heads[self.service_of(head, sessions) if head is not None else DEADLOCK] += dt
+        return len(edges)
+
+    def summary(self, top=10):
+        """Acumulado: segundos de espera por par de serviços, recurso e head blocker."""
+        with self._lock:
+            pairs = sorted(self.pairs.items(), key=lambda item: item[1], reverse=True)[:top]
+            resources = sorted(self.resources.items(), key=lambda item: item[1], reverse=True)[:top]
+            heads = sorted(self.heads.items(), key=lambda item: item[1], reverse=True)[:top]
+            return {
+                "samples": self.samples,
+                "blocked_samples": self.blocked_samples,
+                "pairs": [[waiter, blocker, round(seconds, 3)] for (waiter, blocker), seconds in pairs],
+                "resources": [[resource, round(seconds, 3)] for resource, seconds in resources],
+                "heads": [[service, round(seconds, 3)] for service, seconds in heads],
+            }
+
+    def report(self):
+        summary = self.summary(top=5)
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as out:
+                out.write(json.dumps(dict(summary, ts=round(time.time(), 3)), ensure_ascii=False) + "\n")
+        if not summary["pairs"]:
+            return
+        lines = [f"🔒 Espera por lock acumulada ({summary['blocked_samples']}/{summary['samples']} amostras com bloqueio)"]
+        lines += [f"    {seconds:>8.1f}s  {waiter} ← {blocker}" for waiter, blocker, seconds in summary["pairs"]]
+        lines.append("  recursos:")
+        lines += [f"    {seconds:>8.1f}s  {resource}" for resource, seconds in summary["resources"]]
+        lines.append("  head blockers:")
+        lines += [f"    {seconds:>8.1f}s  {service}" for service, seconds in summary["heads"]]
+        announce("LOCKS", "\n".join(lines))
+
+    def run(self):
+        next_report = time.time() + self.report_interval
+        while True:
+            started = time.perf_counter()
+            try:
+                self.sample()
+            except Exception as e:
+                log_error("LOCKS", f"Falha na amostragem: {e}")
+                self._disconnect()
+            if time.time() >= next_report:
+                self.report()
+                next_report = time.time() + self.report_interval
+            time.sleep(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    def start(self):
+        """Inicia a amostragem em background se LOCK_SAMPLE_INTERVAL > 0."""
+        if not self.interval:
+            return False
+        threading.Thread(target=self.run, daemon=True, name="LockSampler").start()
+        announce("LOCKS", f"Amostrando bloqueios a cada {self.interval * 1000:.0f}ms "
+                          f"(resumo a cada {self.report_interval:.0f}s)")
+        return True
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Captura de planos de execução e detecção de regressão de plano.
+
+Os serviços registram (observe) a última query executada de cada resource —
+só uma atribuição em dicionário no hot path. A cada PLAN_INTERVAL segundos
+uma thread captura o plano estimado dessas queries em uma conexão
+persistente (EXPLAIN (FORMAT JSON, BUFFERS) no PostgreSQL, SHOWPLAN_XML no
+SQL Server) e reduz o plano a um fingerprint normalizado: só a forma da
+árvore (operadores, tabelas e índices), sem custos nem cardinalidades.
+
+Quando o fingerprint de um resource muda, o motor espera PLAN_REGRESSION_WINDOW
+segundos e compara a latência do serviço antes e depois da troca
+(service_metrics); se o p95 piorou mais que PLAN_REGRESSION_RATIO vezes,
+a troca de plano é reportada como regressão.
+
+Configuração:
+    PLAN_INTERVAL            intervalo da captura em segundos (0 → desligado, default)
+    PLAN_FILE                arquivo JSON lines com planos novos, trocas e regressões
+    PLAN_REGRESSION_WINDOW   janela de latência antes/depois da troca (default 60)
+    PLAN_REGRESSION_RATIO    piora do p95 considerada regressão (default 1.5)
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import xml.etree.ElementTree as ET
+
+import service_metrics
+from batch_logger import log, log_error, announce
+
+PLAN_INTERVAL = float(os.getenv("PLAN_INTERVAL", 0))
+PLAN_FILE = os.getenv("PLAN_FILE", "")
+PLAN_REGRESSION_WINDOW = float(os.getenv("PLAN_REGRESSION_WINDOW", 60))
+PLAN_REGRESSION_RATIO = float(os.getenv("PLAN_REGRESSION_RATIO", 1.5))
+
+
+# ── PostgreSQL: EXPLAIN (FORMAT JSON) ─────────────────────────
+def _pg_shape(node):
+    label = node["Node Type"]
+    if node.get("Join Type"):
+        label += f"({node['Join Type']})"
+    if node.get("Strategy"):
+        label += f"({node['Strategy']})"
+    for key in ("Relation Name", "Index Name"):
+        if node.get(key):
+            label += f" {node[key]}"
+    children = [_pg_shape(child) for child in node.get("Plans", ())]
+    return label + (f"[{', '.join(children)}]" if children else "")
+
+
+def capture_postgres(cursor, query, params):
+    cursor.execute("EXPLAIN (FORMAT JSON, BUFFERS) " + query, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    return _pg_shape(root), float(root["Total Cost"])
+
+
+# ── SQL Server: SHOWPLAN_XML ──────────────────────────────────
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _scan(elem):
+    """RelOps filhos e objetos (tabela.índice) do operador, sem descer em outro RelOp."""
+    relops, objects = [], []
+    for child in elem:
+        tag = _local(child.tag)
+        if tag == "RelOp":
+            relops.append(child)
+            continue
+        if tag == "Object":
+            name = child.get("Table", "").strip("[]")
+            if child.get("Index"):
+                name += "." + child.get("Index").strip("[]")
+            objects.append(name)
+        nested_relops, nested_objects = _scan(child)
+        relops += nested_relops
+        objects += nested_objects
+    return relops, objects
+
+
+def _mssql_shape(relop):
+    relops, objects = _scan(relop)
+    label = relop.get("PhysicalOp", "?")
+    if objects:
+        label += " " + " ".join(sorted(set(objects)))
+    children = [_mssql_shape(child) for child in relops]
+    return label + (f"[{', '.join(children)}]" if children else "")
+
+
+def capture_sqlserver(cursor, query, params):
+    # SET SHOWPLAN_XML precisa ser o único statement do batch
+    cursor.execute("SET SHOWPLAN_XML ON")
+    try:
+        # pyodbc trata params=None como um parâmetro
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, params)
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.execute("SET SHOWPLAN_XML OFF")
+    root = ET.fromstring(plan)
+    statements = [e for e in root.iter() if _local(e.tag) == "StmtSimple"]
+    shapes, cost = [], 0.0
+    for statement in statements:
+        cost += float(statement.get("StatementSubTreeCost", 0))
+        shapes += [_mssql_shape(relop) for relop in _scan(statement)[0]]
+    return "; ".join(shapes), cost
+
+
+DIALECTS = {
+    "postgres": capture_postgres,
+    "sqlserver": capture_sqlserver,
+}
+
+
+def fingerprint(shape):
+    return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:12]
+
+
+class PlanMonitor:
+    """Captura periódica dos planos de cada resource e detecção de troca de plano."""
+
+    def __init__(self, dialect, connect, interval=PLAN_INTERVAL, path=PLAN_FILE,
+                 window=PLAN_REGRESSION_WINDOW, ratio=PLAN_REGRESSION_RATIO):
+        self.capture = DIALECTS[dialect]
+        self.connect = connect
+        self.interval = interval
+        self.path = path
+        self.window = window
+        self.ratio = ratio
+        self.observed = {}
+        self.current = {}
+        self.flips = []
+        self._pending = []
+        self._conn = None
+
+    def observe(self, resource, service, query, params=None):
+        """Registra a query que o resource acabou de executar (chamado no hot path)."""
+        if self.interval:
+            self.observed[resource] = (service, query, params)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.connect()
+            self._conn.autocommit = True
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _write(self, entry):
+        if not self.path:
+            return
+        with open(self.path, "a", encoding="utf-8") as out:
+            out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def poll(self):
+        """Captura o plano atual de cada resource observado."""
+        now = time.time()
+        for resource, (service, query, params) in list(self.observed.items()):
+            cursor = self._connection().cursor()
+            try:
+                shape, cost = self.capture(cursor, query, params)
+            except Exception as e:
+                log_error("PLAN", f"{resource}: falha capturando plano: {e}")
+                continue
+            finally:
+                cursor.close()
+            fp = fingerprint(shape)
+            previous = self.current.get(resource)
+            self.current[resource] = (fp, cost, shape)
+            if previous is None:
+                self._write({"ts": round(now, 3), "resource": resource, "fp": fp,
+                             "cost": cost, "shape": shape})
+                log("PLAN", f"{resource}: plano {fp} (custo estimado {cost:.1f})")
+            elif previous[0] != fp:
+                flip = {"ts": round(now, 3), "resource": resource, "service": service,
+                        "from": previous[0], "to": fp, "cost_from": previous[1], "cost": cost,
+                        "shape": shape}
+                self._write(flip)
+                self._pending.append(flip)
+                announce("PLAN", f"🔀 {resource}: plano mudou {previous[0]} → {fp} "
+                                 f"(custo estimado {previous[1]:.1f} → {cost:.1f})\n"
+                                 f"    antes:  {previous[2]}\n    depois: {shape}")
+        self._check_regressions(now)
+
+    def _check_regressions(self, now):
+        """Compara a latência antes/depois de cada troca cuja janela já fechou."""
+        for flip in [f for f in self._pending if f["ts"] + self.window <= now]:
+            self._pending.remove(flip)
+            flipped = flip["ts"]
+            before = service_metrics.window(flipped - self.window, flipped).get(flip["service"])
+            after = service_metrics.window(flipped, flipped + self.window).get(flip["service"])
+            if not before or not after or not before["ops"] or not after["ops"]:
+                continue
+            flip["p95_before"], flip["p95_after"] = before["p95_ms"], after["p95_ms"]
+            flip["regression"] = after["p95_ms"] > before["p95_ms"] * self.ratio
+            self.flips.append(flip)
+            self._write({"ts": round(now, 3), "resource": flip["resource"], "to": flip["to"],
+                         "p95_before": round(before["p95_ms"], 1), "p95_after": round(after["p95_ms"], 1),
+                         "regression": flip["regression"]})
+            if flip["regression"]:
+                announce("PLAN", f"⚠️  Regressão de plano em {flip['resource']}: {flip['from']} → {flip['to']}, "
+                                 f"p95 {before['p95_ms']:.1f} → {after['p95_ms']:.1f}ms "
+                                 f"(avg {before['avg_ms']:.1f} → {after['avg_ms']:.1f}ms)")
+            else:
+                log("PLAN", f"{flip['resource']}: troca de plano sem regressão "
+                            f"(p95 {before['p95_ms']:.1f} → {after['p95_ms']:.1f}ms)")
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                log_error("PLAN", f"Falha na conexão de captura: {e}")
+                self._disconnect()
+
+    def start(self):
+        """Inicia a captura em background se PLAN_INTERVAL > 0."""
+        if not self.interval:
+            return False
+        threading.Thread(target=self.run, daemon=True, name="PlanMonitor").start()
+        announce("PLAN", f"Monitor de planos ativo (a cada {self.interval:.0f}s)")
+        return True
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Fingerprint de queries no cliente, com estatísticas por fingerprint.
+
+O texto SQL é normalizado — sem comentários (inclusive o comentário DBM com
+trace ids), literais e parâmetros viram '?', listas IN colapsadas, espaços
+e pontuação compactados — e o hash do texto normalizado identifica a query. A
+normalização é memoizada: o comentário DBM do início é cortado antes da
+consulta ao cache, então cada texto distinto só é normalizado uma vez e o
+hot path paga um lookup de dicionário.
+
+track(conn) embrulha uma conexão DB-API: cada execute registra calls,
+latência, linhas e erros do fingerprint. Conexões e cursores embrulhados
+ainda vivos (referenciados em algum lugar) são contados em open_objects(),
+a visão do cliente para vazamentos (soak_monitor.py). A mesma normalização aplicada ao
+texto de pg_stat_statements / dm_exec_sql_text (stats_collector.py grava
+"client_fp") alinha as estatísticas do cliente com queryid / query_hash.
+Textos lidos do servidor passam por text_fingerprint(), que dá o mesmo hash
+sem ocupar o cache do hot path nem o registro de textos do app.
+
+Configuração:
+    FINGERPRINT_CACHE_SIZE        textos distintos memoizados (default 4096)
+    FINGERPRINT_EXPORT            arquivo JSON lines com o snapshot por fingerprint
+    FINGERPRINT_EXPORT_INTERVAL   intervalo da exportação em segundos (default 60)
+"""
+
+import os
+import re
+import json
+import time
+import atexit
+import hashlib
+import weakref
+import threading
+from functools import lru_cache
+
+from batch_logger import announce, log_error
+
+FINGERPRINT_CACHE_SIZE = int(os.getenv("FINGERPRINT_CACHE_SIZE", 4096))
+FINGERPRINT_EXPORT = os.getenv("FINGERPRINT_EXPORT", "")
+FINGERPRINT_EXPORT_INTERVAL = float(os.getenv("FINGERPRINT_EXPORT_INTERVAL", 60))
+
+_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_LINE_COMMENT = re.compile(r"--[^\n]*")
+_STRING = re.compile(r"N?'(?:[^']|'')*'")
+_PARAM = re.compile(r"%s|\$\d+|@P\d+|\?")
+_NUMBER = re.compile(r"(?<![\w@$.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+_PUNCT = re.compile(r"\s*([,()=<>!])\s*")
+
+
+def _strip_param_declaration(sql):
+    """sp_executesql do pyodbc: '(@P1 nvarchar(9),@P2 int)SELECT ...' → 'SELECT ...'."""
+    if not sql.startswith("(@"):
+        return sql
+    depth = 0
+    for i, char in enumerate(sql):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return sql[i + 1:]
+    return sql
+
+
+def normalize(sql):
+    """Texto canônico da query: sem comentários, literais e parâmetros."""
+    sql = _strip_param_declaration(sql.strip())
+    sql = _BLOCK_COMMENT.sub(" ", sql)
+    sql = _LINE_COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _PARAM.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PUNCT.sub(r"\1", sql)
+    sql = _IN_LIST.sub("(?)", sql)
+    return _SPACE.sub(" ", sql).strip().rstrip(";").strip().lower()
+
+
+def _digest(normalized):
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def _fingerprint(sql):
+    normalized = normalize(sql)
+    return _digest(normalized), normalized
+
+
+def fingerprint(sql):
+    """Fingerprint memoizado; o comentário DBM do início não entra na chave do cache."""
+    if sql.startswith("/*"):
+        end = sql.find("*/")
+        if end != -1:
+            sql = sql[end + 2:]
+    fp, normalized = _fingerprint(sql)
+    if fp not in _texts:
+        _texts[fp] = normalized
+    return fp
+
+
+def text_fingerprint(sql):
+    """Mesmo hash de fingerprint(), sem memoizar nem registrar o texto (textos do servidor)."""
+    return _digest(normalize(sql))
+
+
+# ── Estatísticas por fingerprint ──────────────────────────────
+_stats = {}
+_texts = {}
+_lock = threading.Lock()
+
+# Wrappers vivos (WeakSet: sai sozinho quando o objeto é coletado)
+_live_connections = weakref.WeakSet()
+_live_cursors = weakref.WeakSet()
+
+
+def _record(fp, elapsed=0.0, rows=0, calls=1, error=False):
+    with _lock:
+        stats = _stats.get(fp)
+        if stats is None:
+            stats = _stats[fp] = [0, 0.0, 0, 0]
+        stats[0] += calls
+        stats[1] += elapsed
+        stats[2] += rows
+        if error:
+            stats[3] += 1
+
+
+class TrackedCursor:
+    """Cursor que registra cada execute no fingerprint da query."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._fp = None
+        _live_cursors.add(self)
+
+    def execute(self, sql, *args, **kwargs):
+        # psycopg2 também aceita sql.Composed; o fingerprint usa o texto
+        self._fp = fingerprint(sql if isinstance(sql, str) else str(sql))
+        started = time.perf_counter()
+        try:
+            result = self._cursor.execute(sql, *args, **kwargs)
+        except Exception:
+            _record(self._fp, time.perf_counter() - started, error=True)
+            raise
+        elapsed = time.perf_counter() - started
+        # Linhas de SELECT são contadas no fetch; DML usa rowcount
+        rowcount = self._cursor.rowcount if self._cursor.description is None else 0
+        _record(self._fp, elapsed, max(rowcount or 0, 0))
+        return self if result is self._cursor else result
+
+    def _fetched(self, rows):
+        if self._fp is not None and rows:
+            _record(self._fp, rows=rows, calls=0)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._fetched(1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._fetched(len(rows))
+        return rows
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TrackedConnection:
+    """Conexão cujos cursores registram estatísticas por fingerprint."""
+
+    def __init__(self, conn):
+        object.__setattr__(self, "_conn", conn)
+        _live_connections.add(self)
+
+    def cursor(self, *args, **kwargs):
+        return TrackedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+def track(conn):
+    return TrackedConnection(conn)
+
+
+def open_objects():
+    """Conexões e cursores embrulhados por track() ainda vivos no processo."""
+    return len(_live_connections), len(_live_cursors)
+
+
+# ── Exportação ────────────────────────────────────────────────
+def snapshot():
+    """Estatísticas por fingerprint, da query mais cara para a mais barata."""
+    with _lock:
+        items = [(fp, list(stats)) for fp, stats in _stats.items()]
+    result = []
+    for fp, (calls, elapsed, rows, errors) in items:
+        result.append({
+            "fp": fp,
+            "query": _texts.get(fp, ""),
+            "calls": calls,
+            "total_ms": round(elapsed * 1000, 3),
+            "avg_ms": round(elapsed * 1000 / calls, 3) if calls else 0.0,
+            "rows": rows,
+            "errors": errors,
+        })
+    return sorted(result, key=lambda entry: entry["total_ms"], reverse=True)
+
+
+def export(path=FINGERPRINT_EXPORT):
+    """Grava o snapshot atual (sobrescreve): uma linha por fingerprint."""
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as out:
+        for entry in snapshot():
+            out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+def _export_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            export(path)
+        except OSError as e:
+            log_error("FINGERPRINT", f"Falha exportando {path}: {e}")
+
+
+def start_export(path=FINGERPRINT_EXPORT, interval=FINGERPRINT_EXPORT_INTERVAL):
+    """Exporta periodicamente (e no encerramento) se FINGERPRINT_EXPORT estiver definido."""
+    if not path:
+        return False
+    threading.Thread(target=_export_loop, args=(path, interval), daemon=True, name="FingerprintExport").start()
+    atexit.register(export, path)
+    announce("FINGERPRINT", f"Estatísticas por fingerprint em {path} (a cada {interval:.0f}s)")
+    return True
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Roteamento de leituras para réplicas, com verificação de lag.
+
+Serviços somente leitura pegam a conexão do roteador: ele escolhe uma
+réplica saudável (round-robin ou menos carregada) e volta para o primário
+quando todas estão com lag acima do limite ou fora do ar. Uma thread mede
+o lag de cada réplica a cada REPLICA_LAG_INTERVAL segundos em uma conexão
+persistente, fora do hot path.
+
+Configuração:
+    REPLICA_STRATEGY       "round_robin" (default) ou "least_loaded"
+    REPLICA_MAX_LAG        lag máximo em segundos antes do fallback (default 5)
+    REPLICA_LAG_INTERVAL   intervalo da medição de lag (default 2)
+"""
+
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+from ddtrace import tracer
+
+from batch_logger import announce, log_error
+
+REPLICA_STRATEGY = os.getenv("REPLICA_STRATEGY", "round_robin")
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 5))
+REPLICA_LAG_INTERVAL = float(os.getenv("REPLICA_LAG_INTERVAL", 2))
+
+
+class Endpoint:
+    """Destino de leitura: como obter/devolver conexões e o estado observado.
+
+    connect abre a conexão dedicada da medição de lag (fora do pool).
+    """
+
+    def __init__(self, name, acquire, release, connect=None):
+        self.name = name
+        self.acquire = acquire
+        self.release = release
+        self.connect = connect or acquire
+        self.inflight = 0
+        self.routed = 0
+        self.lag = 0.0
+        self.healthy = True
+
+
+class ReplicaRouter:
+    """Escolhe réplica ou primário para cada leitura."""
+
+    def __init__(self, primary, replicas, lag_query, strategy=REPLICA_STRATEGY,
+                 max_lag=REPLICA_MAX_LAG, lag_interval=REPLICA_LAG_INTERVAL):
+        self.primary = primary
+        self.replicas = replicas
+        self.lag_query = lag_query
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.lag_interval = lag_interval
+        self.fallbacks = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        if replicas:
+            threading.Thread(target=self._monitor_lag, daemon=True, name="ReplicaLag").start()
+
+    def _choose(self):
+        with self._lock:
+            candidates = [r for r in self.replicas if r.healthy and r.lag <= self.max_lag]
+            if not candidates:
+                endpoint = self.primary
+                if self.replicas:
+                    self.fallbacks += 1
+            elif self.strategy == "least_loaded":
+                low = min(r.inflight for r in candidates)
+                endpoint = random.choice([r for r in candidates if r.inflight == low])
+            else:
+                endpoint = candidates[self._next % len(candidates)]
+                self._next += 1
+            endpoint.inflight += 1
+            endpoint.routed += 1
+        return endpoint
+
+    @contextmanager
+    def connection(self):
+        """Conexão para uma leitura no endpoint escolhido."""
+        endpoint = self._choose()
+        span = tracer.current_span()
+        if span:
+            span.set_tag("db.route", endpoint.name)
+        try:
+            conn = endpoint.acquire()
+            try:
+                yield conn
+            finally:
+                endpoint.release(conn)
+        finally:
+            with self._lock:
+                endpoint.inflight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "routed": {e.name: e.routed for e in [self.primary] + self.replicas},
+                "lag": {r.name: r.lag for r in self.replicas},
+                "fallbacks": self.fallbacks,
+            }
+
+    # ── Medição de lag ────────────────────────────────────────
+    def _monitor_lag(self):
+        conns = {}
+        while True:
+            for replica in self.replicas:
+                try:
+                    conn = conns.get(replica.name)
+                    if conn is None:
+                        conn = conns[replica.name] = replica.connect()
+                    cursor = conn.cursor()
+                    cursor.execute(self.lag_query)
+                    lag = float(cursor.fetchone()[0] or 0)
+                    cursor.close()
+                    conn.rollback()
+                    healthy = True
+                except Exception as e:
+                    log_error("REPLICA", f"{replica.name}: falha medindo lag: {e}")
+                    conn = conns.pop(replica.name, None)
+                    if conn is not None:
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
+                    lag, healthy = float("inf"), False
+                self._update(replica, lag, healthy)
+            time.sleep(self.lag_interval)
+
+    def _update(self, replica, lag, healthy):
+        was_usable = replica.healthy and replica.lag <= self.max_lag
+        with self._lock:
+            replica.lag, replica.healthy = lag, healthy
+        usable = healthy and lag <= self.max_lag
+        if was_usable and not usable:
+            announce("REPLICA", f"⚠️  {replica.name} fora do roteamento (lag={lag:.1f}s, limite={self.max_lag}s)")
+        elif usable and not was_usable:
+            announce("REPLICA", f"✓ {replica.name} de volta ao roteamento (lag={lag:.1f}s)")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Leitura de resultados em streaming, com memória constante no cliente.
+
+Com RESULT_MODE=stream as leituras deixam de materializar o resultado
+inteiro com fetchall(): no PostgreSQL usam um cursor nomeado (server-side —
+o resultado fica no servidor e o cliente busca RESULT_FETCH_SIZE linhas por
+vez); no pyodbc iteram com fetchmany(). Cada leitura põe no span o número
+de linhas e o tempo até a primeira; no modo stream mede também o pico de RSS
+do processo e loga a leitura. No modo fetchall não há syscall nem linha de
+log por leitura.
+
+Configuração:
+    RESULT_MODE         "fetchall" (default) ou "stream"
+    RESULT_FETCH_SIZE   linhas por ida ao servidor no modo stream (default 1000)
+"""
+
+import os
+import time
+import itertools
+import resource
+
+from ddtrace import tracer
+
+from batch_logger import log
+
+RESULT_MODE = os.getenv("RESULT_MODE", "fetchall")
+RESULT_FETCH_SIZE = int(os.getenv("RESULT_FETCH_SIZE", 1000))
+
+_cursor_ids = itertools.count(1)
+
+
+def peak_rss_mb():
+    """Pico de RSS do processo até agora (ru_maxrss é em KB no Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _open_cursor(conn, named):
+    if named:
+        # Nome único por leitura: vários cursores nomeados podem coexistir na conexão
+        return conn.cursor(name=f"stream_{next(_cursor_ids)}")
+    return conn.cursor()
+
+
+def read_rows(conn, query, params=None, service="", named=False,
+              mode=RESULT_MODE, fetch_size=RESULT_FETCH_SIZE):
+    """Itera as linhas da query; named=True usa cursor server-side (psycopg2).
+
+    No modo fetchall o resultado é lido inteiro antes da primeira linha, como
+    antes; no modo stream as linhas chegam em lotes de fetch_size.
+    """
+    streaming = mode == "stream"
+    span = tracer.current_span()
+    rss_before = peak_rss_mb() if streaming else None
+    started = time.perf_counter()
+    first_row = None
+    rows = 0
+
+    cursor = _open_cursor(conn, named and streaming)
+    try:
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, params)
+
+        if streaming:
+            while True:
+                batch = cursor.fetchmany(fetch_size)
+                if not batch:
+                    break
+                if first_row is None:
+                    first_row = time.perf_counter() - started
+                for row in batch:
+                    rows += 1
+                    yield row
+        else:
+            result = cursor.fetchall()
+            if result:
+                first_row = time.perf_counter() - started
+            for row in result:
+                rows += 1
+                yield row
+            del result
+    finally:
+        cursor.close()
+        elapsed = time.perf_counter() - started
+        first_row_ms = (first_row if first_row is not None else elapsed) * 1000
+
+        if span:
+            span.set_tag("db.fetch_mode", mode)
+            span.set_tag("db.row_count", rows)
+            span.set_tag("db.first_row_ms", round(first_row_ms, 1))
+        if streaming:
+            peak = peak_rss_mb()
+            if span:
+                span.set_tag("process.peak_rss_mb", round(peak, 1))
+            if service:
+                log(service, f"📦 {rows} linhas ({mode}) — 1ª linha {first_row_ms:.1f}ms, "
+                             f"total {elapsed * 1000:.1f}ms, pico RSS {peak:.1f}MB (+{peak - rss_before:.1f})")
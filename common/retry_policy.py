@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Retry com classificação de erro do driver (psycopg2 / pyodbc).
+
+Em vez de capturar Exception e dormir segundos fixos, cada erro é
+classificado e recebe a sua política:
+
+    deadlock       vítima de deadlock (40P01 / 1205)        → retry rápido
+    lock_timeout   lock_timeout / query timeout (55P03, 1222, HYT00)
+    serialization  conflito de serialização (40001 / 3960)   → retry rápido
+    connection     conexão perdida (08xxx, 57P0x, OperationalError)
+    logic          erro de SQL/dados/código                  → sem retry
+    rejected       rejeitada pelo limite de concorrência (concurrency_limit.py)
+                   → sem retry, pausa curta
+
+O backoff é exponencial com full jitter e os retries de cada serviço são
+limitados por um retry budget (fração das requisições + mínimo por segundo),
+para que uma degradação do banco não vire uma tempestade de retries.
+"""
+
+import os
+import re
+import time
+import random
+import threading
+from collections import namedtuple
+
+import service_metrics
+from batch_logger import log_retry
+
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_MIN_PER_S = float(os.getenv("RETRY_BUDGET_MIN_PER_S", 1))
+
+DEADLOCK = "deadlock"
+LOCK_TIMEOUT = "lock_timeout"
+SERIALIZATION = "serialization"
+CONNECTION = "connection"
+LOGIC = "logic"
+REJECTED = "rejected"
+
+# max_retries, backoff base/cap (s) e pausa do loop após desistir
+RetryPolicy = namedtuple("RetryPolicy", ["max_retries", "base", "cap", "cooldown"])
+
+POLICIES = {
+    DEADLOCK:      RetryPolicy(3, 0.05, 1.0, 0.0),
+    LOCK_TIMEOUT:  RetryPolicy(2, 0.2, 2.0, 0.5),
+    SERIALIZATION: RetryPolicy(5, 0.02, 0.5, 0.0),
+    CONNECTION:    RetryPolicy(4, 0.5, 8.0, 2.0),
+    LOGIC:         RetryPolicy(0, 0.0, 0.0, 1.0),
+    REJECTED:      RetryPolicy(0, 0.0, 0.0, 0.2),
+}
+
+_PG_CODES = {
+    "40P01": DEADLOCK,
+    "55P03": LOCK_TIMEOUT,
+    "57014": LOCK_TIMEOUT,   # statement_timeout
+    "40001": SERIALIZATION,
+    "57P01": CONNECTION,
+    "57P02": CONNECTION,
+    "57P03": CONNECTION,
+}
+
+_MSSQL_NATIVE = {
+    1205: DEADLOCK,
+    1222: LOCK_TIMEOUT,
+    3960: SERIALIZATION,
+    3961: SERIALIZATION,
+    10054: CONNECTION,
+    10060: CONNECTION,
+}
+
+_NATIVE_CODE = re.compile(r"\((\d{3,5})\)")
+
+
+def classify(exc):
+    """Classifica a exceção do driver em uma das classes de erro."""
+    name = type(exc).__name__
+
+    # psycopg2: SQLSTATE em pgcode
+    pgcode = getattr(exc, "pgcode", None)
+    if pgcode:
+        if pgcode in _PG_CODES:
+            return _PG_CODES[pgcode]
+        if pgcode.startswith("08"):
+            return CONNECTION
+        return LOGIC
+
+    # pyodbc: args = (SQLSTATE, mensagem com o código nativo entre parênteses)
+    args = getattr(exc, "args", ())
+    if len(args) >= 2 and isinstance(args[0], str) and isinstance(args[1], str):
+        sqlstate, message = args[0], args[1]
+        for code in _NATIVE_CODE.findall(message):
+            if int(code) in _MSSQL_NATIVE:
+                return _MSSQL_NATIVE[int(code)]
+        if sqlstate == "HYT00":
+            return LOCK_TIMEOUT
+        if sqlstate.startswith("08") or "communication link failure" in message.lower():
+            return CONNECTION
+
+    # Sem SQLSTATE: OperationalError/InterfaceError = conexão caiu
+    if name in ("OperationalError", "InterfaceError"):
+        return CONNECTION
+    return LOGIC
+
+
+class RetryBudget:
+    """Token bucket por serviço: cada requisição deposita RATIO tokens, cada retry gasta 1."""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_s=RETRY_BUDGET_MIN_PER_S):
+        self.ratio = ratio
+        self.min_per_s = min_per_s
+        self.max_tokens = max(10.0, min_per_s * 10)
+        self.tokens = self.max_tokens
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_s)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def _budget(service):
+    budget = _budgets.get(service)
+    if budget is None:
+        with _budgets_lock:
+            budget = _budgets.setdefault(service, RetryBudget())
+    return budget
+
+
+def backoff(policy, attempt):
+    """Exponencial com full jitter: uniforme em [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(policy.cap, policy.base * (2 ** attempt)))
+
+
+def call_with_retry(service, func, *args, **kwargs):
+    """Executa func aplicando a política da classe do erro; relança quando desiste."""
+    budget = _budget(service)
+    budget.deposit()
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error_class = classify(e)
+            policy = POLICIES[error_class]
+            if attempt >= policy.max_retries or not budget.withdraw():
+                try:
+                    e.error_class = error_class
+                except AttributeError:
+                    pass
+                raise
+            delay = backoff(policy, attempt)
+            attempt += 1
+            service_metrics.record_retry(service, error_class)
+            log_retry(service, f"↻ retry {attempt}/{policy.max_retries} ({error_class}) em {delay * 1000:.0f}ms")
+            time.sleep(delay)
+
+
+def error_class_of(exc):
+    """Classe já atribuída por call_with_retry ou classificada agora."""
+    return getattr(exc, "error_class", None) or classify(exc)
+
+
+def failure_pause(exc):
+    """Pausa do loop do serviço depois de uma falha definitiva."""
+    return POLICIES[error_class_of(exc)].cooldown
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Métricas em memória por serviço (latência, erros, throughput).
+
+Cada serviço registra uma amostra por operação em um deque limitado —
+append atômico sob o GIL, sem lock no hot path. As consultas por janela
+de tempo (window) copiam o deque e calculam as estatísticas fora dele.
+Retries são registrados à parte (record_retry), por classe de erro.
+"""
+
+import os
+import time
+from collections import deque
+
+METRICS_WINDOW_SIZE = int(os.getenv("METRICS_WINDOW_SIZE", 50000))
+
+_samples = {}
+_retries = {}
+
+
+def record(service, latency, ok=True):
+    """Registra uma operação: latência em segundos e se terminou sem erro."""
+    samples = _samples.get(service)
+    if samples is None:
+        samples = _samples.setdefault(service, deque(maxlen=METRICS_WINDOW_SIZE))
+    samples.append((time.time(), latency, ok))
+
+
+def record_retry(service, error_class):
+    """Registra um retry do serviço, com a classe de erro que o causou."""
+    retries = _retries.get(service)
+    if retries is None:
+        retries = _retries.setdefault(service, deque(maxlen=METRICS_WINDOW_SIZE))
+    retries.append((time.time(), error_class))
+
+
+def services():
+    return sorted(set(_samples) | set(_retries))
+
+
+def first_success():
+    """Timestamp da primeira operação sem erro ainda na janela (None se não houve)."""
+    first = None
+    for samples in tuple(_samples.values()):
+        for ts, lat, ok in tuple(samples):
+            if ok:
+                first = ts if first is None else min(first, ts)
+                break
+    return first
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def window(start, end):
+    """Estatísticas por serviço entre os timestamps start e end."""
+    duration = max(end - start, 1e-9)
+    stats = {}
+    for service in services():
+        # tuple() copia o deque inteiro sem liberar o GIL
+        samples = tuple(_samples.get(service, ()))
+        retries = [cls for ts, cls in tuple(_retries.get(service, ())) if start <= ts < end]
+        latencies = sorted(lat for ts, lat, ok in samples if start <= ts < end and ok)
+        errors = sum(1 for ts, lat, ok in samples if start <= ts < end and not ok)
+        ops = len(latencies)
+        stats[service] = {
+            "ops": ops,
+            "errors": errors,
+            "ops_per_s": ops / duration,
+            "avg_ms": (sum(latencies) / ops * 1000) if ops else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "retries": len(retries),
+            "retries_by_class": {cls: retries.count(cls) for cls in set(retries)},
+        }
+    return stats
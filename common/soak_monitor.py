@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Modo soak: linha do tempo de recursos do próprio processo, para rodadas longas.
+
+A cada SOAK_INTERVAL segundos o monitor amostra:
+    - RSS do processo, threads Python, descritores de arquivo abertos e
+      objetos rastreados pelo gc
+    - conexões e cursores do app ainda vivos (query_fingerprint.open_objects)
+    - sessões no banco por application_name / program_name, e quantas estão
+      ociosas com transação aberta, em uma conexão persistente
+    - memória rastreada pelo tracemalloc, a parte alocada pelo ddtrace (buffer
+      de spans do tracer) e os maiores crescimentos por linha de código desde
+      o início do soak
+
+Cada amostra vai para SOAK_FILE (JSON lines) junto com ops/s, p95 e erros
+de cada serviço no mesmo intervalo (service_metrics), então recursos e
+throughput ficam na mesma linha do tempo. Uma série que cresce em
+SOAK_GROWTH_SAMPLES amostras seguidas, sem nenhuma queda, é sinalizada no
+log como crescimento monotônico — junto com os maiores alocadores, se a
+série for de memória.
+
+O tracemalloc deixa as alocações mais lentas: só liga com o soak ativo, e
+SOAK_TRACEMALLOC_TOP=0 o desliga.
+
+Configuração:
+    SOAK_INTERVAL          intervalo da amostragem em segundos (0 → desligado, default)
+    SOAK_FILE              arquivo JSON lines com a linha do tempo
+    SOAK_GROWTH_SAMPLES    amostras seguidas crescendo para sinalizar (default 10)
+    SOAK_TRACEMALLOC_TOP   maiores alocadores por amostra (0 → sem tracemalloc, default 10)
+"""
+
+import gc
+import os
+import json
+import time
+import threading
+import tracemalloc
+from collections import deque
+
+import service_metrics
+from batch_logger import announce, log_error
+from query_fingerprint import open_objects
+
+SOAK_INTERVAL = float(os.getenv("SOAK_INTERVAL", 0))
+SOAK_FILE = os.getenv("SOAK_FILE", "")
+SOAK_GROWTH_SAMPLES = int(os.getenv("SOAK_GROWTH_SAMPLES", 10))
+SOAK_TRACEMALLOC_TOP = int(os.getenv("SOAK_TRACEMALLOC_TOP", 10))
+
+# Sessões por aplicação no banco do app; "ociosa com transação" segura locks e snapshot
+PG_SESSIONS_QUERY = """
+    SELECT COALESCE(NULLIF(application_name, ''), '(sem nome)'),
+           COUNT(*),
+           COUNT(*) FILTER (WHERE state IN ('idle in transaction', 'idle in transaction (aborted)'))
+    FROM pg_stat_activity
+    WHERE datname = current_database() AND backend_type = 'client backend'
+    GROUP BY 1
+"""
+
+SQLSERVER_SESSIONS_QUERY = """
+    SELECT ISNULL(NULLIF(program_name, ''), '(sem nome)'),
+           COUNT(*),
+           SUM(CASE WHEN status = 'sleeping' AND open_transaction_count > 0 THEN 1 ELSE 0 END)
+    FROM sys.dm_exec_sessions
+    WHERE is_user_process = 1 AND database_id = DB_ID()
+    GROUP BY ISNULL(NULLIF(program_name, ''), '(sem nome)')
+"""
+
+DIALECTS = {
+    "postgres": PG_SESSIONS_QUERY,
+    "sqlserver": SQLSERVER_SESSIONS_QUERY,
+}
+
+# Séries de memória: ao crescerem, o log traz os maiores alocadores
+_MEMORY_SERIES = ("rss_mb", "traced_mb", "ddtrace_mb")
+
+_DDTRACE_FILES = tracemalloc.Filter(True, f"*{os.sep}ddtrace{os.sep}*")
+# As estruturas do tracemalloc e do próprio monitor ficam fora da conta
+_EXCLUDED = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+
+
+def rss_mb():
+    """RSS atual (Linux: /proc/self/statm); fora do Linux, o pico (getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+class SoakMonitor:
+    """Amostragem periódica de recursos do processo e do banco, com detecção de crescimento."""
+
+    def __init__(self, dialect, connect, interval=SOAK_INTERVAL, path=SOAK_FILE,
+                 growth_samples=SOAK_GROWTH_SAMPLES, top=SOAK_TRACEMALLOC_TOP):
+        self.query = DIALECTS[dialect]
+        self.connect = connect
+        self.interval = interval
+        self.path = path
+        self.growth_samples = growth_samples
+        self.top = top
+        self.series = {}
+        self.growing = set()
+        self.samples = 0
+        self._baseline = None
+        self._last = None
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.connect()
+            self._conn.autocommit = True
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def sessions(self):
+        """{aplicação: [sessões, ociosas com transação]}; None se o banco não respondeu."""
+        try:
+            cursor = self._connection().cursor()
+            try:
+                cursor.execute(self.query)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception as e:
+            log_error("SOAK", f"Falha lendo sessões: {e}")
+            self._disconnect()
+            return None
+        return {str(app).strip(): [int(total), int(idle_in_tx or 0)] for app, total, idle_in_tx in rows}
+
+    def allocations(self):
+        """Memória rastreada, parte do ddtrace e maiores crescimentos desde o início."""
+        snapshot = tracemalloc.take_snapshot().filter_traces(_EXCLUDED)
+        traced = sum(stat.size for stat in snapshot.statistics("filename"))
+        ddtrace = sum(stat.size for stat in snapshot.filter_traces([_DDTRACE_FILES]).statistics("filename"))
+        top = []
+        for stat in snapshot.compare_to(self._baseline, "lineno")[:self.top]:
+            frame = stat.traceback[0]
+            top.append([f"{frame.filename}:{frame.lineno}", round(stat.size_diff / 1024, 1), stat.count_diff])
+        return traced / 1048576, ddtrace / 1048576, top
+
+    def _track(self, name, value):
+        """Acumula a série; True se cresceu em todas as últimas growth_samples amostras."""
+        values = self.series.get(name)
+        if values is None:
+            values = self.series[name] = deque(maxlen=self.growth_samples)
+        values.append(value)
+        if len(values) < self.growth_samples:
+            return False
+        steps = list(values)
+        return steps[-1] > steps[0] and all(b >= a for a, b in zip(steps, steps[1:]))
+
+    def sample(self):
+        now = time.time()
+        connections, cursors = open_objects()
+        sample = {
+            "ts": round(now, 3),
+            "rss_mb": round(rss_mb(), 2),
+            "threads": threading.active_count(),
+            "fds": open_fds(),
+            "gc_objects": len(gc.get_objects()),
+            "connections": connections,
+            "cursors": cursors,
+        }
+        top = []
+        if self._baseline is not None:
+            traced, ddtrace, top = self.allocations()
+            sample["traced_mb"] = round(traced, 2)
+            sample["ddtrace_mb"] = round(ddtrace, 2)
+        sessions = self.sessions()
+        if sessions is not None:
+            sample["sessions"] = sessions
+
+        values = {name: value for name, value in sample.items()
+                  if name not in ("ts", "sessions") and value is not None}
+        for app, (total, idle_in_tx) in (sessions or {}).items():
+            values[f"sessions:{app}"] = total
+            values[f"idle_in_tx:{app}"] = idle_in_tx
+        growing = sorted(name for name, value in values.items() if self._track(name, value))
+
+        if self._last is not None:
+            sample["services"] = {
+                service: {"ops_per_s": round(s["ops_per_s"], 2), "p95_ms": round(s["p95_ms"], 1),
+                          "errors": s["errors"]}
+                for service, s in service_metrics.window(self._last, now).items()
+            }
+        sample["growing"] = growing
+        sample["top_allocations"] = top
+        self._last = now
+        self.samples += 1
+
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as out:
+                out.write(json.dumps(sample, ensure_ascii=False) + "\n")
+        self.report(sample, growing, top)
+        return sample
+
+    def report(self, sample, growing, top):
+        ops = sum(s["ops_per_s"] for s in sample.get("services", {}).values())
+        sessions = sum(total for total, _ in sample.get("sessions", {}).values())
+        line = (f"🧪 Soak: RSS {sample['rss_mb']:.1f}MB, threads {sample['threads']}, fds {sample['fds']}, "
+                f"conexões {sample['connections']}, cursores {sample['cursors']}, sessões {sessions}")
+        if "traced_mb" in sample:
+            line += f", tracemalloc {sample['traced_mb']:.1f}MB (ddtrace {sample['ddtrace_mb']:.1f}MB)"
+        lines = [line + f", {ops:.1f} ops/s"]
+
+        # Sinaliza quando a série começa a crescer; de novo só depois de uma queda
+        new = [name for name in growing if name not in self.growing]
+        self.growing = set(growing)
+        for name in new:
+            values = self.series[name]
+            lines.append(f"  ⚠️  Crescimento monotônico em {name}: {values[0]} → {values[-1]} "
+                         f"em {len(values)} amostras ({len(values) * self.interval:.0f}s)")
+        if top and any(name in _MEMORY_SERIES for name in new):
+            lines.append("  maiores crescimentos desde o início do soak:")
+            lines += [f"    {size_kb:>10.1f} KB  {count:>+8}  {location}" for location, size_kb, count in top]
+        announce("SOAK", "\n".join(lines))
+
+    def run(self):
+        while True:
+            started = time.perf_counter()
+            try:
+                self.sample()
+            except Exception as e:
+                log_error("SOAK", f"Falha na amostragem: {e}")
+            time.sleep(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    def start(self):
+        """Inicia a amostragem em background se SOAK_INTERVAL > 0."""
+        if not self.interval:
+            return False
+        if self.top > 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._baseline = tracemalloc.take_snapshot().filter_traces(_EXCLUDED)
+        threading.Thread(target=self.run, daemon=True, name="SoakMonitor").start()
+        announce("SOAK", f"Soak: recursos a cada {self.interval:.0f}s, crescimento sinalizado após "
+                         f"{self.growth_samples} amostras" + (" (tracemalloc ligado)" if self.top > 0 else ""))
+        return True
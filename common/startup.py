@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Startup por prontidão: probes em vez de sleeps fixos.
+
+wait_ready() testa o banco (conecta + SELECT 1) e, se o tracing estiver
+ligado, a porta do trace agent — os dois em paralelo, com backoff
+exponencial curto (50ms → 1s, com jitter). Com as dependências já no ar o
+startup leva milissegundos; o agente é opcional e só gera um aviso se não
+responder. instrument() faz o patch apenas da integração do driver, e nada
+quando DD_TRACE_ENABLED=false.
+
+O tempo até a primeira operação (desde o início do processo, imports
+incluídos) é medido a partir das amostras de service_metrics e aparece no
+log junto com o tempo de cada probe.
+
+Configuração:
+    STARTUP_TIMEOUT         espera máxima pelo banco em segundos (default 60)
+    STARTUP_AGENT_TIMEOUT   espera máxima pelo trace agent em segundos (default 10)
+"""
+
+import os
+import time
+import random
+import socket
+import threading
+
+import service_metrics
+from batch_logger import announce
+
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", 60))
+STARTUP_AGENT_TIMEOUT = float(os.getenv("STARTUP_AGENT_TIMEOUT", 10))
+
+TRACING = os.getenv("DD_TRACE_ENABLED", "true").lower() not in ("false", "0")
+AGENT_HOST = os.getenv("DD_AGENT_HOST", "localhost")
+AGENT_PORT = int(os.getenv("DD_TRACE_AGENT_PORT", 8126))
+
+_BACKOFF_BASE = 0.05
+_BACKOFF_CAP = 1.0
+
+
+def _process_started():
+    """Início do processo (Linux: /proc/self/stat); fora do Linux, o import deste módulo."""
+    try:
+        with open("/proc/self/stat") as f:
+            # campo 22, em ticks desde o boot; o nome do processo pode ter espaços
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+PROCESS_STARTED = _process_started()
+
+
+def instrument(**integrations):
+    """Patch só das integrações pedidas (ex: psycopg=True); nada com o tracing desligado."""
+    if not TRACING:
+        return False
+    from ddtrace import patch
+    patch(**integrations)
+    return True
+
+
+def wait_for(name, probe, timeout):
+    """Repete probe() com backoff exponencial até dar certo; segundos gastos ou None no timeout."""
+    started = time.perf_counter()
+    deadline = started + timeout
+    attempt = 0
+    while True:
+        try:
+            probe()
+            return time.perf_counter() - started
+        except Exception as e:
+            delay = random.uniform(_BACKOFF_BASE, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+            if time.perf_counter() + delay > deadline:
+                announce("STARTUP", f"⏳ {name} não respondeu em {timeout:.0f}s: {e}")
+                return None
+            attempt += 1
+            if attempt in (5, 10) or attempt % 20 == 0:
+                announce("STARTUP", f"⏳ Aguardando {name} (tentativa {attempt}): {e}")
+            time.sleep(delay)
+
+
+def probe_db(connect):
+    def probe():
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+    return probe
+
+
+def probe_agent(host=AGENT_HOST, port=AGENT_PORT):
+    def probe():
+        socket.create_connection((host, port), timeout=0.5).close()
+    return probe
+
+
+def wait_ready(connect, name="banco", db_timeout=STARTUP_TIMEOUT, agent_timeout=STARTUP_AGENT_TIMEOUT):
+    """Espera banco e trace agent em paralelo; False se o banco não ficou pronto."""
+    results = {}
+
+    def agent():
+        results["agent"] = wait_for("trace agent", probe_agent(), agent_timeout)
+
+    agent_thread = None
+    if TRACING:
+        agent_thread = threading.Thread(target=agent, daemon=True, name="AgentProbe")
+        agent_thread.start()
+    db_elapsed = wait_for(name, probe_db(connect), db_timeout)
+    if agent_thread is not None:
+        agent_thread.join()
+
+    parts = [f"{name} {db_elapsed * 1000:.0f}ms" if db_elapsed is not None else f"{name} indisponível"]
+    if agent_thread is None:
+        parts.append("tracing desligado")
+    elif results.get("agent") is None:
+        parts.append("trace agent indisponível (traces serão descartados)")
+    else:
+        parts.append(f"trace agent {results['agent'] * 1000:.0f}ms")
+    announce("STARTUP", f"Dependências: {', '.join(parts)} — "
+                        f"{time.time() - PROCESS_STARTED:.2f}s desde o início do processo")
+    return db_elapsed is not None
+
+
+def _watch_first_operation(timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        first = service_metrics.first_success()
+        if first is not None:
+            announce("STARTUP", f"⏱️  Primeira operação em {first - PROCESS_STARTED:.2f}s desde o início do processo")
+            return
+        time.sleep(0.05)
+
+
+def report_first_operation(timeout=STARTUP_TIMEOUT):
+    """Loga, em background, o tempo do início do processo até a primeira operação."""
+    threading.Thread(target=_watch_first_operation, args=(timeout,), daemon=True, name="FirstOperation").start()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Coletor de deltas de pg_stat_statements / sys.dm_exec_query_stats.
+
+As views de estatística são cumulativas; o coletor as lê a cada
+STATS_INTERVAL segundos em uma única conexão persistente e grava, por
+fingerprint de query (queryid / query_hash), o delta do intervalo: calls,
+tempo total (ms), linhas, blocos em cache (hits) e lidos do disco (reads).
+
+Para o custo de coleta continuar pequeno com milhares de statements, o poll
+lê só os contadores agregados por fingerprint — os textos das queries só são
+lidos quando aparece um fingerprint novo. "client_fp" é o fingerprint que
+query_fingerprint.py calcula no cliente para o mesmo texto, e liga as
+estatísticas do servidor às do cliente (FINGERPRINT_EXPORT).
+
+Arquivo (JSON lines, append):
+    {"ts": ..., "fp": "...", "client_fp": "...", "service": "...", "query": "..."}
+                                                                   fingerprint novo
+    {"ts": ..., "interval": 15.0, "d": {"<fp>": [calls, ms, rows, hits, reads]}}
+
+Configuração:
+    STATS_FILE       arquivo da série temporal (vazio → coletor desligado)
+    STATS_INTERVAL   intervalo do poll em segundos (default 15)
+
+Queries mais caras de cada intervalo de um arquivo coletado:
+    python stats_collector.py stats.jsonl [top]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+
+from batch_logger import log, log_error, announce
+from query_fingerprint import text_fingerprint
+
+STATS_FILE = os.getenv("STATS_FILE", "")
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", 15))
+
+# Contadores por fingerprint: calls, tempo (ms), linhas, hits, reads.
+# pg_stat_statements(false) não lê o arquivo de textos das queries.
+PG_COUNTERS_QUERY = """
+    SELECT queryid, SUM(calls), SUM(total_exec_time), SUM(rows),
+           SUM(shared_blks_hit), SUM(shared_blks_read)
+    FROM pg_stat_statements(false)
+    WHERE queryid IS NOT NULL
+      AND dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    GROUP BY queryid
+"""
+PG_TEXT_QUERY = """
+    SELECT queryid, MIN(LEFT(query, 4000))
+    FROM pg_stat_statements
+    WHERE queryid IS NOT NULL
+      AND dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    GROUP BY queryid
+"""
+
+# total_elapsed_time em microssegundos; hits = leituras lógicas que não foram ao disco
+SQLSERVER_COUNTERS_QUERY = """
+    SELECT query_hash, SUM(execution_count), SUM(total_elapsed_time) / 1000.0, SUM(total_rows),
+           SUM(total_logical_reads - total_physical_reads), SUM(total_physical_reads)
+    FROM sys.dm_exec_query_stats
+    GROUP BY query_hash
+"""
+SQLSERVER_TEXT_QUERY = """
+    SELECT qs.query_hash, MIN(LEFT(st.text, 4000))
+    FROM sys.dm_exec_query_stats qs
+    CROSS APPLY sys.dm_exec_sql_text(qs.sql_handle) st
+    GROUP BY qs.query_hash
+"""
+
+DIALECTS = {
+    "postgres": (PG_COUNTERS_QUERY, PG_TEXT_QUERY),
+    "sqlserver": (SQLSERVER_COUNTERS_QUERY, SQLSERVER_TEXT_QUERY),
+}
+
+# Comentário DBM (ddtrace / add_dbm_comment) identifica o serviço de origem
+_SERVICE = re.compile(r"ddps='([^']*)'")
+_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+
+def _fingerprint(value):
+    """queryid (int) ou query_hash (bytes) → chave em texto."""
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + bytes(value).hex()
+    return str(value)
+
+
+def service_of(text):
+    """Serviço de origem pelo comentário DBM (ddps='...'); vazio se não houver."""
+    match = _SERVICE.search(text or "")
+    return match.group(1) if match else ""
+
+
+class StatsCollector:
+    """Poll periódico das estatísticas cumulativas, gravando só os deltas."""
+
+    def __init__(self, dialect, connect, path=STATS_FILE, interval=STATS_INTERVAL):
+        self.counters_query, self.text_query = DIALECTS[dialect]
+        self.connect = connect
+        self.path = path
+        self.interval = interval
+        self.services = {}
+        self._conn = None
+        self._last = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.connect()
+            # Sem transação aberta entre polls
+            self._conn.autocommit = True
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _write_texts(self, cursor, fingerprints, now, out):
+        cursor.execute(self.text_query)
+        texts = {_fingerprint(fp): text or "" for fp, text in cursor.fetchall()}
+        for fp in fingerprints:
+            text = texts.get(fp, "")
+            self.services[fp] = service_of(text)
+            query = " ".join(_COMMENT.sub("", text).split())
+            out.write(json.dumps({"ts": round(now, 3), "fp": fp, "client_fp": text_fingerprint(text),
+                                  "service": self.services[fp], "query": query},
+                                 ensure_ascii=False) + "\n")
+
+    def poll(self, out):
+        """Lê os contadores, grava fingerprints novos e o delta do intervalo."""
+        now = time.time()
+        cursor = self._connection().cursor()
+        try:
+            cursor.execute(self.counters_query)
+            current = {_fingerprint(row[0]): tuple(float(v or 0) for v in row[1:])
+                       for row in cursor.fetchall()}
+            new = [fp for fp in current if fp not in self.services]
+            if new:
+                self._write_texts(cursor, new, now, out)
+        finally:
+            cursor.close()
+
+        first_poll = self._last is None
+        delta = {}
+        if not first_poll:
+            for fp, values in current.items():
+                previous = self._last.get(fp)
+                if previous is None or values[0] < previous[0]:
+                    # Fingerprint novo ou estatística resetada/evictada: conta tudo
+                    previous = (0.0,) * len(values)
+                if values[0] > previous[0]:
+                    delta[fp] = [round(c - p, 3) for c, p in zip(values, previous)]
+
+        self._last = current
+        if not first_poll:
+            out.write(json.dumps({"ts": round(now, 3), "interval": self.interval, "d": delta},
+                                 separators=(",", ":")) + "\n")
+        out.flush()
+        return delta
+
+    def run(self):
+        with open(self.path, "a", encoding="utf-8") as out:
+            while True:
+                started = time.perf_counter()
+                try:
+                    delta = self.poll(out)
+                    calls = sum(d[0] for d in delta.values())
+                    total_ms = sum(d[1] for d in delta.values())
+                    log("STATS", f"{len(delta)} queries ativas, {calls:.0f} calls, {total_ms:.0f}ms no servidor "
+                                 f"(coleta {(time.perf_counter() - started) * 1000:.0f}ms)")
+                except Exception as e:
+                    log_error("STATS", f"Falha no poll: {e}")
+                    self._disconnect()
+                time.sleep(self.interval)
+
+    def start(self):
+        """Inicia a coleta em background se STATS_FILE estiver definido."""
+        if not self.path:
+            return False
+        threading.Thread(target=self.run, daemon=True, name="StatsCollector").start()
+        announce("STATS", f"Coletando deltas a cada {self.interval:.0f}s em {self.path}")
+        return True
+
+
+def summarize(path, top=10):
+    """Custo no servidor por intervalo: as queries que mais gastaram tempo."""
+    labels = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if "fp" in entry:
+                service = entry["service"] or "-"
+                labels[entry["fp"]] = f"{service}: {entry['query'][:60]}"
+                continue
+            stamp = time.strftime("%H:%M:%S", time.localtime(entry["ts"]))
+            ranked = sorted(entry["d"].items(), key=lambda item: item[1][1], reverse=True)
+            print(f"── {stamp} ({len(ranked)} queries)")
+            for fp, (calls, ms, rows, hits, reads) in ranked[:top]:
+                print(f"    {ms:>9.1f}ms  calls {calls:>6.0f}  linhas {rows:>8.0f}  "
+                      f"hits {hits:>8.0f}  reads {reads:>6.0f}  {labels.get(fp, fp)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Uso: python stats_collector.py <arquivo> [top]")
+        sys.exit(1)
+    summarize(sys.argv[1], *(int(a) for a in sys.argv[2:]))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Batch de billing / atraso das parcelas, em chunks limitados e paralelos.
+
+A cada BILLING_INTERVAL segundos o job varre as parcelas vencidas de cada
+shard: uma query lê os limites dos chunks (o installment_id de cada
+BILLING_CHUNK_SIZE-ésima parcela vencida) e BILLING_WORKERS threads
+processam os chunks, cada um em um único statement (BILLING_CHUNK_SQL) —
+transação curta, com no máximo BILLING_CHUNK_SIZE linhas travadas. Parcelas
+pagas viram PAYMENT, a primeira entrada em atraso vira FEE e os contratos
+com mais de 90 dias de atraso passam a DEFAULTED.
+
+No fim de cada execução o job loga a janela do batch (duração, chunks,
+parcelas) e compara throughput e latência dos serviços online durante a
+janela com o mesmo intervalo logo antes — o impacto do batch na carga.
+
+Configuração:
+    BILLING_INTERVAL       intervalo entre execuções em segundos (0 → desligado, default)
+    BILLING_CHUNK_SIZE     parcelas por chunk (default 1000)
+    BILLING_WORKERS        chunks processados em paralelo (default 2)
+    BILLING_PAYMENT_RATE   probabilidade de uma parcela vencida ser paga (default 0.7)
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ddtrace import tracer
+
+import service_metrics
+from batch_logger import announce, log_error
+from retry_policy import call_with_retry
+from queries import BILLING_CHUNKS_SQL, BILLING_CHUNK_SQL
+
+BILLING_INTERVAL = float(os.getenv("BILLING_INTERVAL", 0))
+BILLING_CHUNK_SIZE = int(os.getenv("BILLING_CHUNK_SIZE", 1000))
+BILLING_WORKERS = int(os.getenv("BILLING_WORKERS", 2))
+BILLING_PAYMENT_RATE = float(os.getenv("BILLING_PAYMENT_RATE", 0.7))
+
+SERVICE = "Billing Batch"
+CHUNK_SERVICE = "Billing Chunk"
+
+# installment_id é SERIAL (int4): limite superior do último chunk
+_MAX_ID = 2 ** 31 - 1
+
+# Janela mínima de comparação com os serviços online (segundos)
+_MIN_BASELINE = 30
+
+
+class BillingBatch:
+    """Execuções periódicas do billing, com os chunks distribuídos entre workers."""
+
+    def __init__(self, shards, interval=BILLING_INTERVAL, chunk_size=BILLING_CHUNK_SIZE,
+                 workers=BILLING_WORKERS, payment_rate=BILLING_PAYMENT_RATE):
+        self.shards = shards
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.payment_rate = payment_rate
+        self.reports = []
+
+    def chunks(self, shard):
+        """Faixas (após, até] de installment_id com até chunk_size parcelas vencidas cada."""
+        with self.shards.connection(shard) as conn:
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute(BILLING_CHUNKS_SQL, (self.chunk_size,))
+            bounds = [row[0] for row in cur.fetchall()]
+            cur.close()
+        starts = [0] + bounds
+        return [(shard, after, until) for after, until in zip(starts, bounds + [_MAX_ID])]
+
+    def run_chunk(self, shard, after, until):
+        """Processa um chunk em um statement; retorna (pagas, em atraso)."""
+        with tracer.trace("billing.chunk", service="credit-product-pg", resource="billing.chunk") as span:
+            span.set_tag("db.shard", shard)
+            with self.shards.connection(shard) as conn:
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(BILLING_CHUNK_SQL, (self.payment_rate, after, until))
+                paid, overdue = cur.fetchone()
+                cur.close()
+            span.set_tag("billing.rows", paid + overdue)
+        return paid, overdue
+
+    def _timed_chunk(self, shard, after, until):
+        started = time.perf_counter()
+        try:
+            result = call_with_retry(CHUNK_SERVICE, self.run_chunk, shard, after, until)
+        except Exception:
+            service_metrics.record(CHUNK_SERVICE, time.perf_counter() - started, ok=False)
+            raise
+        service_metrics.record(CHUNK_SERVICE, time.perf_counter() - started)
+        return result
+
+    def run_once(self):
+        """Uma execução completa do batch em todos os shards."""
+        started = time.time()
+        chunks = [chunk for shard in range(self.shards.count) for chunk in self.chunks(shard)]
+        paid = overdue = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="Billing") as executor:
+            futures = [executor.submit(self._timed_chunk, *chunk) for chunk in chunks]
+            for future in futures:
+                try:
+                    chunk_paid, chunk_overdue = future.result()
+                    paid += chunk_paid
+                    overdue += chunk_overdue
+                except Exception as e:
+                    failed += 1
+                    log_error(SERVICE, f"Chunk falhou: {e}")
+        ended = time.time()
+        service_metrics.record(SERVICE, ended - started, ok=not failed)
+        report = self.report(started, ended, len(chunks), paid, overdue, failed)
+        self.reports.append(report)
+        return report
+
+    def report(self, started, ended, chunks, paid, overdue, failed):
+        window = ended - started
+        baseline = max(window, _MIN_BASELINE)
+        before = service_metrics.window(started - baseline, started)
+        during = service_metrics.window(started, ended)
+        chunk_stats = during.get(CHUNK_SERVICE, {"p50_ms": 0.0, "p99_ms": 0.0})
+
+        lines = [f"🧾 Billing: {paid + overdue} parcelas ({paid} pagas, {overdue} em atraso) "
+                 f"em {chunks} chunks × {self.chunk_size}, {self.workers} workers — "
+                 f"janela {window:.1f}s, chunk p50 {chunk_stats['p50_ms']:.0f}ms / "
+                 f"p99 {chunk_stats['p99_ms']:.0f}ms, {failed} chunks com falha"]
+        services = {}
+        for service in sorted(set(before) | set(during)):
+            if service in (SERVICE, CHUNK_SERVICE):
+                continue
+            b = before.get(service) or {"ops_per_s": 0.0, "p95_ms": 0.0, "errors": 0}
+            d = during.get(service) or {"ops_per_s": 0.0, "p95_ms": 0.0, "errors": 0}
+            services[service] = {"baseline": b, "batch": d}
+            lines.append(
+                f"    {service:<28} ops/s {b['ops_per_s']:>7.2f} → {d['ops_per_s']:>7.2f}  "
+                f"p95 {b['p95_ms']:>7.1f} → {d['p95_ms']:>7.1f}ms  "
+                f"erros {b['errors']} → {d['errors']}"
+            )
+        announce("BILLING", "\n".join(lines))
+        return {"started": started, "ended": ended, "chunks": chunks, "paid": paid,
+                "overdue": overdue, "failed": failed, "services": services}
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                log_error(SERVICE, f"Falha no batch: {e}")
+
+    def start(self):
+        """Inicia as execuções periódicas se BILLING_INTERVAL > 0."""
+        if not self.interval:
+            return False
+        threading.Thread(target=self.run, daemon=True, name="BillingBatch").start()
+        announce("BILLING", f"Batch a cada {self.interval:.0f}s "
+                            f"(chunks de {self.chunk_size}, {self.workers} workers)")
+        return True
@@ -1,19 +1,50 @@
 #!/usr/bin/env python3
 """
 Simulador de Produto de Crédito — PostgreSQL
-5 serviços concorrentes com Datadog APM + DBM Propagation.
+6 serviços concorrentes + batch de billing com Datadog APM + DBM Propagation.
 """
 
 import os
 import time
 import random
 import threading
+from decimal import Decimal
+
 import psycopg2
 from psycopg2 import sql
-from ddtrace import tracer, patch_all
-
-# Instrumentação automática (psycopg2 + DBM Propagation)
-patch_all()
+from ddtrace import tracer
+
+from batch_logger import log, log_error, announce, flush as flush_logs, LOG_MODE
+from service_metrics import record
+from retry_policy import call_with_retry, error_class_of, failure_pause
+from concurrency_limit import call_with_limit, start_report as start_limit_report
+from incident_engine import IncidentEngine, Scenario, Role
+from sharding import ShardMap, SHARD_POOL_MAX
+from queries import (
+    CREATE_PROPOSAL_SQL, AUDIT_PROPOSAL_SQL, PENDING_PROPOSAL_SQL, CUSTOMER_SCORE_SQL,
+    APPROVE_PROPOSAL_SQL, INSERT_ANALYSIS_SQL, CUSTOMER_LOOKUP_SQL,
+    RISK_ANALYSIS_SQL, RISK_ANALYSIS_PARTIAL_SQL,
+    SERVICE_PERFORMANCE_SQL, SERVICE_PERFORMANCE_PARTIAL_SQL,
+    DISBURSE_CONTRACTS_SQL, BILLING_CHUNKS_SQL, BILLING_CHUNK_SQL,
+    create_proposal, approve_next_pending,
+)
+from result_stream import RESULT_MODE, RESULT_FETCH_SIZE
+from stats_collector import StatsCollector
+from plan_monitor import PlanMonitor
+from query_fingerprint import start_export as start_fingerprint_export
+from lock_sampler import LockSampler
+from billing_batch import BillingBatch
+from audit_writer import AuditWriter
+from soak_monitor import SoakMonitor
+from fake_db import DB_BACKEND, install as install_fake_db
+from startup import instrument, wait_ready, report_first_operation
+
+# Backend em memória (DB_BACKEND=fake) entra antes do patch do ddtrace
+if DB_BACKEND == "fake":
+    install_fake_db(psycopg2)
+
+# Instrumentação só do psycopg2 + DBM Propagation (nenhuma com DD_TRACE_ENABLED=false)
+instrument(psycopg=True)
 
 # Configuração via variáveis de ambiente
 DB_CONFIG = {
@@ -22,27 +53,83 @@ DB_CONFIG = {
     "dbname": os.getenv("PGDATABASE", "creditdb"),
     "user": os.getenv("PGUSER", "app_user"),
     "password": os.getenv("PGPASSWORD", "AppUser123"),
+    # Identifica as sessões do simulador em pg_stat_activity (lock_sampler.py)
+    "application_name": os.getenv("PGAPPNAME", "credit-simulator"),
 }
 
+# Incidentes rodam com o usuário da aplicação por padrão
+INCIDENT_DB_CONFIG = dict(
+    DB_CONFIG,
+    user=os.getenv("INCIDENT_PGUSER", DB_CONFIG["user"]),
+    password=os.getenv("INCIDENT_PGPASSWORD", DB_CONFIG["password"]),
+    application_name="incident-engine",
+)
+# Coletor de pg_stat_statements: o app_user só enxerga os próprios statements
+STATS_DB_CONFIG = dict(
+    DB_CONFIG,
+    user=os.getenv("STATS_PGUSER", DB_CONFIG["user"]),
+    password=os.getenv("STATS_PGPASSWORD", DB_CONFIG["password"]),
+)
+
+# Liberação de contratos: propostas aprovadas por operação e retroatividade
+# máxima da liberação (parcelas já vencidas para o billing)
+DISBURSE_BATCH_SIZE = int(os.getenv("DISBURSE_BATCH_SIZE", 20))
+CONTRACT_BACKDATE_DAYS = int(os.getenv("CONTRACT_BACKDATE_DAYS", 180))
+
+# Threads por serviço: "1" (default, uma por serviço) ou "4" para todos, ou
+# por serviço, ex: "customer_lookup=8,proposal_approval=4" (demais = 1)
+SERVICE_WORKERS = os.getenv("SERVICE_WORKERS", "1")
+
+INCIDENT_SQL_DIR = os.getenv(
+    "INCIDENT_SQL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql")
+)
+
+# Cenários de sql/ disponíveis para o motor de incidentes
+INCIDENT_SCENARIOS = [
+    Scenario("blocking", [Role("02_blocking.sql", "hold"), Role("02_blocking_session2.sql", "loop")], 1.0),
+    Scenario("deadlock", [Role("03_deadlock_sessionA.sql", "loop"), Role("03_deadlock_sessionB.sql", "loop")], 1.0),
+    Scenario("seq_scan", [Role("04_seq_scan.sql", "loop")], 2.0),
+    Scenario("slow_query", [Role("05_slow_query.sql", "loop")], 2.0),
+    Scenario("cpu_intensive", [Role("06_cpu_intensive.sql", "loop")], 1.0),
+]
+
 
 def get_connection():
     """Cria conexão com PostgreSQL."""
     return psycopg2.connect(**DB_CONFIG)
 
 
-def wait_for_db(max_retries=30, delay=2):
-    """Aguarda o PostgreSQL ficar disponível."""
-    for i in range(max_retries):
-        try:
-            conn = get_connection()
-            conn.close()
-            print("✅ PostgreSQL disponível!")
-            return True
-        except Exception as e:
-            print(f"⏳ Aguardando PostgreSQL... ({i+1}/{max_retries}): {e}")
-            time.sleep(delay)
-    print("❌ PostgreSQL não disponível após timeout")
-    return False
+# SQL de cada serviço, para o lock_sampler atribuir as sessões do pool
+# (compartilhado por todos os serviços) pelo fingerprint da query
+SERVICE_QUERIES = {
+    CREATE_PROPOSAL_SQL: "Proposal Creation",
+    AUDIT_PROPOSAL_SQL: "Proposal Creation",
+    PENDING_PROPOSAL_SQL: "Proposal Approval",
+    CUSTOMER_SCORE_SQL: "Proposal Approval",
+    APPROVE_PROPOSAL_SQL: "Proposal Approval",
+    INSERT_ANALYSIS_SQL: "Proposal Approval",
+    CUSTOMER_LOOKUP_SQL: "Customer Lookup",
+    RISK_ANALYSIS_SQL: "Risk Analysis",
+    RISK_ANALYSIS_PARTIAL_SQL: "Risk Analysis",
+    SERVICE_PERFORMANCE_SQL: "Service Performance",
+    SERVICE_PERFORMANCE_PARTIAL_SQL: "Service Performance",
+    DISBURSE_CONTRACTS_SQL: "Contract Disbursement",
+    BILLING_CHUNKS_SQL: "Billing Batch",
+    BILLING_CHUNK_SQL: "Billing Batch",
+}
+
+
+# Pool por shard (SHARD_DSNS); sem shards configurados, um único pool em PGHOST
+SHARDS = ShardMap.from_env(DB_CONFIG)
+
+# Auditoria write-behind (AUDIT_MODE=async): audit_log não tem chave de cliente,
+# então o flusher grava tudo no shard 0
+AUDIT = AuditWriter("postgres", lambda: psycopg2.connect(
+    SHARDS.dsns[0], **dict(SHARDS.connect_kwargs, application_name="audit-writer")
+))
+
+# Planos das queries de cada resource, capturados no shard 0 (PLAN_INTERVAL)
+PLANS = PlanMonitor("postgres", lambda: SHARDS.connect(0))
 
 
 # ═══════════════════════════════════════════════════════════
@@ -51,33 +138,31 @@ def wait_for_db(max_retries=30, delay=2):
 @tracer.wrap(service="credit-product-pg", resource="proposal.create")
 def proposal_creation():
     """Cria novas propostas de crédito."""
-    conn = get_connection()
-    conn.autocommit = True
-    cur = conn.cursor()
-
     customer_id = random.randint(1, 10000)
     amount = round(random.uniform(1000, 50000), 2)
     installments = random.choice([12, 24, 36, 48])
     proposal_type = random.choice(["PERSONAL", "PAYROLL", "VEHICLE", "HOME_EQUITY"])
     risk_score = random.randint(300, 900)
 
-    cur.execute("""
-        INSERT INTO credit_proposals
-            (customer_id, requested_amount, installment_count, status, proposal_type)
-        VALUES (%s, %s, %s, 'PENDING', %s)
-        RETURNING proposal_id
-    """, (customer_id, amount, installments, proposal_type))
+    shard = SHARDS.shard_for(customer_id)
+    _tag_shard(shard)
+    with SHARDS.connection(shard) as conn:
+        # Proposta e auditoria em uma transação: se a auditoria falhar, o retry
+        # não duplica a proposta (sem commit, o pool faz rollback na devolução)
+        conn.autocommit = False
+        cur = conn.cursor()
 
-    proposal_id = cur.fetchone()[0]
+        # Audit log: na requisição ou na fila do write-behind (AUDIT_MODE)
+        proposal_id = create_proposal(cur, customer_id, amount, installments, proposal_type,
+                                      audit=not AUDIT.enabled)
 
-    # Audit log
-    cur.execute("""
-        INSERT INTO audit_log (entity_type, entity_id, action, user_service)
-        VALUES ('PROPOSAL', %s, 'CREATE', 'proposal-service')
-    """, (proposal_id,))
-
-    cur.close()
-    conn.close()
+        conn.commit()
+        cur.close()
+    if AUDIT.enabled:
+        AUDIT.submit("PROPOSAL", proposal_id, "CREATE", "proposal-service", {
+            "customer_id": customer_id, "requested_amount": amount,
+            "installment_count": installments, "proposal_type": proposal_type,
+        })
     return proposal_id
 
 
@@ -87,68 +172,19 @@ def proposal_creation():
 @tracer.wrap(service="credit-product-pg", resource="proposal.approve")
 def proposal_approval():
     """Processa e aprova/rejeita propostas pendentes."""
-    conn = get_connection()
-    conn.autocommit = True
-    cur = conn.cursor()
-
-    # Busca proposta pendente
-    cur.execute("""
-        SELECT proposal_id, requested_amount, customer_id
-        FROM credit_proposals
-        WHERE status = 'PENDING'
-        ORDER BY created_at ASC
-        LIMIT 1
-    """)
-
-    row = cur.fetchone()
-    if not row:
-        cur.close()
-        conn.close()
-        return None
+    # Proposta e cliente ficam no mesmo shard (roteados por customer_id);
+    # a fila de pendentes é consumida de um shard por vez
+    shard = SHARDS.any_shard()
+    _tag_shard(shard)
+    with SHARDS.connection(shard) as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        # Proposta pendente mais antiga → score do cliente → decisão → análise
+        proposal_id = approve_next_pending(cur, random.randint(50, 500))
+        PLANS.observe("proposal.approve", "Proposal Approval", PENDING_PROPOSAL_SQL)
 
-    proposal_id, amount, customer_id = row
-
-    # Busca score do cliente
-    cur.execute("SELECT credit_score FROM customers WHERE customer_id = %s", (customer_id,))
-    score_row = cur.fetchone()
-    score = score_row[0] if score_row else 500
-
-    # Lógica de aprovação
-    if score < 400:
-        status = "REJECTED"
-        approved = None
-    elif score < 600:
-        status = "APPROVED"
-        approved = round(float(amount) * 0.8, 2)
-    else:
-        status = "APPROVED"
-        approved = float(amount)
-
-    cur.execute("""
-        UPDATE credit_proposals
-        SET status = %s,
-            approved_amount = %s,
-            analyzed_at = NOW(),
-            analyzed_by = 'approval-service',
-            updated_at = NOW()
-        WHERE proposal_id = %s
-    """, (status, approved, proposal_id))
-
-    # Registra análise
-    cur.execute("""
-        INSERT INTO credit_analysis
-            (proposal_id, analysis_type, score, risk_level, recommendation, processing_time_ms)
-        VALUES (%s, 'AUTO', %s, %s, %s, %s)
-    """, (
-        proposal_id,
-        score,
-        "LOW" if score > 700 else "MEDIUM" if score > 500 else "HIGH",
-        status,
-        random.randint(50, 500)
-    ))
-
-    cur.close()
-    conn.close()
+        cur.close()
     return proposal_id
 
 
@@ -158,26 +194,19 @@ def proposal_approval():
 @tracer.wrap(service="credit-product-pg", resource="customer.lookup")
 def customer_lookup():
     """Consulta histórico de crédito do cliente."""
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cpf = str(random.randint(1, 10000)).zfill(11)
-
-    cur.execute("""
-        SELECT
-            c.customer_id, c.full_name, c.cpf, c.email, c.credit_score,
-            COUNT(p.proposal_id) AS total_proposals,
-            SUM(CASE WHEN p.status = 'APPROVED' THEN 1 ELSE 0 END) AS approved_count,
-            COALESCE(SUM(CASE WHEN p.status = 'APPROVED' THEN p.approved_amount ELSE 0 END), 0) AS total_credit
-        FROM customers c
-        LEFT JOIN credit_proposals p ON c.customer_id = p.customer_id
-        WHERE c.cpf = %s
-        GROUP BY c.customer_id, c.full_name, c.cpf, c.email, c.credit_score
-    """, (cpf,))
-
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
+    customer_id = random.randint(1, 10000)
+    cpf = str(customer_id).zfill(11)
+
+    shard = SHARDS.shard_for(customer_id)
+    _tag_shard(shard)
+    with SHARDS.read_connection(shard) as conn:
+        cur = conn.cursor()
+
+        cur.execute(CUSTOMER_LOOKUP_SQL, (cpf,))
+        PLANS.observe("customer.lookup", "Customer Lookup", CUSTOMER_LOOKUP_SQL, (cpf,))
+
+        result = cur.fetchone()
+        cur.close()
     return result
 
 
@@ -187,28 +216,22 @@ def customer_lookup():
 @tracer.wrap(service="credit-product-pg", resource="risk.analysis")
 def risk_analysis():
     """Análise de distribuição de risco das propostas."""
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT
-            proposal_type,
-            status,
-            COUNT(*) AS proposal_count,
-            ROUND(AVG(ca.score)::numeric, 0) AS avg_risk_score,
-            ROUND(AVG(cp.requested_amount)::numeric, 2) AS avg_amount,
-            COALESCE(SUM(CASE WHEN cp.status = 'APPROVED' THEN cp.approved_amount ELSE 0 END), 0) AS total_approved
-        FROM credit_proposals cp
-        LEFT JOIN credit_analysis ca ON ca.proposal_id = cp.proposal_id
-        WHERE cp.created_at >= NOW() - INTERVAL '30 days'
-        GROUP BY proposal_type, cp.status
-        ORDER BY proposal_type, cp.status
-    """)
-
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-    return results
+    if SHARDS.count == 1:
+        PLANS.observe("risk.analysis", "Risk Analysis", RISK_ANALYSIS_SQL)
+        # Já agregado no servidor: as poucas linhas são o próprio relatório
+        return SHARDS.query(0, RISK_ANALYSIS_SQL, read_only=True, service="Risk Analysis", consume=list)
+
+    PLANS.observe("risk.analysis", "Risk Analysis", RISK_ANALYSIS_PARTIAL_SQL)
+    partials = SHARDS.scatter(RISK_ANALYSIS_PARTIAL_SQL, read_only=True, service="Risk Analysis",
+                              consume=_fold_partials(2))
+    merged = _merge_partials(partials, key_size=2)
+    results = [
+        (proposal_type, status, count,
+         _avg(sum_score, count_score, 0), _avg(sum_amount, count_amount, 2), total_approved)
+        for (proposal_type, status), (count, sum_score, count_score, sum_amount, count_amount, total_approved)
+        in merged.items()
+    ]
+    return sorted(results, key=lambda r: (r[0] or "", r[1] or ""))
 
 
 # ═══════════════════════════════════════════════════════════
@@ -217,45 +240,132 @@ def risk_analysis():
 @tracer.wrap(service="credit-product-pg", resource="service.performance")
 def service_performance():
     """Relatório de performance por tipo de produto."""
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT
-            cp.proposal_type,
-            COUNT(cp.proposal_id) AS total_proposals,
-            COUNT(CASE WHEN cp.status = 'APPROVED' THEN 1 END) AS approved_count,
-            ROUND(
-                COUNT(CASE WHEN cp.status = 'APPROVED' THEN 1 END) * 100.0 / NULLIF(COUNT(*), 0), 2
-            ) AS approval_rate,
-            ROUND(AVG(cp.requested_amount)::numeric, 2) AS avg_requested,
-            ROUND(AVG(cp.approved_amount)::numeric, 2) AS avg_approved,
-            ROUND(AVG(ca.processing_time_ms)::numeric, 0) AS avg_processing_ms
-        FROM credit_proposals cp
-        LEFT JOIN credit_analysis ca ON ca.proposal_id = cp.proposal_id
-        GROUP BY cp.proposal_type
-        ORDER BY approval_rate DESC
-    """)
-
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-    return results
+    if SHARDS.count == 1:
+        PLANS.observe("service.performance", "Service Performance", SERVICE_PERFORMANCE_SQL)
+        return SHARDS.query(0, SERVICE_PERFORMANCE_SQL, read_only=True, service="Service Performance",
+                            consume=list)
+
+    PLANS.observe("service.performance", "Service Performance", SERVICE_PERFORMANCE_PARTIAL_SQL)
+    partials = SHARDS.scatter(SERVICE_PERFORMANCE_PARTIAL_SQL, read_only=True, service="Service Performance",
+                              consume=_fold_partials(1))
+    merged = _merge_partials(partials, key_size=1)
+    results = []
+    for (proposal_type,), (total, approved_count, total_rows, sum_req, cnt_req,
+                           sum_appr, cnt_appr, sum_proc, cnt_proc) in merged.items():
+        approval_rate = round(Decimal(approved_count) * 100 / total_rows, 2) if total_rows else None
+        results.append((
+            proposal_type, total, approved_count, approval_rate,
+            _avg(sum_req, cnt_req, 2), _avg(sum_appr, cnt_appr, 2), _avg(sum_proc, cnt_proc, 0),
+        ))
+    # NULL por último, como no ORDER BY ... DESC do PostgreSQL
+    return sorted(results, key=lambda r: (r[3] is not None, r[3] or 0), reverse=True)
+
+
+# ═══════════════════════════════════════════════════════════
+# Serviço 6: Liberação de Contratos
+# ═══════════════════════════════════════════════════════════
+@tracer.wrap(service="credit-product-pg", resource="contract.disburse")
+def contract_disbursement():
+    """Converte propostas aprovadas em contratos, com cronograma de parcelas."""
+    shard = SHARDS.any_shard()
+    _tag_shard(shard)
+    with SHARDS.connection(shard) as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        # Contratos, parcelas e transações em um statement (set-based)
+        cur.execute(DISBURSE_CONTRACTS_SQL, (CONTRACT_BACKDATE_DAYS, DISBURSE_BATCH_SIZE))
+        contracts, installments = cur.fetchone()
+
+        cur.close()
+    span = tracer.current_span()
+    if span:
+        span.set_tag("contracts.count", contracts)
+        span.set_tag("installments.count", installments)
+    return contracts
+
+
+# ── Scatter-gather: junta agregados parciais dos shards ──
+def _merge_partials(partials, key_size):
+    """Soma coluna a coluna as linhas de mesma chave vindas de cada shard."""
+    merged = {}
+    for rows in partials:
+        for row in rows:
+            key, values = tuple(row[:key_size]), row[key_size:]
+            current = merged.get(key)
+            merged[key] = list(values) if current is None else [
+                (a or 0) + (b or 0) if (a is not None or b is not None) else None
+                for a, b in zip(current, values)
+            ]
+    return merged
+
+
+def _fold_partials(key_size):
+    """Consumidor por shard: soma as linhas parciais à medida que saem do cursor."""
+    return lambda rows: [key + tuple(values) for key, values in _merge_partials([rows], key_size).items()]
+
+
+def _avg(total, count, digits):
+    if not count or total is None:
+        return None
+    return round(Decimal(total) / count, digits)
+
+
+def _tag_shard(shard):
+    span = tracer.current_span()
+    if span:
+        span.set_tag("db.shard", shard)
 
 
 # ═══════════════════════════════════════════════════════════
 # Workers (threads)
 # ═══════════════════════════════════════════════════════════
+SERVICES = [
+    ("Proposal Creation",   proposal_creation,   (4, 8)),    # ~10/min
+    ("Proposal Approval",   proposal_approval,    (3, 5)),    # ~15/min
+    ("Customer Lookup",     customer_lookup,      (0.8, 1.5)),# ~50/min
+    ("Risk Analysis",       risk_analysis,        (10, 15)),  # ~5/min
+    ("Service Performance", service_performance,  (15, 25)),  # ~3/min
+    ("Contract Disbursement", contract_disbursement, (5, 10)), # ~8/min
+]
+
+
+def service_key(name):
+    """'Customer Lookup' → 'customer_lookup' (nome usado em SERVICE_WORKERS)."""
+    return name.lower().replace(" ", "_")
+
+
+def parse_workers(spec, default=1):
+    """'4' → 4 para todos; 'customer_lookup=8,risk_analysis=2' → só esses (demais = default)."""
+    spec = spec.strip()
+    if not spec:
+        return {name: default for name, _, _ in SERVICES}
+    if "=" not in spec:
+        return {name: int(spec) for name, _, _ in SERVICES}
+    names = {service_key(name): name for name, _, _ in SERVICES}
+    workers = {name: default for name, _, _ in SERVICES}
+    for part in spec.split(","):
+        key, value = part.split("=")
+        key = key.strip()
+        if key not in names:
+            raise ValueError(f"Serviço desconhecido: {key} (opções: {', '.join(names)})")
+        workers[names[key]] = int(value)
+    return workers
+
+
 def run_service(name, func, interval_range):
     """Loop contínuo para um serviço."""
-    print(f"  🔄 [{name}] iniciado (intervalo: {interval_range}s)")
+    announce(name, f"🔄 iniciado (intervalo: {interval_range}s)")
     while True:
+        started = time.perf_counter()
         try:
-            result = func()
-            status = "✓" if result else "○"
-            print(f"  {status} [{name}] executado")
+            result = call_with_limit(name, call_with_retry, name, func)
+            record(name, time.perf_counter() - started)
+            log(name, "✓ executado" if result else "○ executado")
         except Exception as e:
-            print(f"  ✗ [{name}] erro: {e}")
+            record(name, time.perf_counter() - started, ok=False)
+            log_error(name, f"✗ erro ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
         time.sleep(random.uniform(*interval_range))
 
 
@@ -267,39 +377,74 @@ def main():
     print(f"  Database: {DB_CONFIG['dbname']}")
     print(f"  User: {DB_CONFIG['user']}")
     print(f"  DBM Propagation: ✅ ATIVO (psycopg2)")
+    print(f"  Log mode: {LOG_MODE}")
+    print(f"  Shards: {SHARDS.count} ({SHARDS.strategy if SHARDS.count > 1 else 'desativado'})")
+    print(f"  Réplicas de leitura: {sum(len(r.replicas) for r in SHARDS.readers)}")
+    print(f"  Leitura de resultados: {RESULT_MODE} (fetch size {RESULT_FETCH_SIZE})")
+    print(f"  Liberação: {DISBURSE_BATCH_SIZE} contratos/operação (retroativa até {CONTRACT_BACKDATE_DAYS} dias)")
+    workers = parse_workers(SERVICE_WORKERS)
+    print(f"  Threads por serviço: {', '.join(f'{service_key(n)}={w}' for n, w in workers.items())}")
+    if sum(workers.values()) > SHARD_POOL_MAX:
+        print(f"  ⚠️  {sum(workers.values())} threads de serviço > SHARD_POOL_MAX={SHARD_POOL_MAX} (pool esgota)")
+    if DB_BACKEND == "fake":
+        print("  Backend: 🧪 em memória (fake_db.py), sem banco")
     print("=" * 60)
 
-    # Aguarda banco
-    if not wait_for_db():
+    # Banco e Datadog Agent prontos (probes com backoff, sem sleep fixo)
+    if not wait_ready(get_connection, "PostgreSQL"):
         return
+    report_first_operation()
 
-    # Aguarda Datadog Agent
-    print("⏳ Aguardando 10s para Datadog Agent...")
-    time.sleep(10)
+    # Auditoria write-behind antes dos serviços que enfileiram eventos (AUDIT_MODE=async)
+    AUDIT.start()
 
     # Inicia serviços em threads
-    services = [
-        ("Proposal Creation",   proposal_creation,   (4, 8)),    # ~10/min
-        ("Proposal Approval",   proposal_approval,    (3, 5)),    # ~15/min
-        ("Customer Lookup",     customer_lookup,      (0.8, 1.5)),# ~50/min
-        ("Risk Analysis",       risk_analysis,        (10, 15)),  # ~5/min
-        ("Service Performance", service_performance,  (15, 25)),  # ~3/min
-    ]
-
     print("\n🚀 Iniciando serviços:")
     threads = []
-    for name, func, interval in services:
-        t = threading.Thread(target=run_service, args=(name, func, interval), daemon=True)
-        t.start()
-        threads.append(t)
+    for name, func, interval in SERVICES:
+        for i in range(workers[name]):
+            t = threading.Thread(target=run_service, args=(name, func, interval), daemon=True,
+                                 name=f"{service_key(name)}-{i + 1}")
+            t.start()
+            threads.append(t)
+
+    print(f"\n✅ {len(SERVICES)} serviços rodando em {len(threads)} threads. Ctrl+C para parar.\n")
+
+    # Incidentes concorrentes com a carga (INCIDENT_SCHEDULE / INCIDENT_TRIGGER_FILE)
+    incidents = IncidentEngine(
+        lambda: psycopg2.connect(**INCIDENT_DB_CONFIG), INCIDENT_SQL_DIR, INCIDENT_SCENARIOS
+    )
+    incidents.start()
+
+    # Deltas de pg_stat_statements em arquivo local (STATS_FILE)
+    StatsCollector("postgres", lambda: psycopg2.connect(**STATS_DB_CONFIG)).start()
+
+    # Troca de plano x regressão de latência por resource (PLAN_INTERVAL)
+    PLANS.start()
+
+    # Estatísticas por fingerprint no cliente (FINGERPRINT_EXPORT)
+    start_fingerprint_export()
+
+    # Cadeias de bloqueio por serviço (LOCK_SAMPLE_INTERVAL)
+    LockSampler("postgres", lambda: psycopg2.connect(**dict(STATS_DB_CONFIG, application_name="lock-sampler")),
+                SERVICE_QUERIES).start()
+
+    # Limite adaptativo de concorrência por serviço e do processo (CONCURRENCY_LIMIT)
+    start_limit_report()
+
+    # Billing / atraso das parcelas em chunks (BILLING_INTERVAL)
+    BillingBatch(SHARDS).start()
 
-    print(f"\n✅ {len(threads)} serviços rodando. Ctrl+C para parar.\n")
+    # Linha do tempo de recursos do processo e sessões por aplicação no shard 0 (SOAK_INTERVAL)
+    SoakMonitor("postgres", lambda: psycopg2.connect(**dict(STATS_DB_CONFIG, application_name="soak-monitor"))).start()
 
     # Mantém main thread viva
     try:
         while True:
             time.sleep(60)
     except KeyboardInterrupt:
+        AUDIT.close()
+        flush_logs()
         print("\n🛑 Parando simulação...")
 
 
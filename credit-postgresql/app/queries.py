@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+SQL dos serviços do simulador PostgreSQL.
+
+Centralizado aqui para que o simulador e o runner de experimentos de schema
+(schema_experiment.py) executem exatamente as mesmas queries — inclusive os
+passos de criação e aprovação de proposta (create_proposal,
+approve_next_pending), que recebem um cursor já aberto.
+"""
+
+# ── Serviço 1: Criação de Propostas ──
+CREATE_PROPOSAL_SQL = """
+    INSERT INTO credit_proposals
+        (customer_id, requested_amount, installment_count, status, proposal_type)
+    VALUES (%s, %s, %s, 'PENDING', %s)
+    RETURNING proposal_id
+"""
+
+AUDIT_PROPOSAL_SQL = """
+    INSERT INTO audit_log (entity_type, entity_id, action, user_service)
+    VALUES ('PROPOSAL', %s, 'CREATE', 'proposal-service')
+"""
+
+# ── Serviço 2: Aprovação de Propostas ──
+PENDING_PROPOSAL_SQL = """
+    SELECT proposal_id, requested_amount, customer_id
+    FROM credit_proposals
+    WHERE status = 'PENDING'
+    ORDER BY created_at ASC
+    LIMIT 1
+"""
+
+CUSTOMER_SCORE_SQL = "SELECT credit_score FROM customers WHERE customer_id = %s"
+
+APPROVE_PROPOSAL_SQL = """
+    UPDATE credit_proposals
+    SET status = %s,
+        approved_amount = %s,
+        analyzed_at = NOW(),
+        analyzed_by = 'approval-service',
+        updated_at = NOW()
+    WHERE proposal_id = %s
+"""
+
+INSERT_ANALYSIS_SQL = """
+    INSERT INTO credit_analysis
+        (proposal_id, analysis_type, score, risk_level, recommendation, processing_time_ms)
+    VALUES (%s, 'AUTO', %s, %s, %s, %s)
+"""
+
+
+def create_proposal(cur, customer_id, amount, installments, proposal_type, audit=True):
+    """Insere a proposta PENDING (e o audit_log, com audit=True); devolve o proposal_id."""
+    cur.execute(CREATE_PROPOSAL_SQL, (customer_id, amount, installments, proposal_type))
+    proposal_id = cur.fetchone()[0]
+    if audit:
+        cur.execute(AUDIT_PROPOSAL_SQL, (proposal_id,))
+    return proposal_id
+
+
+def approval_decision(score, amount):
+    """Regra de aprovação: score do cliente → (status, valor aprovado, nível de risco)."""
+    if score < 400:
+        status, approved = "REJECTED", None
+    elif score < 600:
+        status, approved = "APPROVED", round(float(amount) * 0.8, 2)
+    else:
+        status, approved = "APPROVED", float(amount)
+    risk = "LOW" if score > 700 else "MEDIUM" if score > 500 else "HIGH"
+    return status, approved, risk
+
+
+def approve_next_pending(cur, processing_ms):
+    """Aprova/rejeita a proposta pendente mais antiga; proposal_id, ou None com a fila vazia."""
+    cur.execute(PENDING_PROPOSAL_SQL)
+    row = cur.fetchone()
+    if not row:
+        return None
+    proposal_id, amount, customer_id = row
+
+    cur.execute(CUSTOMER_SCORE_SQL, (customer_id,))
+    score_row = cur.fetchone()
+    score = score_row[0] if score_row else 500
+
+    status, approved, risk = approval_decision(score, amount)
+    cur.execute(APPROVE_PROPOSAL_SQL, (status, approved, proposal_id))
+    cur.execute(INSERT_ANALYSIS_SQL, (proposal_id, score, risk, status, processing_ms))
+    return proposal_id
+
+# ── Serviço 3: Consulta de Cliente ──
+# Nas leituras, proposta liberada (DISBURSED) continua contando como aprovada
+CUSTOMER_LOOKUP_SQL = """
+    SELECT
+        c.customer_id, c.full_name, c.cpf, c.email, c.credit_score,
+        COUNT(p.proposal_id) AS total_proposals,
+        SUM(CASE WHEN p.status IN ('APPROVED', 'DISBURSED') THEN 1 ELSE 0 END) AS approved_count,
+        COALESCE(SUM(CASE WHEN p.status IN ('APPROVED', 'DISBURSED') THEN p.approved_amount ELSE 0 END), 0) AS total_credit
+    FROM customers c
+    LEFT JOIN credit_proposals p ON c.customer_id = p.customer_id
+    WHERE c.cpf = %s
+    GROUP BY c.customer_id, c.full_name, c.cpf, c.email, c.credit_score
+"""
+
+# ── Serviço 4: Análise de Risco ──
+RISK_ANALYSIS_SQL = """
+    SELECT
+        proposal_type,
+        status,
+        COUNT(*) AS proposal_count,
+        ROUND(AVG(ca.score)::numeric, 0) AS avg_risk_score,
+        ROUND(AVG(cp.requested_amount)::numeric, 2) AS avg_amount,
+        COALESCE(SUM(CASE WHEN cp.status IN ('APPROVED', 'DISBURSED') THEN cp.approved_amount ELSE 0 END), 0) AS total_approved
+    FROM credit_proposals cp
+    LEFT JOIN credit_analysis ca ON ca.proposal_id = cp.proposal_id
+    WHERE cp.created_at >= NOW() - INTERVAL '30 days'
+    GROUP BY proposal_type, cp.status
+    ORDER BY proposal_type, cp.status
+"""
+
+# Agregados parciais (somas e contagens) para juntar entre shards
+RISK_ANALYSIS_PARTIAL_SQL = """
+    SELECT
+        proposal_type,
+        status,
+        COUNT(*) AS proposal_count,
+        SUM(ca.score) AS sum_score,
+        COUNT(ca.score) AS count_score,
+        SUM(cp.requested_amount) AS sum_amount,
+        COUNT(cp.requested_amount) AS count_amount,
+        COALESCE(SUM(CASE WHEN cp.status IN ('APPROVED', 'DISBURSED') THEN cp.approved_amount ELSE 0 END), 0) AS total_approved
+    FROM credit_proposals cp
+    LEFT JOIN credit_analysis ca ON ca.proposal_id = cp.proposal_id
+    WHERE cp.created_at >= NOW() - INTERVAL '30 days'
+    GROUP BY proposal_type, cp.status
+"""
+
+# ── Serviço 5: Performance por Produto ──
+SERVICE_PERFORMANCE_SQL = """
+    SELECT
+        cp.proposal_type,
+        COUNT(cp.proposal_id) AS total_proposals,
+        COUNT(CASE WHEN cp.status IN ('APPROVED', 'DISBURSED') THEN 1 END) AS approved_count,
+        ROUND(
+            COUNT(CASE WHEN cp.status IN ('APPROVED', 'DISBURSED') THEN 1 END) * 100.0 / NULLIF(COUNT(*), 0), 2
+        ) AS approval_rate,
+        ROUND(AVG(cp.requested_amount)::numeric, 2) AS avg_requested,
+        ROUND(AVG(cp.approved_amount)::numeric, 2) AS avg_approved,
+        ROUND(AVG(ca.processing_time_ms)::numeric, 0) AS avg_processing_ms
+    FROM credit_proposals cp
+    LEFT JOIN credit_analysis ca ON ca.proposal_id = cp.proposal_id
+    GROUP BY cp.proposal_type
+    ORDER BY approval_rate DESC
+"""
+
+SERVICE_PERFORMANCE_PARTIAL_SQL = """
+    SELECT
+        cp.proposal_type,
+        COUNT(cp.proposal_id) AS total_proposals,
+        COUNT(CASE WHEN cp.status IN ('APPROVED', 'DISBURSED') THEN 1 END) AS approved_count,
+        COUNT(*) AS total_rows,
+        SUM(cp.requested_amount) AS sum_requested,
+        COUNT(cp.requested_amount) AS count_requested,
+        SUM(cp.approved_amount) AS sum_approved,
+        COUNT(cp.approved_amount) AS count_approved,
+        SUM(ca.processing_time_ms) AS sum_processing,
+        COUNT(ca.processing_time_ms) AS count_processing
+    FROM credit_proposals cp
+    LEFT JOIN credit_analysis ca ON ca.proposal_id = cp.proposal_id
+    GROUP BY cp.proposal_type
+"""
+
+# ── Serviço 6: Liberação de Contratos ──
+# Propostas aprovadas viram contrato (tabela Price), com o cronograma de
+# parcelas gerado por generate_series e a transação de liberação — tudo em um
+# statement. A data de liberação é retroativa em até %s dias, para que parte
+# das parcelas já esteja vencida quando o billing rodar.
+DISBURSE_CONTRACTS_SQL = """
+    WITH approved AS (
+        SELECT proposal_id, approved_amount,
+               COALESCE(interest_rate, 2.5) AS rate,
+               COALESCE(installment_count, 12) AS installment_count,
+               NOW() - (random() * %s)::int * INTERVAL '1 day' AS disbursed_at
+        FROM credit_proposals
+        WHERE status = 'APPROVED' AND approved_amount IS NOT NULL
+        ORDER BY proposal_id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ),
+    disbursed AS (
+        UPDATE credit_proposals p
+        SET status = 'DISBURSED', updated_at = NOW()
+        FROM approved a
+        WHERE p.proposal_id = a.proposal_id
+    ),
+    contracts AS (
+        INSERT INTO credit_contracts
+            (proposal_id, contract_number, principal_amount, interest_rate, installment_count,
+             installment_value, first_due_date, status, disbursed_at)
+        SELECT proposal_id,
+               'CT' || LPAD(proposal_id::text, 10, '0'),
+               approved_amount, rate, installment_count,
+               ROUND(approved_amount * (rate / 100) / (1 - POWER(1 + rate / 100, -installment_count)), 2),
+               (disbursed_at + INTERVAL '1 month')::date,
+               'ACTIVE', disbursed_at
+        FROM approved
+        RETURNING contract_id, principal_amount, installment_count, installment_value, first_due_date
+    ),
+    schedule AS (
+        INSERT INTO installments (contract_id, installment_number, due_date, amount, status)
+        SELECT c.contract_id, n, (c.first_due_date + (n - 1) * INTERVAL '1 month')::date,
+               c.installment_value, 'PENDING'
+        FROM contracts c
+        CROSS JOIN LATERAL generate_series(1, c.installment_count) AS n
+    ),
+    posted AS (
+        INSERT INTO credit_transactions (contract_id, transaction_type, amount, description, processed_by)
+        SELECT contract_id, 'DISBURSEMENT', principal_amount, 'Liberação do contrato', 'disbursement-service'
+        FROM contracts
+    )
+    SELECT COUNT(*), COALESCE(SUM(installment_count), 0) FROM contracts
+"""
+
+# ── Batch de Billing / Atraso ──
+# Limites dos chunks: o installment_id de cada %s-ésima parcela vencida
+BILLING_CHUNKS_SQL = """
+    SELECT installment_id
+    FROM (
+        SELECT installment_id, ROW_NUMBER() OVER (ORDER BY installment_id) AS rn
+        FROM installments
+        WHERE status IN ('PENDING', 'OVERDUE') AND due_date <= CURRENT_DATE
+    ) due
+    WHERE rn %% %s = 0
+    ORDER BY installment_id
+"""
+
+# Um chunk (installment_id em (%s, %s]) por statement: parcelas vencidas são
+# pagas (com probabilidade %s) ou ficam em atraso; pagamentos e multa da
+# primeira entrada em atraso viram credit_transactions, e contratos com mais
+# de 90 dias de atraso passam a DEFAULTED
+BILLING_CHUNK_SQL = """
+    WITH due AS (
+        SELECT installment_id, due_date, amount, status AS previous_status,
+               random() < %s AS pays
+        FROM installments
+        WHERE installment_id > %s AND installment_id <= %s
+          AND status IN ('PENDING', 'OVERDUE')
+          AND due_date <= CURRENT_DATE
+        FOR UPDATE
+    ),
+    billed AS (
+        UPDATE installments i
+        SET status = CASE WHEN d.pays THEN 'PAID'
+                          WHEN d.due_date < CURRENT_DATE THEN 'OVERDUE'
+                          ELSE i.status END,
+            paid_amount = CASE WHEN d.pays THEN d.amount END,
+            paid_at = CASE WHEN d.pays THEN NOW() END,
+            days_overdue = CURRENT_DATE - d.due_date
+        FROM due d
+        WHERE i.installment_id = d.installment_id
+        RETURNING i.contract_id, i.status, i.amount, i.days_overdue, d.previous_status
+    ),
+    posted AS (
+        INSERT INTO credit_transactions (contract_id, transaction_type, amount, description, processed_by)
+        SELECT contract_id,
+               CASE WHEN status = 'PAID' THEN 'PAYMENT' ELSE 'FEE' END,
+               CASE WHEN status = 'PAID' THEN amount ELSE ROUND(amount * 0.02, 2) END,
+               CASE WHEN status = 'PAID' THEN 'Pagamento de parcela' ELSE 'Multa por atraso' END,
+               'billing-batch'
+        FROM billed
+        WHERE status = 'PAID' OR (status = 'OVERDUE' AND previous_status = 'PENDING')
+    ),
+    defaulted AS (
+        UPDATE credit_contracts
+        SET status = 'DEFAULTED'
+        WHERE status = 'ACTIVE'
+          AND contract_id IN (SELECT contract_id FROM billed WHERE status = 'OVERDUE' AND days_overdue > 90)
+    )
+    SELECT COUNT(*) FILTER (WHERE status = 'PAID'),
+           COUNT(*) FILTER (WHERE status = 'OVERDUE')
+    FROM billed
+"""
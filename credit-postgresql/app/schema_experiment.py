@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Runner de experimentos de schema (A/B de índices).
+
+Para cada variante — a baseline (00_setup.sql sem alterações) e cada delta
+de DDL do arquivo de variantes — cria um banco novo, aplica o setup com os
+dados iniciais, aplica o delta, roda a mesma carga gravada e mede:
+
+    throughput          operações/s da carga inteira
+    latência            avg e p95 por resource do simulador
+    tamanho de índices  soma de pg_relation_size dos índices ao final
+    write amplification bytes de WAL gerados por operação de escrita
+
+Arquivo de variantes: blocos de DDL separados por "-- variant: <nome>", ex:
+
+    -- variant: sem_idx_status
+    DROP INDEX idx_proposals_status;
+
+    -- variant: cpf_covering
+    CREATE INDEX idx_customers_cpf_cov ON customers (cpf) INCLUDE (credit_score, full_name);
+
+A carga é gravada em EXPERIMENT_WORKLOAD na primeira execução e reaproveitada
+nas seguintes, para que todas as variantes (e rodadas) vejam as mesmas
+operações. O WAL é medido no cluster inteiro: rode contra uma instância
+local sem outra carga.
+
+Configuração:
+    EXPERIMENT_ADMIN_DSN   DSN com permissão de CREATE DATABASE (default: banco postgres
+                           em PGHOST/PGPORT, usuário EXPERIMENT_ADMIN_USER)
+    EXPERIMENT_ADMIN_USER  usuário administrativo (default postgres); senha em
+                           POSTGRES_PASSWORD, ou PGPASSWORD se for o próprio PGUSER
+    EXPERIMENT_SETUP_SQL   schema + seed (default ../sql/00_setup.sql)
+    EXPERIMENT_WORKLOAD    arquivo da carga gravada (default /tmp/experiment_workload.jsonl)
+    EXPERIMENT_OPS         operações da carga (default 2000)
+    EXPERIMENT_THREADS     conexões concorrentes (default 4)
+    EXPERIMENT_SEED        semente da carga (default 42)
+    EXPERIMENT_KEEP        "1" mantém os bancos criados
+
+Uso:
+    python schema_experiment.py ../sql/experiments/index_variants.sql
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import threading
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+
+from service_metrics import percentile
+from queries import (
+    CUSTOMER_LOOKUP_SQL, RISK_ANALYSIS_SQL, SERVICE_PERFORMANCE_SQL,
+    create_proposal, approve_next_pending,
+)
+
+EXPERIMENT_ADMIN_DSN = os.getenv("EXPERIMENT_ADMIN_DSN", "")
+EXPERIMENT_ADMIN_USER = os.getenv("EXPERIMENT_ADMIN_USER", "postgres")
+# Mesmo host/porta do simulador (PGHOST/PGPORT), no banco de manutenção; a
+# senha nunca tem default — PGPASSWORD só vale se for do próprio usuário
+ADMIN_DB_CONFIG = {
+    "host": os.getenv("PGHOST", "postgres-credit"),
+    "port": int(os.getenv("PGPORT", 5432)),
+    "dbname": "postgres",
+    "user": EXPERIMENT_ADMIN_USER,
+    "password": os.getenv("POSTGRES_PASSWORD") or (
+        os.getenv("PGPASSWORD") if os.getenv("PGUSER") == EXPERIMENT_ADMIN_USER else None
+    ),
+}
+EXPERIMENT_SETUP_SQL = os.getenv(
+    "EXPERIMENT_SETUP_SQL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql", "00_setup.sql"),
+)
+EXPERIMENT_WORKLOAD = os.getenv("EXPERIMENT_WORKLOAD", "/tmp/experiment_workload.jsonl")
+EXPERIMENT_OPS = int(os.getenv("EXPERIMENT_OPS", 2000))
+EXPERIMENT_THREADS = int(os.getenv("EXPERIMENT_THREADS", 4))
+EXPERIMENT_SEED = int(os.getenv("EXPERIMENT_SEED", 42))
+EXPERIMENT_KEEP = os.getenv("EXPERIMENT_KEEP", "0") == "1"
+
+# Mesma proporção de chamadas dos serviços do simulador (chamadas/min)
+RESOURCES = [
+    ("proposal.create", 10),
+    ("proposal.approve", 15),
+    ("customer.lookup", 50),
+    ("risk.analysis", 5),
+    ("service.performance", 3),
+]
+WRITE_RESOURCES = ("proposal.create", "proposal.approve")
+
+_VARIANT = re.compile(r"^--\s*variant:\s*(\S+)\s*$", re.MULTILINE)
+
+
+def parse_variants(path):
+    """'-- variant: nome' + DDL → [('baseline', ''), (nome, ddl), ...]"""
+    with open(path, encoding="utf-8") as f:
+        parts = _VARIANT.split(f.read())
+    variants = [("baseline", "")]
+    for name, ddl in zip(parts[1::2], parts[2::2]):
+        variants.append((name, ddl.strip()))
+    return variants
+
+
+# ── Carga gravada ─────────────────────────────────────────────
+def record_workload(path, ops, seed):
+    """Gera a carga com semente fixa e grava (uma operação por linha)."""
+    rng = random.Random(seed)
+    names = [name for name, _ in RESOURCES]
+    weights = [weight for _, weight in RESOURCES]
+    with open(path, "w", encoding="utf-8") as out:
+        for _ in range(ops):
+            resource = rng.choices(names, weights)[0]
+            if resource == "proposal.create":
+                params = [rng.randint(1, 10000), round(rng.uniform(1000, 50000), 2),
+                          rng.choice([12, 24, 36, 48]),
+                          rng.choice(["PERSONAL", "PAYROLL", "VEHICLE", "HOME_EQUITY"])]
+            elif resource == "proposal.approve":
+                params = [rng.randint(50, 500)]
+            elif resource == "customer.lookup":
+                params = [str(rng.randint(1, 10000)).zfill(11)]
+            else:
+                params = []
+            out.write(json.dumps({"resource": resource, "params": params}) + "\n")
+
+
+def load_workload(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _execute(cur, resource, params):
+    """Executa uma operação da carga com o SQL do simulador."""
+    if resource == "proposal.create":
+        create_proposal(cur, *params)
+    elif resource == "proposal.approve":
+        approve_next_pending(cur, params[0])
+    elif resource == "customer.lookup":
+        cur.execute(CUSTOMER_LOOKUP_SQL, params)
+        cur.fetchall()
+    elif resource == "risk.analysis":
+        cur.execute(RISK_ANALYSIS_SQL)
+        cur.fetchall()
+    elif resource == "service.performance":
+        cur.execute(SERVICE_PERFORMANCE_SQL)
+        cur.fetchall()
+
+
+def _worker(dsn, operations, latencies, errors):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        for op in operations:
+            started = time.perf_counter()
+            try:
+                _execute(cur, op["resource"], op["params"])
+            except psycopg2.Error:
+                errors[op["resource"]] = errors.get(op["resource"], 0) + 1
+                continue
+            latencies.setdefault(op["resource"], []).append(time.perf_counter() - started)
+    finally:
+        cur.close()
+        conn.close()
+
+
+# ── Execução de uma variante ──────────────────────────────────
+def admin_dsn():
+    """EXPERIMENT_ADMIN_DSN, ou o DSN montado de ADMIN_DB_CONFIG; None sem senha."""
+    if EXPERIMENT_ADMIN_DSN:
+        return EXPERIMENT_ADMIN_DSN
+    if not ADMIN_DB_CONFIG["password"]:
+        return None
+    return make_dsn(**ADMIN_DB_CONFIG)
+
+
+def _admin():
+    conn = psycopg2.connect(admin_dsn())
+    conn.autocommit = True
+    return conn
+
+
+def _database_dsn(dbname):
+    return make_dsn(admin_dsn(), dbname=dbname)
+
+
+def _scalar(dsn, query):
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute(query)
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_variant(name, ddl, workload, setup_sql, threads):
+    dbname = "exp_" + re.sub(r"\W", "_", name.lower())
+    admin = _admin()
+    admin.cursor().execute(f"DROP DATABASE IF EXISTS {dbname}")
+    admin.cursor().execute(f"CREATE DATABASE {dbname}")
+    dsn = _database_dsn(dbname)
+    try:
+        conn = psycopg2.connect(dsn)
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(setup_sql)
+        if ddl:
+            cur.execute(ddl)
+        cur.execute("ANALYZE")
+        cur.execute("CHECKPOINT")
+        cur.execute("SELECT pg_current_wal_lsn()")
+        wal_before = cur.fetchone()[0]
+        conn.close()
+
+        latencies = [{} for _ in range(threads)]
+        errors = [{} for _ in range(threads)]
+        workers = [
+            threading.Thread(target=_worker, args=(dsn, workload[i::threads], latencies[i], errors[i]))
+            for i in range(threads)
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        wal_bytes = float(_scalar(dsn, f"SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '{wal_before}')"))
+        index_bytes = float(_scalar(dsn, "SELECT COALESCE(SUM(pg_relation_size(indexrelid)), 0) "
+                                         "FROM pg_stat_user_indexes"))
+    finally:
+        if not EXPERIMENT_KEEP:
+            admin.cursor().execute(f"DROP DATABASE IF EXISTS {dbname}")
+        admin.close()
+
+    merged = {}
+    for per_thread in latencies:
+        for resource, values in per_thread.items():
+            merged.setdefault(resource, []).extend(values)
+    writes = sum(len(merged.get(r, [])) for r in WRITE_RESOURCES)
+    ops = sum(len(v) for v in merged.values())
+    return {
+        "variant": name,
+        "ops_per_s": ops / elapsed if elapsed else 0.0,
+        "errors": sum(sum(e.values()) for e in errors),
+        "index_mb": index_bytes / 1024 / 1024,
+        "wal_kb_per_write": wal_bytes / 1024 / writes if writes else 0.0,
+        "latency": {
+            resource: (sum(values) / len(values) * 1000, percentile(sorted(values), 95) * 1000)
+            for resource, values in merged.items()
+        },
+    }
+
+
+# ── Relatório ─────────────────────────────────────────────────
+def _vs(value, base):
+    if not base:
+        return ""
+    return f" ({(value - base) / base * 100:+.0f}%)"
+
+
+def print_report(results):
+    base = results[0]
+    print()
+    print(f"{'variante':<22} {'ops/s':>16} {'índices MB':>18} {'WAL KB/escrita':>20} {'erros':>6}")
+    for r in results:
+        print(f"{r['variant']:<22} "
+              f"{r['ops_per_s']:>8.1f}{_vs(r['ops_per_s'], base['ops_per_s']):>8} "
+              f"{r['index_mb']:>10.1f}{_vs(r['index_mb'], base['index_mb']):>8} "
+              f"{r['wal_kb_per_write']:>12.1f}{_vs(r['wal_kb_per_write'], base['wal_kb_per_write']):>8} "
+              f"{r['errors']:>6}")
+
+    print()
+    print(f"{'latência avg / p95 (ms)':<22} " + " ".join(f"{name:>22}" for name, _ in RESOURCES))
+    for r in results:
+        cells = []
+        for name, _ in RESOURCES:
+            avg, p95 = r["latency"].get(name, (0.0, 0.0))
+            cells.append(f"{avg:>9.2f} / {p95:>9.2f}")
+        print(f"{r['variant']:<22} " + " ".join(f"{c:>22}" for c in cells))
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Uso: python schema_experiment.py <arquivo de variantes>")
+        sys.exit(1)
+
+    if admin_dsn() is None:
+        print(f"Sem senha para o usuário administrativo {EXPERIMENT_ADMIN_USER}: defina POSTGRES_PASSWORD "
+              f"(ou EXPERIMENT_ADMIN_DSN completo)")
+        sys.exit(1)
+
+    variants = parse_variants(sys.argv[1])
+    if not os.path.exists(EXPERIMENT_WORKLOAD):
+        record_workload(EXPERIMENT_WORKLOAD, EXPERIMENT_OPS, EXPERIMENT_SEED)
+        print(f"📼 Carga gravada: {EXPERIMENT_OPS} operações em {EXPERIMENT_WORKLOAD} (seed {EXPERIMENT_SEED})")
+    workload = load_workload(EXPERIMENT_WORKLOAD)
+    with open(EXPERIMENT_SETUP_SQL, encoding="utf-8") as f:
+        setup_sql = f.read()
+
+    results = []
+    for name, ddl in variants:
+        print(f"🧪 {name}: criando banco, aplicando setup{' + delta' if ddl else ''} e rodando "
+              f"{len(workload)} operações em {EXPERIMENT_THREADS} conexões...")
+        results.append(run_variant(name, ddl, workload, setup_sql, EXPERIMENT_THREADS))
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Roteamento por shard (customer_id) entre várias instâncias PostgreSQL.
+
+Cada shard tem o seu pool de conexões. Operações de um único cliente vão
+para o shard dono do customer_id (hash ou faixa); relatórios fazem
+scatter-gather em paralelo em todos os shards e juntam os agregados parciais.
+
+Configuração:
+    SHARD_DSNS       DSNs libpq separados por ';', ex:
+                     "host=pg-shard1 port=5432;host=pg-shard2 port=5432"
+                     (vazio → um único shard com PGHOST/PGPORT)
+    SHARD_STRATEGY   "hash" (default) ou "range"
+    SHARD_RANGES     faixas para "range", ex: "1-5000,5001-10000"
+                     (default: 1..SHARD_CUSTOMER_MAX dividido igualmente)
+    SHARD_POOL_MAX   conexões máximas por shard (default 10)
+    REPLICA_DSNS     réplicas de leitura de cada shard: grupos separados por
+                     '|' (um por shard, na ordem de SHARD_DSNS) e DSNs do
+                     grupo separados por ';' — ver replica_router.py
+"""
+
+import os
+import zlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2 import pool
+
+from replica_router import ReplicaRouter, Endpoint
+from result_stream import read_rows
+from query_fingerprint import track
+
+SHARD_DSNS = os.getenv("SHARD_DSNS", "")
+SHARD_STRATEGY = os.getenv("SHARD_STRATEGY", "hash")
+SHARD_RANGES = os.getenv("SHARD_RANGES", "")
+SHARD_CUSTOMER_MAX = int(os.getenv("SHARD_CUSTOMER_MAX", 10000))
+SHARD_POOL_MAX = int(os.getenv("SHARD_POOL_MAX", 10))
+REPLICA_DSNS = os.getenv("REPLICA_DSNS", "")
+
+# Lag da réplica em segundos; 0 quando já aplicou todo o WAL recebido
+# (evita lag "falso" com o primário ocioso)
+PG_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class LazyPool(pool.ThreadedConnectionPool):
+    """Pool que abre conexões sob demanda e mantém até maxconn ociosas.
+
+    No ThreadedConnectionPool o putconn só guarda a conexão enquanto houver
+    menos de minconn ociosas (com minconn=0 fecha todas), e minconn > 0 abre
+    as conexões já no construtor — antes do banco ficar pronto (startup.py).
+    """
+
+    def __init__(self, maxconn, *args, **kwargs):
+        super().__init__(0, maxconn, *args, **kwargs)
+        # minconn só é usado no construtor e no putconn: a partir daqui vira
+        # o limite de conexões ociosas guardadas
+        self.minconn = self.maxconn
+
+
+def parse_ranges(spec, shards, customer_max=SHARD_CUSTOMER_MAX):
+    """'1-5000,5001-10000' → [(1, 5000), (5001, 10000)]; sem spec divide igualmente."""
+    if spec:
+        ranges = []
+        for part in spec.split(","):
+            low, high = part.strip().split("-")
+            ranges.append((int(low), int(high)))
+        if len(ranges) != shards:
+            raise ValueError(f"SHARD_RANGES tem {len(ranges)} faixas para {shards} shards")
+        return ranges
+    size = -(-customer_max // shards)
+    return [(i * size + 1, (i + 1) * size) for i in range(shards)]
+
+
+class ShardMap:
+    """Mapa customer_id → shard, com um pool de conexões por shard."""
+
+    def __init__(self, dsns, connect_kwargs, strategy=SHARD_STRATEGY,
+                 ranges=SHARD_RANGES, pool_max=SHARD_POOL_MAX, replica_dsns=None):
+        self.dsns = dsns
+        self.connect_kwargs = connect_kwargs
+        self.strategy = strategy
+        self.count = len(dsns)
+        self.ranges = parse_ranges(ranges, self.count) if strategy == "range" else None
+        self.pools = [LazyPool(pool_max, dsn, **connect_kwargs) for dsn in dsns]
+        self._next = 0
+        self._next_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.count), thread_name_prefix="Scatter")
+
+        # Um roteador de leitura por shard (sem réplicas, lê sempre do primário)
+        replica_dsns = replica_dsns or [[] for _ in dsns]
+        self.readers = []
+        self.replica_pools = []
+        for shard, dsn in enumerate(dsns):
+            primary = Endpoint(f"shard{shard}-primary", self.pools[shard].getconn, self._putconn(self.pools[shard]))
+            replicas = []
+            for i, replica_dsn in enumerate(replica_dsns[shard] if shard < len(replica_dsns) else []):
+                replica_pool = LazyPool(pool_max, replica_dsn, **connect_kwargs)
+                replicas.append(Endpoint(
+                    f"shard{shard}-replica{i}", replica_pool.getconn, self._putconn(replica_pool),
+                    connect=lambda d=replica_dsn: psycopg2.connect(d, **connect_kwargs),
+                ))
+                self.replica_pools.append(replica_pool)
+            self.readers.append(ReplicaRouter(primary, replicas, PG_LAG_QUERY))
+
+    @classmethod
+    def from_env(cls, db_config):
+        """Monta o mapa a partir de SHARD_DSNS; sem ele usa host/port de db_config."""
+        kwargs = {k: v for k, v in db_config.items() if k not in ("host", "port")}
+        dsns = [d.strip() for d in SHARD_DSNS.split(";") if d.strip()]
+        if not dsns:
+            dsns = [f"host={db_config['host']} port={db_config['port']}"]
+        replica_dsns = [
+            [d.strip() for d in group.split(";") if d.strip()]
+            for group in REPLICA_DSNS.split("|")
+        ] if REPLICA_DSNS else None
+        return cls(dsns, kwargs, replica_dsns=replica_dsns)
+
+    @staticmethod
+    def _putconn(p):
+        return lambda conn: p.putconn(conn, close=bool(conn.closed))
+
+    def shard_for(self, customer_id):
+        """Shard dono do cliente."""
+        if self.count == 1:
+            return 0
+        if self.ranges:
+            for shard, (low, high) in enumerate(self.ranges):
+                if low <= customer_id <= high:
+                    return shard
+            return customer_id % self.count
+        # crc32 é estável entre processos (hash() de str não é)
+        return zlib.crc32(str(customer_id).encode()) % self.count
+
+    def any_shard(self):
+        """Round-robin para operações sem cliente definido (ex: fila de pendentes)."""
+        with self._next_lock:
+            shard = self._next
+            self._next = (self._next + 1) % self.count
+        return shard
+
+    @contextmanager
+    def connection(self, shard):
+        """Empresta uma conexão do pool do shard; descarta se a conexão quebrou."""
+        conn = self.pools[shard].getconn()
+        broken = False
+        try:
+            yield track(conn)
+        except Exception:
+            broken = bool(conn.closed)
+            raise
+        finally:
+            self.pools[shard].putconn(conn, close=broken)
+
+    def connect(self, shard=0):
+        """Conexão avulsa (fora do pool) no primário do shard."""
+        return psycopg2.connect(self.dsns[shard], **self.connect_kwargs)
+
+    @contextmanager
+    def read_connection(self, shard):
+        """Conexão somente leitura: réplica do shard (se houver e sem lag) ou primário."""
+        with self.readers[shard].connection() as conn:
+            yield track(conn)
+
+    def query(self, shard, query, params=None, read_only=False, service="", consume=list):
+        """Executa uma leitura no shard; retorna consume(linhas).
+
+        consume recebe o iterador das linhas com a conexão ainda aberta e deve
+        esgotá-lo. Em RESULT_MODE=stream a leitura usa cursor nomeado
+        (server-side) e as linhas chegam em lotes enquanto consume itera: um
+        consume que agrega, em vez de list, não materializa o resultado.
+        """
+        connection = self.read_connection if read_only else self.connection
+        with connection(shard) as conn:
+            result = consume(read_rows(conn, query, params, service, named=True))
+            conn.rollback()
+            return result
+
+    def scatter(self, query, params=None, read_only=False, service="", consume=list):
+        """Executa a query em todos os shards em paralelo; retorna consume(linhas) de cada um."""
+        futures = [self._executor.submit(self.query, shard, query, params, read_only, service, consume)
+                   for shard in range(self.count)]
+        return [f.result() for f in futures]
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for p in self.pools + self.replica_pools:
+            p.closeall()
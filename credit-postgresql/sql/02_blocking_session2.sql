@@ -0,0 +1,7 @@
+-- =========================================================
+-- Simulação de Blocking — Session 2 (vítima)
+-- =========================================================
+-- Fica bloqueada enquanto a Session 1 (02_blocking.sql) segura o lock
+UPDATE credit_proposals
+SET status = 'APPROVED'
+WHERE proposal_id = 1;
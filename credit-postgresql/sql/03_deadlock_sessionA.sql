@@ -0,0 +1,9 @@
+-- =========================================================
+-- Simulação de Deadlock — Terminal A
+-- =========================================================
+-- Lock no proposal_id = 1, depois tenta proposal_id = 2
+BEGIN;
+UPDATE credit_proposals SET status = 'ANALYZING' WHERE proposal_id = 1;
+SELECT pg_sleep(2);
+UPDATE credit_proposals SET status = 'ANALYZING' WHERE proposal_id = 2;
+COMMIT;
@@ -0,0 +1,9 @@
+-- =========================================================
+-- Simulação de Deadlock — Terminal B
+-- =========================================================
+-- Lock no proposal_id = 2, depois tenta proposal_id = 1
+BEGIN;
+UPDATE credit_proposals SET status = 'APPROVED' WHERE proposal_id = 2;
+SELECT pg_sleep(2);
+UPDATE credit_proposals SET status = 'APPROVED' WHERE proposal_id = 1;
+COMMIT;
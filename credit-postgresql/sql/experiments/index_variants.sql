@@ -0,0 +1,17 @@
+-- =========================================================
+-- Variantes de índice para schema_experiment.py
+-- Cada bloco "-- variant: <nome>" é um delta de DDL aplicado
+-- sobre o 00_setup.sql; a baseline é o setup sem alterações.
+-- =========================================================
+
+-- variant: sem_idx_status
+-- idx_proposals_status_created cobre sozinho os filtros por status?
+DROP INDEX idx_proposals_status;
+
+-- variant: cpf_covering
+-- Índice coberto para o customer_lookup (evita ir à heap de customers)
+CREATE INDEX idx_customers_cpf_covering ON customers (cpf) INCLUDE (credit_score, full_name);
+
+-- variant: sem_idx_cpf_duplicado
+-- idx_customers_cpf duplica o índice da constraint UNIQUE(cpf)
+DROP INDEX idx_customers_cpf;
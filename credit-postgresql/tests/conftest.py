@@ -0,0 +1,11 @@
+"""Os testes importam os módulos como no container: app/ e common/ no sys.path."""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+for path in (os.path.join(HERE, "..", "app"), os.path.join(HERE, "..", "..", "common")):
+    path = os.path.normpath(path)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,107 @@
+"""Funções puras usadas pelo simulador PostgreSQL (sem banco)."""
+
+import pytest
+
+from retry_policy import classify, DEADLOCK, LOCK_TIMEOUT, SERIALIZATION, CONNECTION, LOGIC
+from query_fingerprint import normalize, text_fingerprint
+from incident_engine import parse_schedule
+from fake_db import shape, FAKE_DB_ROWS
+from queries import CREATE_PROPOSAL_SQL, AUDIT_PROPOSAL_SQL, PENDING_PROPOSAL_SQL, CUSTOMER_LOOKUP_SQL
+
+
+class PgError(Exception):
+    """Erro com SQLSTATE em pgcode, como os do psycopg2."""
+
+    def __init__(self, pgcode, message="erro"):
+        super().__init__(message)
+        self.pgcode = pgcode
+
+
+class OperationalError(Exception):
+    pass
+
+
+# ── retry_policy.classify ─────────────────────────────────────
+@pytest.mark.parametrize("pgcode, expected", [
+    ("40P01", DEADLOCK),
+    ("55P03", LOCK_TIMEOUT),
+    ("57014", LOCK_TIMEOUT),
+    ("40001", SERIALIZATION),
+    ("57P01", CONNECTION),
+    ("08006", CONNECTION),
+    ("23505", LOGIC),
+    ("42P01", LOGIC),
+])
+def test_classify_pgcode(pgcode, expected):
+    assert classify(PgError(pgcode)) == expected
+
+
+def test_classify_without_sqlstate():
+    # Conexão caída antes de o servidor responder: sem pgcode
+    assert classify(OperationalError("server closed the connection unexpectedly")) == CONNECTION
+    assert classify(ValueError("bug do app")) == LOGIC
+
+
+# ── query_fingerprint.normalize ───────────────────────────────
+def test_normalize_strips_dbm_comment_and_params():
+    sql = "/*dddbs='credit',traceparent='00-1-2-01'*/ SELECT * FROM customers WHERE cpf = %s"
+    assert normalize(sql) == "select * from customers where cpf=?"
+
+
+def test_normalize_literals_and_positional_params():
+    assert normalize("SELECT id FROM t WHERE a = $1 AND b = 'x''y' AND c > -10.5 ;") == \
+        "select id from t where a=? and b=? and c>?"
+
+
+def test_normalize_collapses_in_lists():
+    assert normalize("UPDATE t SET x = 1 WHERE id IN (1, 2, 3)") == normalize("update t set x=7 where id in (%s)")
+
+
+def test_normalize_ignores_layout_and_case():
+    assert normalize("select  c.cpf\n  FROM customers c\n WHERE c.cpf = %s") == \
+        normalize("SELECT c.cpf FROM Customers C WHERE C.CPF=%s")
+    assert text_fingerprint(CUSTOMER_LOOKUP_SQL) == text_fingerprint("/* ddps='x' */" + CUSTOMER_LOOKUP_SQL)
+
+
+# ── incident_engine.parse_schedule ────────────────────────────
+def test_parse_schedule_defaults_and_order():
+    assert parse_schedule("300:deadlock:30, 120:seq_scan:60:2, 10:blocking") == [
+        (10.0, "blocking", 60.0, 1),
+        (120.0, "seq_scan", 60.0, 2),
+        (300.0, "deadlock", 30.0, 1),
+    ]
+
+
+def test_parse_schedule_skips_bad_entries():
+    scenarios = {"seq_scan", "deadlock"}
+    spec = "x:seq_scan, 10, 7:deadlock:abc, 5:nope:3, 30:deadlock"
+    assert parse_schedule(spec, scenarios) == [(30.0, "deadlock", 60.0, 1)]
+
+
+# ── fake_db.shape ─────────────────────────────────────────────
+def test_shape_dml():
+    assert shape(CREATE_PROPOSAL_SQL) == (1, 1)      # RETURNING proposal_id
+    assert shape(AUDIT_PROPOSAL_SQL) is None
+
+
+def test_shape_select():
+    assert shape(PENDING_PROPOSAL_SQL) == (3, 1)     # LIMIT 1
+    assert shape("SELECT a, COUNT(*) FROM t GROUP BY a") == (2, FAKE_DB_ROWS)
+    assert shape("SELECT COUNT(*), SUM(x) FROM t") == (2, 1)
+    assert shape("SELECT 1") == (1, 1)
+
+
+# ── credit_simulator._merge_partials ──────────────────────────
+def test_merge_partials():
+    pytest.importorskip("psycopg2")
+    pytest.importorskip("ddtrace")
+    from credit_simulator import _merge_partials, _fold_partials
+
+    shard0 = [("PERSONAL", "APPROVED", 2, 10), ("VEHICLE", "REJECTED", 1, None)]
+    shard1 = [("PERSONAL", "APPROVED", 3, 5), ("VEHICLE", "REJECTED", 4, None)]
+    merged = _merge_partials([shard0, shard1], key_size=2)
+    assert merged == {("PERSONAL", "APPROVED"): [5, 15], ("VEHICLE", "REJECTED"): [5, None]}
+
+    # Dobra por shard (streaming) e junção final dão o mesmo resultado
+    fold = _fold_partials(2)
+    assert _merge_partials([fold(iter(shard0)), fold(iter(shard1))], key_size=2) == merged
@@ -5,19 +5,41 @@ Simula múltiplos serviços fazendo requisições contínuas durante o dia,
 com introdução gradual de problemas para análise via DBM.
 """
 
+import os
 import time
 import random
 import pyodbc
+import socket
 import threading
 from datetime import datetime, timedelta
-from ddtrace import tracer, patch, config
+from ddtrace import tracer, config
+
+from batch_logger import log, log_error, announce, flush as flush_logs
+from service_metrics import record
+from retry_policy import call_with_retry, error_class_of, failure_pause
+from concurrency_limit import call_with_limit, start_report as start_limit_report
+from incident_engine import IncidentEngine, Scenario, Role
+from replica_router import ReplicaRouter, Endpoint
+from result_stream import read_rows, RESULT_MODE, RESULT_FETCH_SIZE
+from stats_collector import StatsCollector
+from plan_monitor import PlanMonitor
+from query_fingerprint import track, start_export as start_fingerprint_export
+from fake_db import DB_BACKEND, install as install_fake_db
+from lock_sampler import LockSampler
+from audit_writer import AuditWriter
+from soak_monitor import SoakMonitor
+from startup import instrument, wait_ready, report_first_operation
+
+# Backend em memória (DB_BACKEND=fake) entra antes do patch do ddtrace
+if DB_BACKEND == "fake":
+    install_fake_db(pyodbc)
 
 # Configura DBM propagation antes do patch
 config.dbapi_propagation_mode = 'full'
 config._trace_sql_comments = True
 
-# Habilita instrumentação automática
-patch(pyodbc=True)
+# Instrumentação só do pyodbc (nenhuma com DD_TRACE_ENABLED=false)
+instrument(pyodbc=True)
 
 # Configuração do banco (usando usuário específico da aplicação)
 CONN_STRING = (
@@ -27,8 +49,41 @@ CONN_STRING = (
     "UID=app_user;"
     "PWD=AppUser123!@#;"
     "TrustServerCertificate=yes;"
+    # program_name das sessões em sys.dm_exec_sessions (lock_sampler.py)
+    "APP=credit-simulator;"
+)
+
+# Incidentes rodam com o usuário da aplicação por padrão
+INCIDENT_CONN_STRING = os.getenv(
+    "INCIDENT_CONN_STRING", CONN_STRING.replace("APP=credit-simulator;", "APP=incident-engine;")
+)
+# sys.dm_exec_query_stats exige VIEW SERVER STATE (ex: login datadog)
+STATS_CONN_STRING = os.getenv("STATS_CONN_STRING", CONN_STRING)
+
+# Escrita de propostas: "inline" (INSERT + auditoria, dois commits), "procedure"
+# (usp_CreateProposal, uma chamada) ou "tvp" (usp_CreateProposalBatch, lotes)
+WRITE_MODE = os.getenv("WRITE_MODE", "inline")
+PROPOSAL_BATCH_SIZE = int(os.getenv("PROPOSAL_BATCH_SIZE", 50))
+
+# Análise de crédito: "single" (uma proposta por vez) ou "queue" (lotes reivindicados
+# com UPDLOCK/READPAST, vários workers em paralelo)
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "single")
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", 20))
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 4))
+
+INCIDENT_SQL_DIR = os.getenv(
+    "INCIDENT_SQL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql")
 )
 
+# Cenários de sql/ disponíveis para o motor de incidentes
+# (06_cpu_intensive.sql ainda está vazio, por isso não entra na lista)
+INCIDENT_SCENARIOS = [
+    Scenario("blocking", [Role("02_blocking_conn1.sql", "loop"), Role("02_blocking_conn2.sql", "loop")], 2.0),
+    Scenario("deadlock", [Role("03_deadlock_sessionA.sql", "loop"), Role("03_deadlock_sessionB.sql", "loop")], 1.0),
+    Scenario("full_scan", [Role("04_full_scan.sql", "loop")], 3.0),
+    Scenario("slow_query", [Role("05_slow_query.sql", "loop")], 5.0),
+]
+
 # Controle de problemas (serão ativados em horários específicos)
 PROBLEMS_ENABLED = {
     'slow_queries': False,
@@ -39,8 +94,40 @@ PROBLEMS_ENABLED = {
 }
 
 def get_connection():
-    """Cria conexão com SQL Server"""
-    return pyodbc.connect(CONN_STRING)
+    """Cria conexão com SQL Server (estatísticas por fingerprint de query)"""
+    return track(pyodbc.connect(CONN_STRING))
+
+# Réplicas de leitura (readable secondaries), connection strings separadas por '|'
+REPLICA_CONN_STRINGS = [c.strip() for c in os.getenv("REPLICA_CONN_STRINGS", "").split("|") if c.strip()]
+
+# Lag aproximado do secondary: tempo desde o último commit refeito localmente
+SQLSERVER_LAG_QUERY = """
+    SELECT ISNULL(MAX(DATEDIFF(SECOND, last_commit_time, GETDATE())), 0)
+    FROM sys.dm_hadr_database_replica_states
+    WHERE is_local = 1 AND database_id = DB_ID()
+"""
+
+def _close(conn):
+    conn.close()
+
+# Auditoria write-behind (AUDIT_MODE=async): flusher com conexão própria
+AUDIT = AuditWriter(
+    "sqlserver", lambda: track(pyodbc.connect(CONN_STRING.replace("APP=credit-simulator;", "APP=audit-writer;")))
+)
+
+# Planos das queries de cada resource (PLAN_INTERVAL); no primário, não nas réplicas.
+# Conexão sem track: os SHOWPLAN não entram nas estatísticas por fingerprint
+PLANS = PlanMonitor("sqlserver", lambda: pyodbc.connect(CONN_STRING))
+
+# Serviços somente leitura usam READS: réplica sem lag ou, no fallback, o primário
+READS = ReplicaRouter(
+    Endpoint("primary", get_connection, _close),
+    [
+        Endpoint(f"replica{i}", lambda c=conn_str: track(pyodbc.connect(c)), _close)
+        for i, conn_str in enumerate(REPLICA_CONN_STRINGS)
+    ],
+    SQLSERVER_LAG_QUERY,
+)
 
 def add_dbm_comment(query, service_name, operation, span=None):
     """Adiciona comentário DBM para rastreamento end-to-end"""
@@ -54,43 +141,31 @@ def add_dbm_comment(query, service_name, operation, span=None):
         return comment + query.strip()
     return query.strip()
 
-def log(service, message):
-    """Log formatado com timestamp"""
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"[{timestamp}] [{service}] {message}")
-
 # ═══════════════════════════════════════════════════════════════
 #  SERVIÇO 1: CONSULTA DE PROPOSTAS (alta frequência)
 # ═══════════════════════════════════════════════════════════════
 @tracer.wrap(service="proposal-query-service", resource="list_proposals")
 def list_proposals_by_status(status):
-    """Lista propostas por status - Query mais comum do sistema"""
+    """Lista propostas por status - Query mais comum do sistema; retorna quantas leu"""
     with tracer.trace("database.query", service="proposal-query-service") as span:
         span.set_tag("proposal.status", status)
         span.set_tag("db.system", "sqlserver")
         
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Query otimizada com índice
-        query = add_dbm_comment("""
-            SELECT TOP 100 
-                p.ProposalID, p.CustomerID, p.RequestedAmount, 
-                p.Status, p.CreatedAt, c.FullName, c.CreditScore
-            FROM CreditProposals p
-            INNER JOIN Customers c ON p.CustomerID = c.CustomerID
-            WHERE p.Status = ?
-            ORDER BY p.CreatedAt DESC
-        """, "proposal-query-service", "list_proposals", span)
-        
-        cursor.execute(query, (status,))
-        rows = cursor.fetchall()
-        
-        span.set_tag("db.row_count", len(rows))
-        cursor.close()
-        conn.close()
+        with READS.connection() as conn:
+            # Query otimizada com índice
+            query = add_dbm_comment("""
+                SELECT TOP 100 
+                    p.ProposalID, p.CustomerID, p.RequestedAmount, 
+                    p.Status, p.CreatedAt, c.FullName, c.CreditScore
+                FROM CreditProposals p
+                INNER JOIN Customers c ON p.CustomerID = c.CustomerID
+                WHERE p.Status = ?
+                ORDER BY p.CreatedAt DESC
+            """, "proposal-query-service", "list_proposals", span)
+            PLANS.observe("list_proposals", "proposal-query-service", query, (status,))
         
-        return rows
+            # Processa linha a linha (RESULT_MODE=stream não materializa o resultado)
+            return sum(1 for _ in read_rows(conn, query, (status,), "proposal-query-service"))
 
 def proposal_query_service():
     """Serviço que consulta propostas constantemente"""
@@ -98,48 +173,119 @@ def proposal_query_service():
     statuses = ['PENDING', 'ANALYZING', 'APPROVED', 'REJECTED']
     
     while True:
+        started = time.perf_counter()
         try:
             status = random.choice(statuses)
-            result = list_proposals_by_status(status)
-            log(service_name, f"Consultou {len(result)} propostas com status {status}")
+            result = call_with_limit(service_name, call_with_retry, service_name, list_proposals_by_status, status)
+            record(service_name, time.perf_counter() - started)
+            log(service_name, f"Consultou {result} propostas com status {status}")
             time.sleep(random.uniform(0.5, 2))
         except Exception as e:
-            log(service_name, f"ERRO: {e}")
-            time.sleep(5)
+            record(service_name, time.perf_counter() - started, ok=False)
+            log_error(service_name, f"ERRO ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
 
 # ═══════════════════════════════════════════════════════════════
 #  SERVIÇO 2: CRIAÇÃO DE PROPOSTAS
 # ═══════════════════════════════════════════════════════════════
 @tracer.wrap(service="proposal-creation-service", resource="create_proposal")
 def create_proposal(customer_id, amount, proposal_type):
-    """Cria nova proposta de crédito"""
+    """Cria nova proposta de crédito; retorna o ProposalID"""
     with tracer.trace("database.insert", service="proposal-creation-service") as span:
         span.set_tag("customer_id", customer_id)
         span.set_tag("amount", amount)
         span.set_tag("proposal_type", proposal_type)
         
+        interest_rate = random.uniform(2.5, 5.5)
         conn = get_connection()
-        cursor = conn.cursor()
-        
-        query = add_dbm_comment("""
-            INSERT INTO CreditProposals 
-            (CustomerID, RequestedAmount, Status, ProposalType, InterestRate, InstallmentCount)
-            VALUES (?, ?, 'PENDING', ?, ?, 12)
-        """, "proposal-creation-service", "create_proposal")
+        try:
+            cursor = conn.cursor()
+            query = add_dbm_comment("""
+                INSERT INTO CreditProposals 
+                (CustomerID, RequestedAmount, Status, ProposalType, InterestRate, InstallmentCount)
+                OUTPUT inserted.ProposalID
+                VALUES (?, ?, 'PENDING', ?, ?, 12)
+            """, "proposal-creation-service", "create_proposal")
+            cursor.execute(query, (customer_id, amount, proposal_type, interest_rate))
+            proposal_id = cursor.fetchone()[0]
+            
+            if AUDIT.enabled:
+                # Auditoria vai para a fila depois do commit, sem o INSERT no AuditLog
+                span.set_tag("audit.mode", "async")
+            else:
+                # Log de auditoria
+                audit_query = add_dbm_comment("""
+                    INSERT INTO AuditLog (EntityType, EntityID, Action, UserService)
+                    VALUES ('PROPOSAL', ?, 'CREATE', 'proposal-creation-service')
+                """, "proposal-creation-service", "audit_log")
+                cursor.execute(audit_query, (proposal_id,))
+            
+            # Um único commit: se a auditoria falhar, o retry não duplica a proposta
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
         
-        cursor.execute(query, (customer_id, amount, proposal_type, random.uniform(2.5, 5.5)))
-        conn.commit()
+        if AUDIT.enabled:
+            AUDIT.submit("PROPOSAL", proposal_id, "CREATE", "proposal-creation-service", {
+                "CustomerID": customer_id, "RequestedAmount": amount,
+                "ProposalType": proposal_type, "InterestRate": round(interest_rate, 2),
+            })
+        return proposal_id
+
+@tracer.wrap(service="proposal-creation-service", resource="create_proposal")
+def create_proposal_procedure(customer_id, amount, proposal_type):
+    """Cria proposta e auditoria em uma chamada (SCOPE_IDENTITY); retorna o ProposalID"""
+    with tracer.trace("database.procedure", service="proposal-creation-service") as span:
+        span.set_tag("customer_id", customer_id)
+        span.set_tag("amount", amount)
+        span.set_tag("proposal_type", proposal_type)
+        span.set_tag("db.write_mode", "procedure")
         
-        # Log de auditoria
-        audit_query = add_dbm_comment("""
-            INSERT INTO AuditLog (EntityType, EntityID, Action, UserService)
-            VALUES ('PROPOSAL', @@IDENTITY, 'CREATE', 'proposal-creation-service')
-        """, "proposal-creation-service", "audit_log")
-        cursor.execute(audit_query)
-        conn.commit()
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            query = add_dbm_comment(
+                "EXEC dbo.usp_CreateProposal ?, ?, ?, ?, 12, 'proposal-creation-service'",
+                "proposal-creation-service", "create_proposal"
+            )
+            cursor.execute(query, (customer_id, amount, proposal_type, round(random.uniform(2.5, 5.5), 2)))
+            proposal_id = cursor.fetchone()[0]
+            conn.commit()
+            cursor.close()
+            return proposal_id
+        finally:
+            conn.close()
+
+@tracer.wrap(service="proposal-creation-service", resource="create_proposal_batch")
+def create_proposal_batch(proposals):
+    """Cria um lote de propostas via table-valued parameter; retorna os ProposalIDs"""
+    with tracer.trace("database.procedure", service="proposal-creation-service") as span:
+        span.set_tag("db.write_mode", "tvp")
+        span.set_tag("db.batch_size", len(proposals))
         
-        cursor.close()
-        conn.close()
+        # Linhas na ordem das colunas de dbo.ProposalInput
+        rows = [
+            (customer_id, amount, proposal_type, round(random.uniform(2.5, 5.5), 2), 12)
+            for customer_id, amount, proposal_type in proposals
+        ]
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            query = add_dbm_comment(
+                "EXEC dbo.usp_CreateProposalBatch ?, 'proposal-creation-service'",
+                "proposal-creation-service", "create_proposal_batch"
+            )
+            cursor.execute(query, (rows,))
+            proposal_ids = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            cursor.close()
+            return proposal_ids
+        finally:
+            conn.close()
+
+def _random_proposal(proposal_types):
+    return random.randint(1, 10000), random.randint(1000, 100000), random.choice(proposal_types)
 
 def proposal_creation_service():
     """Serviço que cria propostas de crédito"""
@@ -147,21 +293,40 @@ def proposal_creation_service():
     proposal_types = ['PERSONAL', 'PAYROLL', 'VEHICLE', 'HOME_EQUITY']
     
     while True:
+        started = time.perf_counter()
         try:
-            customer_id = random.randint(1, 10000)
-            amount = random.randint(1000, 100000)
-            proposal_type = random.choice(proposal_types)
-            
-            create_proposal(customer_id, amount, proposal_type)
+            if WRITE_MODE == "tvp":
+                proposals = [_random_proposal(proposal_types) for _ in range(PROPOSAL_BATCH_SIZE)]
+                proposal_ids = call_with_limit(service_name, call_with_retry, service_name, create_proposal_batch, proposals)
+                elapsed = time.perf_counter() - started
+                record(service_name, elapsed)
+                log(service_name, f"Criou {len(proposal_ids)} propostas em lote (TVP) em {elapsed * 1000:.0f}ms "
+                                  f"— {len(proposal_ids) / elapsed:.0f} propostas/s")
+                time.sleep(random.uniform(2, 5))
+                continue
+
+            customer_id, amount, proposal_type = _random_proposal(proposal_types)
+            create = create_proposal_procedure if WRITE_MODE == "procedure" else create_proposal
+            call_with_limit(service_name, call_with_retry, service_name, create, customer_id, amount, proposal_type)
+            record(service_name, time.perf_counter() - started)
             log(service_name, f"Criou proposta de R${amount} para cliente {customer_id}")
             time.sleep(random.uniform(2, 5))
         except Exception as e:
-            log(service_name, f"ERRO: {e}")
-            time.sleep(5)
+            record(service_name, time.perf_counter() - started, ok=False)
+            log_error(service_name, f"ERRO ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
 
 # ═══════════════════════════════════════════════════════════════
 #  SERVIÇO 3: ANÁLISE DE CRÉDITO (processamento pesado)
 # ═══════════════════════════════════════════════════════════════
+def score_proposal():
+    """Score, risco, recomendação e novo status de uma proposta"""
+    score = random.randint(300, 800)
+    risk = 'LOW' if score > 650 else ('MEDIUM' if score > 500 else 'HIGH')
+    recommendation = 'APPROVE' if score > 600 else 'REJECT'
+    new_status = 'APPROVED' if recommendation == 'APPROVE' else 'REJECTED'
+    return score, risk, recommendation, new_status
+
 @tracer.wrap(service="credit-analysis-service", resource="analyze_credit")
 def analyze_credit(proposal_id):
     """Analisa crédito de uma proposta"""
@@ -169,56 +334,160 @@ def analyze_credit(proposal_id):
         span.set_tag("proposal_id", proposal_id)
         
         conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Busca dados do cliente e proposta
-        query = add_dbm_comment("""
-            SELECT p.ProposalID, p.CustomerID, p.RequestedAmount,
-                   c.CreditScore, c.MonthlyIncome, c.CPF
-            FROM CreditProposals p
-            INNER JOIN Customers c ON p.CustomerID = c.CustomerID
-            WHERE p.ProposalID = ? AND p.Status = 'PENDING'
-        """, "credit-analysis-service", "fetch_proposal")
-        
-        cursor.execute(query, (proposal_id,))
-        row = cursor.fetchone()
-        
-        if row:
-            # Simula processamento
-            time.sleep(random.uniform(0.1, 0.3))
+        try:
+            cursor = conn.cursor()
             
-            credit_score = row[3]
-            score = random.randint(300, 800)
-            risk = 'LOW' if score > 650 else ('MEDIUM' if score > 500 else 'HIGH')
-            recommendation = 'APPROVE' if score > 600 else 'REJECT'
+            # Busca dados do cliente e proposta
+            query = add_dbm_comment("""
+                SELECT p.ProposalID, p.CustomerID, p.RequestedAmount,
+                       c.CreditScore, c.MonthlyIncome, c.CPF
+                FROM CreditProposals p
+                INNER JOIN Customers c ON p.CustomerID = c.CustomerID
+                WHERE p.ProposalID = ? AND p.Status = 'PENDING'
+            """, "credit-analysis-service", "fetch_proposal")
             
-            # Insere análise
-            insert_query = add_dbm_comment("""
-                INSERT INTO CreditAnalysis 
-                (ProposalID, AnalysisType, Score, RiskLevel, Recommendation, ProcessingTimeMs)
-                VALUES (?, 'AUTO', ?, ?, ?, ?)
-            """, "credit-analysis-service", "insert_analysis")
-            cursor.execute(insert_query, (proposal_id, score, risk, recommendation, random.randint(100, 500)))
+            cursor.execute(query, (proposal_id,))
+            row = cursor.fetchone()
             
-            # Atualiza status da proposta
-            update_query = add_dbm_comment("""
-                UPDATE CreditProposals 
-                SET Status = ?, AnalyzedAt = GETDATE()
-                WHERE ProposalID = ?
-            """, "credit-analysis-service", "update_status")
-            cursor.execute(update_query, (new_status, proposal_id))
+            if row:
+                # Simula processamento
+                time.sleep(random.uniform(0.1, 0.3))
+                
+                score, risk, recommendation, new_status = score_proposal()
+                
+                # Insere análise
+                insert_query = add_dbm_comment("""
+                    INSERT INTO CreditAnalysis 
+                    (ProposalID, AnalysisType, Score, RiskLevel, Recommendation, ProcessingTimeMs)
+                    VALUES (?, 'AUTO', ?, ?, ?, ?)
+                """, "credit-analysis-service", "insert_analysis")
+                cursor.execute(insert_query, (proposal_id, score, risk, recommendation, random.randint(100, 500)))
+                
+                # Atualiza status da proposta
+                update_query = add_dbm_comment("""
+                    UPDATE CreditProposals 
+                    SET Status = ?, AnalyzedAt = GETDATE()
+                    WHERE ProposalID = ?
+                """, "credit-analysis-service", "update_status")
+                cursor.execute(update_query, (new_status, proposal_id))
+                
+                conn.commit()
+                log("credit-analysis-service", f"Analisou proposta {proposal_id} - Resultado: {new_status}")
             
-            conn.commit()
-            log("credit-analysis-service", f"Analisou proposta {proposal_id} - Resultado: {new_status}")
+            cursor.close()
+        finally:
+            conn.close()
+
+# Reivindica até N pendentes e marca ANALYZING; READPAST pula as linhas já
+# travadas por outros workers, então cada proposta vai para um único worker.
+# Claim e write-back têm um só commit: ANALYZING só existe dentro da transação
+# (outras sessões veem PENDING → status final, salvo leituras com NOLOCK)
+CLAIM_PROPOSALS_SQL = """
+    WITH next_batch AS (
+        SELECT TOP (?) ProposalID, CustomerID, RequestedAmount, Status, AnalyzedBy, UpdatedAt
+        FROM CreditProposals WITH (UPDLOCK, READPAST, ROWLOCK)
+        WHERE Status = 'PENDING'
+        ORDER BY CreatedAt ASC
+    )
+    UPDATE next_batch
+    SET Status = 'ANALYZING', AnalyzedBy = ?, UpdatedAt = GETDATE()
+    OUTPUT inserted.ProposalID, inserted.CustomerID, inserted.RequestedAmount
+"""
+
+# Grava análises e status de até _APPLY_ROWS propostas em uma ida ao servidor
+APPLY_ANALYSIS_SQL = """
+    SET NOCOUNT ON;
+    DECLARE @results TABLE (
+        ProposalID INT PRIMARY KEY, Score INT, RiskLevel VARCHAR(20),
+        Recommendation VARCHAR(50), ProcessingTimeMs INT, Status VARCHAR(50)
+    );
+    INSERT INTO @results VALUES {values};
+
+    INSERT INTO CreditAnalysis (ProposalID, AnalysisType, Score, RiskLevel, Recommendation, ProcessingTimeMs)
+    SELECT ProposalID, 'AUTO', Score, RiskLevel, Recommendation, ProcessingTimeMs FROM @results;
+
+    UPDATE p
+    SET Status = r.Status, AnalyzedAt = GETDATE(), UpdatedAt = GETDATE()
+    FROM CreditProposals p
+    INNER JOIN @results r ON r.ProposalID = p.ProposalID;
+"""
+
+# Limite de 2100 parâmetros por batch no SQL Server: 300 linhas × 6 colunas
+_APPLY_ROWS = 300
+
+@tracer.wrap(service="credit-analysis-service", resource="analyze_credit_batch")
+def analyze_credit_batch(batch_size, worker):
+    """Reivindica, analisa e grava um lote de propostas em uma transação; retorna os status"""
+    with tracer.trace("database.transaction", service="credit-analysis-service") as span:
+        span.set_tag("db.batch_size", batch_size)
+        span.set_tag("analysis.worker", worker)
         
-        cursor.close()
-        conn.close()
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            
+            # Claim e write-back na mesma transação: se o worker falhar, fechar a
+            # conexão sem commit devolve as propostas para PENDING
+            claim_query = add_dbm_comment(CLAIM_PROPOSALS_SQL, "credit-analysis-service", "claim_proposals")
+            cursor.execute(claim_query, (batch_size, worker))
+            claimed = cursor.fetchall()
+            span.set_tag("db.claimed", len(claimed))
+            if not claimed:
+                return []
+            
+            # Score em memória, sem ida ao banco por proposta
+            results = []
+            for proposal_id, customer_id, amount in claimed:
+                score, risk, recommendation, new_status = score_proposal()
+                results.append((proposal_id, score, risk, recommendation, random.randint(100, 500), new_status))
+            
+            # Lotes grandes (ANALYSIS_BATCH_SIZE > _APPLY_ROWS) vão em partes, na mesma transação
+            for i in range(0, len(results), _APPLY_ROWS):
+                chunk = results[i:i + _APPLY_ROWS]
+                apply_query = add_dbm_comment(
+                    APPLY_ANALYSIS_SQL.format(values=", ".join(["(?, ?, ?, ?, ?, ?)"] * len(chunk))),
+                    "credit-analysis-service", "apply_analysis"
+                )
+                cursor.execute(apply_query, [value for result in chunk for value in result])
+            conn.commit()
+            cursor.close()
+            return [result[5] for result in results]
+        finally:
+            conn.close()
+
+def credit_analysis_queue_worker():
+    """Consumidor da fila de propostas pendentes (ANALYSIS_MODE=queue)"""
+    service_name = "credit-analysis-service"
+    # Identifica o worker em CreditProposals.AnalyzedBy (vários processos/hosts)
+    worker = f"{socket.gethostname()}:{threading.current_thread().name}"
+    
+    while True:
+        started = time.perf_counter()
+        try:
+            statuses = call_with_limit(service_name, call_with_retry, service_name, analyze_credit_batch, ANALYSIS_BATCH_SIZE, worker)
+            elapsed = time.perf_counter() - started
+            record(service_name, elapsed)
+            if statuses:
+                approved = statuses.count('APPROVED')
+                log(service_name, f"[{worker}] Analisou {len(statuses)} propostas "
+                                  f"({approved} aprovadas) em {elapsed * 1000:.0f}ms")
+            else:
+                log(service_name, "Nenhuma proposta pendente")
+            
+            # Lote cheio: ainda há fila, segue sem esperar
+            if len(statuses) < ANALYSIS_BATCH_SIZE:
+                time.sleep(random.uniform(1, 3))
+        except Exception as e:
+            record(service_name, time.perf_counter() - started, ok=False)
+            log_error(service_name, f"ERRO ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
 
 def credit_analysis_service():
     """Serviço que analisa propostas pendentes"""
     service_name = "credit-analysis-service"
     
     while True:
+        started = time.perf_counter()
         try:
             # Busca propostas pendentes
             conn = get_connection()
@@ -234,14 +503,16 @@ def credit_analysis_service():
             conn.close()
             
             if row:
-                analyze_credit(row[0])
+                call_with_limit(service_name, call_with_retry, service_name, analyze_credit, row[0])
             else:
                 log(service_name, "Nenhuma proposta pendente")
+            record(service_name, time.perf_counter() - started)
             
             time.sleep(random.uniform(1, 3))
         except Exception as e:
-            log(service_name, f"ERRO: {e}")
-            time.sleep(5)
+            record(service_name, time.perf_counter() - started, ok=False)
+            log_error(service_name, f"ERRO ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
 
 # ═══════════════════════════════════════════════════════════════
 #  SERVIÇO 4: CONSULTA DE CLIENTES (com possível problema)
@@ -252,39 +523,39 @@ def get_customer_history(cpf):
     with tracer.trace("database.query", service="customer-query-service") as span:
         span.set_tag("cpf", cpf)
         
-        conn = get_connection()
-        cursor = conn.cursor()
+        with READS.connection() as conn:
+            cursor = conn.cursor()
         
-        # Query que pode ficar lenta se não tiver índice adequado
-        if PROBLEMS_ENABLED['missing_indexes']:
-            # Remove hint de índice, força table scan
-            query = add_dbm_comment("""
-                SELECT c.CustomerID, c.FullName, c.CreditScore,
-                       COUNT(p.ProposalID) as total_proposals,
-                       SUM(CASE WHEN p.Status = 'APPROVED' THEN 1 ELSE 0 END) as approved_count,
-                       MAX(p.CreatedAt) as last_proposal
-                FROM Customers c WITH (INDEX(0))
-                LEFT JOIN CreditProposals p ON c.CustomerID = p.CustomerID
-                WHERE c.CPF = ?
-                GROUP BY c.CustomerID, c.FullName, c.CreditScore
-            """, "customer-query-service", "customer_history_slow")
-        else:
-            query = add_dbm_comment("""
-                SELECT c.CustomerID, c.FullName, c.CreditScore,
-                       COUNT(p.ProposalID) as total_proposals,
-                       SUM(CASE WHEN p.Status = 'APPROVED' THEN 1 ELSE 0 END) as approved_count,
-                       MAX(p.CreatedAt) as last_proposal
-                FROM Customers c
-                LEFT JOIN CreditProposals p ON c.CustomerID = p.CustomerID
-                WHERE c.CPF = ?
-                GROUP BY c.CustomerID, c.FullName, c.CreditScore
-            """, "customer-query-service", "customer_history")
+            # Query que pode ficar lenta se não tiver índice adequado
+            if PROBLEMS_ENABLED['missing_indexes']:
+                # Remove hint de índice, força table scan
+                query = add_dbm_comment("""
+                    SELECT c.CustomerID, c.FullName, c.CreditScore,
+                           COUNT(p.ProposalID) as total_proposals,
+                           SUM(CASE WHEN p.Status = 'APPROVED' THEN 1 ELSE 0 END) as approved_count,
+                           MAX(p.CreatedAt) as last_proposal
+                    FROM Customers c WITH (INDEX(0))
+                    LEFT JOIN CreditProposals p ON c.CustomerID = p.CustomerID
+                    WHERE c.CPF = ?
+                    GROUP BY c.CustomerID, c.FullName, c.CreditScore
+                """, "customer-query-service", "customer_history_slow")
+            else:
+                query = add_dbm_comment("""
+                    SELECT c.CustomerID, c.FullName, c.CreditScore,
+                           COUNT(p.ProposalID) as total_proposals,
+                           SUM(CASE WHEN p.Status = 'APPROVED' THEN 1 ELSE 0 END) as approved_count,
+                           MAX(p.CreatedAt) as last_proposal
+                    FROM Customers c
+                    LEFT JOIN CreditProposals p ON c.CustomerID = p.CustomerID
+                    WHERE c.CPF = ?
+                    GROUP BY c.CustomerID, c.FullName, c.CreditScore
+                """, "customer-query-service", "customer_history")
+            PLANS.observe("get_customer_history", "customer-query-service", query, (cpf,))
         
-        cursor.execute(query, (cpf,))
-        row = cursor.fetchone()
+            cursor.execute(query, (cpf,))
+            row = cursor.fetchone()
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         return row
 
@@ -293,62 +564,60 @@ def customer_query_service():
     service_name = "customer-query-service"
     
     while True:
+        started = time.perf_counter()
         try:
             cpf = f"{random.randint(1, 10000):011d}"
-            result = get_customer_history(cpf)
+            result = call_with_limit(service_name, call_with_retry, service_name, get_customer_history, cpf)
+            record(service_name, time.perf_counter() - started)
             if result:
                 log(service_name, f"Consultou histórico do CPF {cpf}")
             time.sleep(random.uniform(1, 3))
         except Exception as e:
-            log(service_name, f"ERRO: {e}")
-            time.sleep(5)
+            record(service_name, time.perf_counter() - started, ok=False)
+            log_error(service_name, f"ERRO ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
 
 # ═══════════════════════════════════════════════════════════════
 #  SERVIÇO 5: RELATÓRIOS E ANALYTICS (queries pesadas)
 # ═══════════════════════════════════════════════════════════════
 @tracer.wrap(service="analytics-service", resource="daily_report")
 def generate_daily_report():
-    """Gera relatório diário - query pesada"""
+    """Gera relatório diário - query pesada; retorna o número de linhas"""
     with tracer.trace("database.analytics", service="analytics-service") as span:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        if PROBLEMS_ENABLED['slow_queries']:
-            # Query sem otimização
-            query = add_dbm_comment("""
-                SELECT 
-                    p.ProposalType,
-                    p.Status,
-                    COUNT(*) as total,
-                    AVG(p.RequestedAmount) as avg_amount,
-                    SUM(p.RequestedAmount) as total_amount,
-                    AVG(c.CreditScore) as avg_credit_score,
-                    COUNT(DISTINCT p.CustomerID) as unique_customers
-                FROM CreditProposals p
-                INNER JOIN Customers c ON p.CustomerID = c.CustomerID
-                LEFT JOIN CreditAnalysis ca ON p.ProposalID = ca.ProposalID
-                WHERE p.CreatedAt >= DATEADD(day, -1, GETDATE())
-                GROUP BY p.ProposalType, p.Status
-                ORDER BY total DESC
-            """, "analytics-service", "daily_report_slow")
-        else:
-            query = add_dbm_comment("""
-                SELECT 
-                    p.ProposalType,
-                    p.Status,
-                    COUNT(*) as total,
-                    AVG(p.RequestedAmount) as avg_amount
-                FROM CreditProposals p
-                WHERE p.CreatedAt >= DATEADD(day, -1, GETDATE())
-                GROUP BY p.ProposalType, p.Status
-            """, "analytics-service", "daily_report")
-        
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        with READS.connection() as conn:
+            if PROBLEMS_ENABLED['slow_queries']:
+                # Query sem otimização
+                query = add_dbm_comment("""
+                    SELECT 
+                        p.ProposalType,
+                        p.Status,
+                        COUNT(*) as total,
+                        AVG(p.RequestedAmount) as avg_amount,
+                        SUM(p.RequestedAmount) as total_amount,
+                        AVG(c.CreditScore) as avg_credit_score,
+                        COUNT(DISTINCT p.CustomerID) as unique_customers
+                    FROM CreditProposals p
+                    INNER JOIN Customers c ON p.CustomerID = c.CustomerID
+                    LEFT JOIN CreditAnalysis ca ON p.ProposalID = ca.ProposalID
+                    WHERE p.CreatedAt >= DATEADD(day, -1, GETDATE())
+                    GROUP BY p.ProposalType, p.Status
+                    ORDER BY total DESC
+                """, "analytics-service", "daily_report_slow")
+            else:
+                query = add_dbm_comment("""
+                    SELECT 
+                        p.ProposalType,
+                        p.Status,
+                        COUNT(*) as total,
+                        AVG(p.RequestedAmount) as avg_amount
+                    FROM CreditProposals p
+                    WHERE p.CreatedAt >= DATEADD(day, -1, GETDATE())
+                    GROUP BY p.ProposalType, p.Status
+                """, "analytics-service", "daily_report")
+            PLANS.observe("daily_report", "analytics-service", query)
         
-        span.set_tag("report.row_count", len(rows))
-        cursor.close()
-        conn.close()
+            rows = sum(1 for _ in read_rows(conn, query, service="analytics-service"))
+            span.set_tag("report.row_count", rows)
         
         return rows
 
@@ -357,20 +626,23 @@ def analytics_service():
     service_name = "analytics-service"
     
     while True:
+        started = time.perf_counter()
         try:
-            result = generate_daily_report()
-            log(service_name, f"Gerou relatório com {len(result)} linhas")
+            result = call_with_limit(service_name, call_with_retry, service_name, generate_daily_report)
+            record(service_name, time.perf_counter() - started)
+            log(service_name, f"Gerou relatório com {result} linhas")
             time.sleep(random.uniform(10, 20))  # Menos frequente
         except Exception as e:
-            log(service_name, f"ERRO: {e}")
-            time.sleep(15)
+            record(service_name, time.perf_counter() - started, ok=False)
+            log_error(service_name, f"ERRO ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
 
 # ═══════════════════════════════════════════════════════════════
 #  CONTROLE DE PROBLEMAS (Timeline)
 # ═══════════════════════════════════════════════════════════════
 def problem_controller():
     """Controla quando os problemas aparecem durante o dia"""
-    log("PROBLEM-CONTROLLER", "Iniciando controle de problemas")
+    announce("PROBLEM-CONTROLLER", "Iniciando controle de problemas")
     
     # Simula um dia de trabalho acelerado (1 minuto real = 1 hora simulada)
     start_time = datetime.now()
@@ -383,24 +655,24 @@ def problem_controller():
         if 9 <= simulated_hour < 12 or 14 <= simulated_hour < 18:
             if simulated_hour >= 11 and not PROBLEMS_ENABLED['slow_queries']:
                 PROBLEMS_ENABLED['slow_queries'] = True
-                log("PROBLEM-CONTROLLER", "⚠️  PROBLEMA ATIVADO: Queries lentas (11h)")
+                announce("PROBLEM-CONTROLLER", "⚠️  PROBLEMA ATIVADO: Queries lentas (11h)")
             
             if simulated_hour >= 15 and not PROBLEMS_ENABLED['missing_indexes']:
                 PROBLEMS_ENABLED['missing_indexes'] = True
-                log("PROBLEM-CONTROLLER", "⚠️  PROBLEMA ATIVADO: Índices ausentes (15h)")
+                announce("PROBLEM-CONTROLLER", "⚠️  PROBLEMA ATIVADO: Índices ausentes (15h)")
             
             if simulated_hour >= 17 and not PROBLEMS_ENABLED['high_cpu']:
                 PROBLEMS_ENABLED['high_cpu'] = True
-                log("PROBLEM-CONTROLLER", "⚠️  PROBLEMA ATIVADO: Alto CPU (17h)")
+                announce("PROBLEM-CONTROLLER", "⚠️  PROBLEMA ATIVADO: Alto CPU (17h)")
         
         # Madrugada - reset dos problemas
         if simulated_hour == 0:
             PROBLEMS_ENABLED['slow_queries'] = False
             PROBLEMS_ENABLED['missing_indexes'] = False
             PROBLEMS_ENABLED['high_cpu'] = False
-            log("PROBLEM-CONTROLLER", "✓ Reset de problemas (00h)")
+            announce("PROBLEM-CONTROLLER", "✓ Reset de problemas (00h)")
         
-        log("PROBLEM-CONTROLLER", f"Hora simulada: {simulated_hour:02d}:00 | Problemas ativos: {sum(PROBLEMS_ENABLED.values())}")
+        announce("PROBLEM-CONTROLLER", f"Hora simulada: {simulated_hour:02d}:00 | Problemas ativos: {sum(PROBLEMS_ENABLED.values())}")
         time.sleep(60)  # Verifica a cada minuto
 
 # ═══════════════════════════════════════════════════════════════
@@ -412,30 +684,83 @@ def main():
     print("  Múltiplos serviços com problemas graduais para análise DBM")
     print("=" * 70)
     
+    # Banco e trace agent prontos (probes com backoff, sem sleep fixo)
+    if not wait_ready(lambda: pyodbc.connect(CONN_STRING), "SQL Server"):
+        return
+    report_first_operation()
+    
+    # Auditoria write-behind antes dos serviços que enfileiram eventos (AUDIT_MODE=async)
+    AUDIT.start()
+    
     # Inicia serviços em threads separadas
     services = [
         threading.Thread(target=proposal_query_service, daemon=True, name="ProposalQuery"),
         threading.Thread(target=proposal_creation_service, daemon=True, name="ProposalCreation"),
-        threading.Thread(target=credit_analysis_service, daemon=True, name="CreditAnalysis"),
         threading.Thread(target=customer_query_service, daemon=True, name="CustomerQuery"),
         threading.Thread(target=analytics_service, daemon=True, name="Analytics"),
         threading.Thread(target=problem_controller, daemon=True, name="ProblemController"),
     ]
+    if ANALYSIS_MODE == "queue":
+        services[2:2] = [
+            threading.Thread(target=credit_analysis_queue_worker, daemon=True, name=f"CreditAnalysis-{i}")
+            for i in range(1, ANALYSIS_WORKERS + 1)
+        ]
+    else:
+        services.insert(2, threading.Thread(target=credit_analysis_service, daemon=True, name="CreditAnalysis"))
     
     for service in services:
         service.start()
-        log("MAIN", f"Serviço {service.name} iniciado")
-        time.sleep(0.5)
+        announce("MAIN", f"Serviço {service.name} iniciado")
     
-    log("MAIN", "✓ Todos os serviços estão rodando!")
-    log("MAIN", "Pressione Ctrl+C para parar")
+    announce("MAIN", "✓ Todos os serviços estão rodando!")
+    if REPLICA_CONN_STRINGS:
+        announce("MAIN", f"Leituras roteadas para {len(REPLICA_CONN_STRINGS)} réplica(s) ({READS.strategy})")
+    if WRITE_MODE != "inline":
+        announce("MAIN", f"Propostas gravadas por stored procedure ({WRITE_MODE}"
+                         + (f", lotes de {PROPOSAL_BATCH_SIZE})" if WRITE_MODE == "tvp" else ")"))
+    if ANALYSIS_MODE == "queue":
+        announce("MAIN", f"Análise de crédito em fila: {ANALYSIS_WORKERS} worker(s), "
+                         f"lotes de {ANALYSIS_BATCH_SIZE} (UPDLOCK, READPAST)")
+    if RESULT_MODE == "stream":
+        announce("MAIN", f"Leituras em streaming (fetchmany de {RESULT_FETCH_SIZE} linhas)")
+
+    # Incidentes concorrentes com a carga (INCIDENT_SCHEDULE / INCIDENT_TRIGGER_FILE)
+    incidents = IncidentEngine(
+        lambda: pyodbc.connect(INCIDENT_CONN_STRING), INCIDENT_SQL_DIR, INCIDENT_SCENARIOS
+    )
+    incidents.start()
+
+    # Deltas de sys.dm_exec_query_stats em arquivo local (STATS_FILE)
+    StatsCollector("sqlserver", lambda: pyodbc.connect(STATS_CONN_STRING)).start()
+
+    # Troca de plano x regressão de latência por resource (PLAN_INTERVAL)
+    PLANS.start()
+
+    # Estatísticas por fingerprint no cliente (FINGERPRINT_EXPORT)
+    start_fingerprint_export()
+
+    # Cadeias de bloqueio por serviço (LOCK_SAMPLE_INTERVAL); as DMVs exigem VIEW SERVER STATE
+    LockSampler("sqlserver", lambda: pyodbc.connect(STATS_CONN_STRING)).start()
+
+    # Limite adaptativo de concorrência por serviço e do processo (CONCURRENCY_LIMIT)
+    start_limit_report()
+
+    # Linha do tempo de recursos do processo e sessões por programa (SOAK_INTERVAL);
+    # ver as sessões dos outros programas exige VIEW SERVER STATE
+    SoakMonitor("sqlserver", lambda: pyodbc.connect(
+        STATS_CONN_STRING.replace("APP=credit-simulator;", "APP=soak-monitor;")
+    )).start()
+
+    announce("MAIN", "Pressione Ctrl+C para parar")
     
     # Mantém o programa rodando
     try:
         while True:
             time.sleep(60)
     except KeyboardInterrupt:
-        log("MAIN", "Encerrando simulação...")
+        announce("MAIN", "Encerrando simulação...")
+        AUDIT.close()
+        flush_logs()
 
 if __name__ == "__main__":
     main()
@@ -2,15 +2,52 @@
 """
 Aplicação de stress test com Datadog APM habilitado
 Gera traces end-to-end: código → query SQL → explain plan
+
+Modos (STRESS_MODE):
+    loop        → uma operação aleatória por vez, 2–5s entre elas, conexão
+                  nova por chamada (comportamento original)
+    concurrent  → workers por endpoint em paralelo, conexões de um pool,
+                  taxa alvo opcional e relatório de throughput/latência
+                  por endpoint
+
+Configuração do modo concurrent:
+    STRESS_WORKERS           workers por endpoint: "8" (todos) ou
+                             "get_orders=4,update_inventory=16"
+    STRESS_TARGET_RATE       ops/s por endpoint, mesmo formato (0/vazio → sem limite)
+    STRESS_POOL_SIZE         conexões do pool (default: total de workers)
+    STRESS_DURATION          segundos de execução (0 → até Ctrl+C)
+    STRESS_REPORT_INTERVAL   intervalo do relatório em segundos (default 10)
+
+No modo concurrent cada endpoint passa pelo limite adaptativo de
+concorrência quando CONCURRENCY_LIMIT está ligado (concurrency_limit.py).
 """
 
+import os
 import time
+import queue
 import random
+import threading
+from contextlib import contextmanager
+
 import pyodbc
-from ddtrace import tracer, patch_all
+from ddtrace import tracer
+
+import service_metrics
+import concurrency_limit
+from batch_logger import log, log_error, announce, flush as flush_logs
+from retry_policy import error_class_of, failure_pause
+from result_stream import read_rows
+from query_fingerprint import track, start_export as start_fingerprint_export
+from fake_db import DB_BACKEND, install as install_fake_db
+from startup import instrument, wait_ready, report_first_operation
+from soak_monitor import SoakMonitor
 
-# Habilita instrumentação automática (SQL, HTTP, etc.)
-patch_all()
+# Backend em memória (DB_BACKEND=fake) entra antes do patch do ddtrace
+if DB_BACKEND == "fake":
+    install_fake_db(pyodbc)
+
+# Instrumentação só do pyodbc (nenhuma com DD_TRACE_ENABLED=false)
+instrument(pyodbc=True)
 
 # Configuração do banco (usando usuário específico da aplicação)
 CONN_STRING = (
@@ -20,25 +57,81 @@ CONN_STRING = (
     "UID=app_user;"
     "PWD=AppUser123!@#;"
     "TrustServerCertificate=yes;"
+    "APP=simdb-api;"
 )
 
 
+STRESS_MODE = os.getenv("STRESS_MODE", "loop")
+STRESS_WORKERS = os.getenv("STRESS_WORKERS", "4")
+STRESS_TARGET_RATE = os.getenv("STRESS_TARGET_RATE", "")
+STRESS_POOL_SIZE = int(os.getenv("STRESS_POOL_SIZE", 0))
+STRESS_DURATION = float(os.getenv("STRESS_DURATION", 0))
+STRESS_REPORT_INTERVAL = float(os.getenv("STRESS_REPORT_INTERVAL", 10))
+
+
 def get_connection():
-    """Cria conexão com SQL Server"""
-    return pyodbc.connect(CONN_STRING)
+    """Cria conexão com SQL Server (estatísticas por fingerprint de query)"""
+    return track(pyodbc.connect(CONN_STRING))
+
+
+class ConnectionPool:
+    """Pool de conexões com limite de tamanho; conexões criadas sob demanda."""
+
+    def __init__(self, size, connect=get_connection):
+        self.connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão; descarta a conexão se a operação falhar."""
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+                # Cada operação é um statement só; sem transação aberta no pool
+                conn.autocommit = True
+            yield conn
+            self._idle.put(conn)
+        except Exception:
+            if conn is not None:
+                try:
+                    conn.close()
+                except pyodbc.Error:
+                    pass
+            raise
+        finally:
+            self._slots.release()
+
+
+# Sem pool (modo loop), cada chamada abre e fecha a própria conexão
+POOL = None
+
+
+@contextmanager
+def connection():
+    if POOL is not None:
+        with POOL.connection() as conn:
+            yield conn
+        return
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
 
 
 @tracer.wrap(service="simdb-api", resource="get_orders")
 def get_orders(customer_id):
-    """Busca pedidos de um cliente específico"""
+    """Busca pedidos de um cliente específico; retorna quantos leu"""
     with tracer.trace("database.query", service="simdb-api") as span:
         span.set_tag("customer_id", customer_id)
         span.set_tag("db.system", "sqlserver")
         span.set_tag("db.name", "SimDB")
         
-        conn = get_connection()
-        cursor = conn.cursor()
-        
         # Query com JOIN (vai gerar explain plan interessante)
         query = """
             SELECT o.OrderID, o.Amount, o.Status, o.CreatedAt,
@@ -51,27 +144,19 @@ def get_orders(customer_id):
             ORDER BY o.CreatedAt DESC
         """
         
-        cursor.execute(query, (customer_id,))
-        rows = cursor.fetchall()
-        
-        span.set_tag("db.row_count", len(rows))
-        cursor.close()
-        conn.close()
-        
-        return rows
+        with connection() as conn:
+            # Conta linha a linha: em RESULT_MODE=stream o resultado não é materializado
+            return sum(1 for _ in read_rows(conn, query, (customer_id,), service="simdb-api"))
 
 
 @tracer.wrap(service="simdb-api", resource="get_inventory")
 def get_inventory(min_stock):
-    """Busca produtos com estoque baixo"""
+    """Busca produtos com estoque baixo; retorna quantos leu"""
     with tracer.trace("database.query", service="simdb-api") as span:
         span.set_tag("min_stock", min_stock)
         span.set_tag("db.system", "sqlserver")
         span.set_tag("db.name", "SimDB")
         
-        conn = get_connection()
-        cursor = conn.cursor()
-        
         query = """
             SELECT ProductID, Stock, LastUpdated
             FROM Inventory
@@ -79,14 +164,8 @@ def get_inventory(min_stock):
             ORDER BY Stock ASC
         """
         
-        cursor.execute(query, (min_stock,))
-        rows = cursor.fetchall()
-        
-        span.set_tag("db.row_count", len(rows))
-        cursor.close()
-        conn.close()
-        
-        return rows
+        with connection() as conn:
+            return sum(1 for _ in read_rows(conn, query, (min_stock,), service="simdb-api"))
 
 
 @tracer.wrap(service="simdb-api", resource="slow_analytics")
@@ -97,9 +176,6 @@ def slow_analytics():
         span.set_tag("db.name", "SimDB")
         span.set_tag("query_type", "analytics")
         
-        conn = get_connection()
-        cursor = conn.cursor()
-        
         # Query com window function e múltiplos JOINs
         query = """
             SELECT TOP 100
@@ -120,14 +196,8 @@ def slow_analytics():
             ORDER BY running_total DESC
         """
         
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        
-        span.set_tag("db.row_count", len(rows))
-        cursor.close()
-        conn.close()
-        
-        return rows
+        with connection() as conn:
+            return sum(1 for _ in read_rows(conn, query, service="simdb-api"))
 
 
 @tracer.wrap(service="simdb-api", resource="update_inventory")
@@ -139,9 +209,6 @@ def update_inventory(product_id, quantity):
         span.set_tag("db.system", "sqlserver")
         span.set_tag("db.name", "SimDB")
         
-        conn = get_connection()
-        cursor = conn.cursor()
-        
         query = """
             UPDATE Inventory
             SET Stock = Stock - ?,
@@ -149,12 +216,172 @@ def update_inventory(product_id, quantity):
             WHERE ProductID = ?
         """
         
-        cursor.execute(query, (quantity, product_id))
-        conn.commit()
-        
-        span.set_tag("db.rows_affected", cursor.rowcount)
-        cursor.close()
-        conn.close()
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (quantity, product_id))
+            conn.commit()
+            
+            span.set_tag("db.rows_affected", cursor.rowcount)
+            cursor.close()
+
+
+# ── Endpoints da API simulada ─────────────────────────────────
+def api_get_orders():
+    customer_id = random.randint(1, 1000)
+    with tracer.trace("api.request", service="simdb-api") as span:
+        span.set_tag("http.method", "GET")
+        span.set_tag("http.url", f"/api/orders?customer_id={customer_id}")
+        orders = get_orders(customer_id)
+    return f"GET /api/orders (customer={customer_id}): {orders} orders"
+
+
+def api_get_inventory():
+    min_stock = random.randint(50, 150)
+    with tracer.trace("api.request", service="simdb-api") as span:
+        span.set_tag("http.method", "GET")
+        span.set_tag("http.url", f"/api/inventory?min_stock={min_stock}")
+        inventory = get_inventory(min_stock)
+    return f"GET /api/inventory (min={min_stock}): {inventory} products"
+
+
+def api_slow_analytics():
+    with tracer.trace("api.request", service="simdb-api") as span:
+        span.set_tag("http.method", "GET")
+        span.set_tag("http.url", "/api/analytics/customer-value")
+        results = slow_analytics()
+    return f"GET /api/analytics (slow query): {results} results"
+
+
+def api_update_inventory():
+    # Linhas quentes: só ProductID 1–3 → contenção de lock em concorrência
+    product_id = random.randint(1, 3)
+    quantity = random.randint(1, 5)
+    with tracer.trace("api.request", service="simdb-api") as span:
+        span.set_tag("http.method", "POST")
+        span.set_tag("http.url", f"/api/inventory/{product_id}")
+        update_inventory(product_id, quantity)
+    return f"POST /api/inventory/{product_id} (qty={quantity})"
+
+
+ENDPOINTS = {
+    "get_orders": api_get_orders,
+    "get_inventory": api_get_inventory,
+    "slow_analytics": api_slow_analytics,
+    "update_inventory": api_update_inventory,
+}
+
+
+def parse_per_endpoint(spec, cast=int, default=0):
+    """'8' → 8 para todos; 'get_orders=4,update_inventory=16' → só esses (demais = default)."""
+    spec = spec.strip()
+    if not spec:
+        return {name: default for name in ENDPOINTS}
+    if "=" not in spec:
+        return {name: cast(spec) for name in ENDPOINTS}
+    values = {name: default for name in ENDPOINTS}
+    for part in spec.split(","):
+        name, value = part.split("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Endpoint desconhecido: {name} (opções: {', '.join(ENDPOINTS)})")
+        values[name] = cast(value)
+    return values
+
+
+class RateLimiter:
+    """Espaça as operações de um endpoint para no máximo `rate` ops/s (todos os workers)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.perf_counter()
+            # Sem acumular crédito quando os workers ficam para trás
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def endpoint_worker(name, limiter, deadline):
+    """Executa o endpoint em loop, sem pausa além da taxa alvo."""
+    service = f"simdb-api.{name}"
+    call = ENDPOINTS[name]
+    while not deadline or time.time() < deadline:
+        if limiter:
+            limiter.wait()
+        started = time.perf_counter()
+        try:
+            result = concurrency_limit.call_with_limit(service, call)
+            service_metrics.record(service, time.perf_counter() - started)
+            log(service, f"✓ {result}")
+        except Exception as e:
+            service_metrics.record(service, time.perf_counter() - started, ok=False)
+            log_error(service, f"✗ Error ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
+
+
+def report(start, end, title):
+    """Throughput e latência por endpoint entre start e end."""
+    stats = service_metrics.window(start, end)
+    limits = concurrency_limit.snapshot() if concurrency_limit.enabled() else {}
+    lines = [title]
+    for name in ENDPOINTS:
+        s = stats.get(f"simdb-api.{name}")
+        if not s:
+            continue
+        line = (f"    {name:<17} {s['ops_per_s']:>8.1f} ops/s  p50 {s['p50_ms']:>7.1f}ms  "
+                f"p95 {s['p95_ms']:>7.1f}ms  p99 {s['p99_ms']:>7.1f}ms  erros {s['errors']}")
+        limit = limits.get(f"simdb-api.{name}")
+        if limit:
+            # Rejeições entram em "erros"; o limite é o atual, as rejeições acumuladas
+            line += f"  limite {limit['limit']:.1f}  rejeitadas {limit['rejected']}"
+        lines.append(line)
+    announce("STRESS", "\n".join(lines))
+
+
+def run_concurrent():
+    """Workers por endpoint em paralelo sobre um pool de conexões."""
+    global POOL
+    workers = parse_per_endpoint(STRESS_WORKERS)
+    rates = parse_per_endpoint(STRESS_TARGET_RATE, float, 0.0)
+    total = sum(workers.values())
+    if not total:
+        raise ValueError("STRESS_WORKERS não define nenhum worker")
+    POOL = ConnectionPool(STRESS_POOL_SIZE or total)
+
+    began = time.time()
+    deadline = began + STRESS_DURATION if STRESS_DURATION else None
+    threads = []
+    for name, count in workers.items():
+        if not count:
+            continue
+        limiter = RateLimiter(rates[name]) if rates[name] > 0 else None
+        for i in range(count):
+            t = threading.Thread(target=endpoint_worker, args=(name, limiter, deadline),
+                                 daemon=True, name=f"{name}-{i + 1}")
+            t.start()
+            threads.append(t)
+        rate = f", alvo {rates[name]:.0f} ops/s" if limiter else ""
+        announce("STRESS", f"{name}: {count} worker(s){rate}")
+    announce("STRESS", f"{total} workers, pool de {STRESS_POOL_SIZE or total} conexões")
+    concurrency_limit.start_report()
+
+    last = began
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(STRESS_REPORT_INTERVAL)
+            now = time.time()
+            report(last, now, f"📈 Últimos {now - last:.0f}s")
+            last = now
+    except KeyboardInterrupt:
+        pass
+    report(began, time.time(), f"📊 Total ({time.time() - began:.0f}s)")
+    flush_logs()
 
 
 def main():
@@ -163,6 +390,12 @@ def main():
     print("   Service: simdb-api")
     print("   Traces sendo enviados para Datadog Agent")
     print("")
+    start_fingerprint_export()
+    SoakMonitor("sqlserver", lambda: pyodbc.connect(CONN_STRING.replace("APP=simdb-api;", "APP=soak-monitor;"))).start()
+    
+    if STRESS_MODE == "concurrent":
+        run_concurrent()
+        return
     
     iteration = 0
     
@@ -171,56 +404,20 @@ def main():
         
         try:
             # Simula diferentes operações com traces
-            operation = random.choice([
-                "get_orders",
-                "get_inventory",
-                "slow_analytics",
-                "update_inventory"
-            ])
-            
-            if operation == "get_orders":
-                customer_id = random.randint(1, 1000)
-                with tracer.trace("api.request", service="simdb-api") as span:
-                    span.set_tag("http.method", "GET")
-                    span.set_tag("http.url", f"/api/orders?customer_id={customer_id}")
-                    orders = get_orders(customer_id)
-                    print(f"✓ [{iteration}] GET /api/orders (customer={customer_id}): {len(orders)} orders")
-            
-            elif operation == "get_inventory":
-                min_stock = random.randint(50, 150)
-                with tracer.trace("api.request", service="simdb-api") as span:
-                    span.set_tag("http.method", "GET")
-                    span.set_tag("http.url", f"/api/inventory?min_stock={min_stock}")
-                    inventory = get_inventory(min_stock)
-                    print(f"✓ [{iteration}] GET /api/inventory (min={min_stock}): {len(inventory)} products")
-            
-            elif operation == "slow_analytics":
-                with tracer.trace("api.request", service="simdb-api") as span:
-                    span.set_tag("http.method", "GET")
-                    span.set_tag("http.url", "/api/analytics/customer-value")
-                    results = slow_analytics()
-                    print(f"✓ [{iteration}] GET /api/analytics (slow query): {len(results)} results")
-            
-            elif operation == "update_inventory":
-                product_id = random.randint(1, 3)
-                quantity = random.randint(1, 5)
-                with tracer.trace("api.request", service="simdb-api") as span:
-                    span.set_tag("http.method", "POST")
-                    span.set_tag("http.url", f"/api/inventory/{product_id}")
-                    update_inventory(product_id, quantity)
-                    print(f"✓ [{iteration}] POST /api/inventory/{product_id} (qty={quantity})")
+            operation = random.choice(list(ENDPOINTS))
+            result = ENDPOINTS[operation]()
+            log("simdb-api", f"✓ [{iteration}] {result}")
             
             # Intervalo entre requests
             time.sleep(random.uniform(2, 5))
         
         except Exception as e:
-            print(f"✗ [{iteration}] Error: {e}")
-            time.sleep(5)
+            log_error("simdb-api", f"✗ [{iteration}] Error ({error_class_of(e)}): {e}")
+            time.sleep(failure_pause(e))
 
 
 if __name__ == "__main__":
-    # Aguarda SQL Server e Datadog Agent ficarem prontos
-    print("Aguardando 15 segundos para SQL Server e Datadog Agent iniciarem...")
-    time.sleep(15)
-    
-    main()
+    # Aguarda SQL Server e Datadog Agent ficarem prontos (probes com backoff)
+    if wait_ready(lambda: pyodbc.connect(CONN_STRING), "SQL Server"):
+        report_first_operation()
+        main()
@@ -38,6 +38,9 @@ ALTER ROLE db_datawriter ADD MEMBER app_user;
 -- Permissão para executar stored procedures (se houver no futuro)
 GRANT EXECUTE TO app_user;
 
+-- Permissão para capturar planos estimados (SHOWPLAN_XML, plan_monitor.py)
+GRANT SHOWPLAN TO app_user;
+
 PRINT '✓ Permissões concedidas para app_user (read/write)';
 GO
 
@@ -220,3 +220,68 @@ PRINT 'Total de clientes: ' + CAST(@CustomerCount AS VARCHAR);
 PRINT 'Total de propostas: ' + CAST(@ProposalCount AS VARCHAR);
 PRINT 'Total de análises: ' + CAST(@AnalysisCount AS VARCHAR);
 GO
+
+-- ── Escrita de propostas por stored procedure (WRITE_MODE=procedure / tvp) ──
+-- Proposta + auditoria em uma chamada e uma transação; SCOPE_IDENTITY / OUTPUT
+-- no lugar de @@IDENTITY (que pegaria a identity de um trigger)
+IF OBJECT_ID('dbo.usp_CreateProposalBatch', 'P') IS NOT NULL DROP PROCEDURE dbo.usp_CreateProposalBatch;
+IF TYPE_ID('dbo.ProposalInput') IS NOT NULL DROP TYPE dbo.ProposalInput;
+CREATE TYPE dbo.ProposalInput AS TABLE (
+    CustomerID INT NOT NULL,
+    RequestedAmount DECIMAL(12,2) NOT NULL,
+    ProposalType VARCHAR(50),
+    InterestRate DECIMAL(5,2),
+    InstallmentCount INT NOT NULL
+);
+GO
+
+CREATE OR ALTER PROCEDURE dbo.usp_CreateProposal
+    @CustomerID INT,
+    @RequestedAmount DECIMAL(12,2),
+    @ProposalType VARCHAR(50),
+    @InterestRate DECIMAL(5,2),
+    @InstallmentCount INT,
+    @UserService VARCHAR(100)
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @ProposalID INT;
+
+    BEGIN TRANSACTION;
+    INSERT INTO CreditProposals (CustomerID, RequestedAmount, Status, ProposalType, InterestRate, InstallmentCount)
+    VALUES (@CustomerID, @RequestedAmount, 'PENDING', @ProposalType, @InterestRate, @InstallmentCount);
+    SET @ProposalID = SCOPE_IDENTITY();
+
+    INSERT INTO AuditLog (EntityType, EntityID, Action, UserService)
+    VALUES ('PROPOSAL', @ProposalID, 'CREATE', @UserService);
+    COMMIT;
+
+    SELECT @ProposalID AS ProposalID;
+END
+GO
+
+-- Variante set-based: N propostas por table-valued parameter
+CREATE OR ALTER PROCEDURE dbo.usp_CreateProposalBatch
+    @Proposals dbo.ProposalInput READONLY,
+    @UserService VARCHAR(100)
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @Created TABLE (ProposalID INT PRIMARY KEY);
+
+    BEGIN TRANSACTION;
+    INSERT INTO CreditProposals (CustomerID, RequestedAmount, Status, ProposalType, InterestRate, InstallmentCount)
+    OUTPUT inserted.ProposalID INTO @Created (ProposalID)
+    SELECT CustomerID, RequestedAmount, 'PENDING', ProposalType, InterestRate, InstallmentCount
+    FROM @Proposals;
+
+    INSERT INTO AuditLog (EntityType, EntityID, Action, UserService)
+    SELECT 'PROPOSAL', ProposalID, 'CREATE', @UserService
+    FROM @Created;
+    COMMIT;
+
+    SELECT ProposalID FROM @Created ORDER BY ProposalID;
+END
+GO
@@ -0,0 +1,89 @@
+"""Funções puras usadas pelo simulador SQL Server (sem banco)."""
+
+import pytest
+
+from retry_policy import classify, DEADLOCK, LOCK_TIMEOUT, SERIALIZATION, CONNECTION, LOGIC
+from query_fingerprint import normalize, text_fingerprint
+from incident_engine import parse_schedule
+from fake_db import shape, FAKE_DB_ROWS
+
+_ODBC = "[Microsoft][ODBC Driver 18 for SQL Server]"
+
+
+class Error(Exception):
+    """Erro no formato do pyodbc: args = (SQLSTATE, mensagem com o código nativo)."""
+
+
+class OperationalError(Error):
+    pass
+
+
+# ── retry_policy.classify ─────────────────────────────────────
+@pytest.mark.parametrize("sqlstate, message, expected", [
+    ("40001", f"[40001] {_ODBC}[SQL Server]Transaction (Process ID 57) was deadlocked on lock resources "
+              "with another process and has been chosen as the deadlock victim. (1205) (SQLExecDirectW)", DEADLOCK),
+    ("HY000", f"[HY000] {_ODBC}[SQL Server]Lock request time out period exceeded. (1222) (SQLExecDirectW)",
+     LOCK_TIMEOUT),
+    ("HYT00", f"[HYT00] {_ODBC}Query timeout expired (0) (SQLExecDirectW)", LOCK_TIMEOUT),
+    ("42000", f"[42000] {_ODBC}[SQL Server]Snapshot isolation transaction aborted due to update conflict. "
+              "(3960) (SQLExecDirectW)", SERIALIZATION),
+    ("08S01", f"[08S01] {_ODBC}TCP Provider: An existing connection was forcibly closed by the remote host. "
+              "(10054) (SQLExecDirectW)", CONNECTION),
+    ("08001", f"[08001] {_ODBC}Login timeout expired (0) (SQLDriverConnect)", CONNECTION),
+    ("23000", f"[23000] {_ODBC}[SQL Server]Violation of PRIMARY KEY constraint 'PK_Customers'. "
+              "(2627) (SQLExecDirectW)", LOGIC),
+])
+def test_classify_pyodbc(sqlstate, message, expected):
+    assert classify(Error(sqlstate, message)) == expected
+
+
+def test_classify_without_sqlstate():
+    assert classify(OperationalError("connection lost")) == CONNECTION
+    assert classify(KeyError("ProposalID")) == LOGIC
+
+
+# ── query_fingerprint.normalize ───────────────────────────────
+def test_normalize_sp_executesql_and_named_params():
+    sql = "(@P1 nvarchar(9),@P2 int)SELECT TOP 50 ProposalID FROM CreditProposals WHERE Status = @P1 AND Amount > @P2"
+    assert normalize(sql) == "select top ? proposalid from creditproposals where status=? and amount>?"
+
+
+def test_normalize_unicode_literals_and_comments():
+    sql = "/*ddps='credit-product'*/ SELECT * FROM Customers WHERE Name = N'José' AND Score >= -10.5 -- fim"
+    assert normalize(sql) == "select * from customers where name=? and score>=?"
+
+
+def test_normalize_client_and_server_texts_match():
+    # O mesmo statement enviado pelo pyodbc (?) e visto em dm_exec_sql_text (@P1, IN expandido)
+    client = "UPDATE Inventory SET Quantity = Quantity - ? WHERE ProductID IN (?, ?, ?)"
+    server = "(@P1 int,@P2 int,@P3 int,@P4 int)UPDATE Inventory SET Quantity = Quantity - @P1 WHERE ProductID IN (@P2,@P3,@P4)"
+    assert normalize(client) == normalize(server)
+    assert text_fingerprint(client) == text_fingerprint(server)
+
+
+# ── incident_engine.parse_schedule ────────────────────────────
+def test_parse_schedule_defaults_and_order():
+    assert parse_schedule("120:full_scan:60:2,5:blocking") == [
+        (5.0, "blocking", 60.0, 1),
+        (120.0, "full_scan", 60.0, 2),
+    ]
+
+
+def test_parse_schedule_skips_bad_entries():
+    scenarios = {"full_scan", "slow_query"}
+    spec = "60:seq_scan:30, 90:full_scan:x, :slow_query, 30:slow_query:15:3"
+    assert parse_schedule(spec, scenarios) == [(30.0, "slow_query", 15.0, 3)]
+
+
+# ── fake_db.shape ─────────────────────────────────────────────
+def test_shape_top_and_exec():
+    assert shape("SELECT TOP 50 a, b, c FROM t ORDER BY a") == (3, 50)
+    assert shape("SELECT TOP (100) a FROM t") == (1, 100)
+    assert shape("EXEC sp_ApproveProposal ?") == (1, 1)
+
+
+def test_shape_batches_and_dml():
+    # Primeiro statement que devolve linhas; ';' dentro de literal não separa
+    assert shape("SET NOCOUNT ON; SELECT a, b FROM t WHERE c = 'x;y'") == (2, FAKE_DB_ROWS)
+    assert shape("UPDATE t SET a = 1") is None
+    assert shape("SELECT COUNT(*) FROM t") == (1, 1)